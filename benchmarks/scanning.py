@@ -0,0 +1,274 @@
+"""
+Benchmarks of the filesystem scanning and version handling paths, run against synthetic /usr/src, /lib/modules and /boot
+trees holding hundreds to thousands of kernel versions.
+
+Besides the time, the calls to os functions and the directory entries they read are counted. Those counts do not
+depend on the machine, so the growth exponent they show from a size to the next is checked against baseline.json to
+catch a path becoming quadratic.
+
+Run with: python -m benchmarks.scanning [--sizes 100 400 1600] [--check]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from math import log
+from tempfile import mkdtemp
+
+import kernelupdater
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = [100, 400, 1600]
+COUNTED_FUNCTIONS = ["listdir", "scandir", "stat", "lstat", "remove", "unlink", "rmdir", "open", "readlink"]
+BOOT_FILE_PREFIXES = ["config-", "System.map-", "vmlinuz-", "initramfs-genkernel-x86_64-"]
+STRAY_KERNEL_ROOT_FILES = ["README", "lost+found", ".keep"]
+STRAY_BOOT_FILES = ["grub", "lost+found", "memtest86+.bin", "EFI", ".keep"]
+
+
+def get_release(index):
+    """
+    Release of the index-th synthetic kernel, mixing revisions: 4.0.0-gentoo, 4.0.0-gentoo-r1, 4.0.0-gentoo-r2,
+    4.0.1-gentoo...
+    """
+    minor, patch, revision = index // 30, (index % 30) // 3, index % 3
+    return "4." + str(minor) + "." + str(patch) + "-gentoo" + ("-r" + str(revision) if revision else "")
+
+
+class SyntheticTrees(object):
+    """
+    /usr/src, /lib/modules and /boot like trees with nb_versions kernels and a few stray files, the newest kernel
+    being selected.
+    """
+
+    def __init__(self, nb_versions):
+        self.root_dir = mkdtemp(prefix="kernel-updater-bench-")
+        self.kernel_root_dir = self.root_dir + "/src"
+        self.modules_root_dir = self.root_dir + "/modules"
+        self.grub_root_dir = self.root_dir + "/boot"
+        for a_dir in [self.kernel_root_dir, self.modules_root_dir, self.grub_root_dir]:
+            os.mkdir(a_dir)
+
+        for index in range(nb_versions):
+            release = get_release(index)
+            kernel_dir = self.kernel_root_dir + "/linux-" + release
+            os.makedirs(kernel_dir + "/arch/x86/boot")
+            touch(kernel_dir + "/Makefile")
+            touch(kernel_dir + "/arch/x86/boot/bzImage")
+            if index % 2 == 0:
+                touch(kernel_dir + "/.config")
+            os.makedirs(self.modules_root_dir + "/" + release + "/kernel")
+            touch(self.modules_root_dir + "/" + release + "/modules.dep")
+            for prefix in BOOT_FILE_PREFIXES:
+                touch(self.grub_root_dir + "/" + prefix + release)
+                if prefix != "initramfs-genkernel-x86_64-":
+                    touch(self.grub_root_dir + "/" + prefix + release + ".old")
+
+        for stray_file in STRAY_KERNEL_ROOT_FILES:
+            touch(self.kernel_root_dir + "/" + stray_file)
+        for stray_file in STRAY_BOOT_FILES:
+            touch(self.grub_root_dir + "/" + stray_file)
+        os.symlink(self.kernel_root_dir + "/linux-" + get_release(nb_versions - 1), self.kernel_root_dir + "/linux")
+
+    def create_kernel_updater(self):
+        selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
+        return kernelupdater.KernelUpdater(config_file=None, a_selected_kernel=selected_kernel,
+                                           a_command_runner=NullCommandRunner(),
+                                           kernel_root_dir=self.kernel_root_dir,
+                                           modules_root_dir=self.modules_root_dir,
+                                           grub_root_dir=self.grub_root_dir)
+
+    def create_config_to_copy_chooser(self):
+        selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
+        return kernelupdater.ConfigToCopyChooser(selected_kernel=selected_kernel, kernel_root_dir=self.kernel_root_dir)
+
+    def remove(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+
+class NullCommandRunner(kernelupdater.CommandRunner):
+    def __init__(self):
+        kernelupdater.CommandRunner.__init__(self)
+
+    def run_command(self, command_array, comment="", env=None):
+        pass
+
+
+class SyscallCounter(object):
+    """
+    Counts the calls to the os functions touching the filesystem, and the directory entries listed, while active.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.entries = 0
+        self.originals = {}
+
+    def __enter__(self):
+        for name in COUNTED_FUNCTIONS:
+            self.originals[name] = getattr(os, name)
+            setattr(os, name, self.wrap(name, self.originals[name]))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, function in self.originals.items():
+            setattr(os, name, function)
+
+    def wrap(self, name, function):
+        counter = self
+
+        def counted(*args, **kwargs):
+            counter.calls += 1
+            result = function(*args, **kwargs)
+            if name == "listdir":
+                counter.entries += len(result)
+            elif name == "scandir":
+                return CountedScandir(result, counter)
+            return result
+        return counted
+
+
+class CountedScandir(object):
+    def __init__(self, iterator, counter):
+        self.iterator = iterator
+        self.counter = counter
+
+    def __iter__(self):
+        for entry in self.iterator:
+            self.counter.entries += 1
+            yield entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if hasattr(self.iterator, "close"):
+            self.iterator.close()
+
+
+def bench_get_old_kernels_to_clean(trees):
+    trees.create_kernel_updater().get_old_kernels_to_clean()
+
+
+def bench_find_config_files(trees):
+    trees.create_config_to_copy_chooser().find_config_files()
+
+
+def bench_clean_old_kernels(trees):
+    kernel_updater = trees.create_kernel_updater()
+    kernel_updater.clean_old_kernels(kernel_updater.get_old_kernels_to_clean())
+    kernel_updater.purge_old_trees()
+
+
+BENCHMARKS = [
+    ("get_old_kernels_to_clean", bench_get_old_kernels_to_clean),
+    ("find_config_files", bench_find_config_files),
+    ("clean_old_kernels", bench_clean_old_kernels),
+]
+
+
+def run_benchmarks(sizes, quiet=True):
+    results = []
+    for name, benchmark in BENCHMARKS:
+        for size in sizes:
+            trees = SyntheticTrees(size)
+            try:
+                stdout = sys.stdout
+                if quiet:
+                    sys.stdout = open(os.devnull, "w")
+                try:
+                    with SyscallCounter() as counter:
+                        start_time = time.perf_counter()
+                        benchmark(trees)
+                        seconds = time.perf_counter() - start_time
+                finally:
+                    if quiet:
+                        sys.stdout.close()
+                        sys.stdout = stdout
+            finally:
+                trees.remove()
+            results.append({"name": name, "size": size, "seconds": seconds, "calls": counter.calls,
+                            "entries": counter.entries})
+    return results
+
+
+def get_growth_exponents(results):
+    """
+    For each benchmark and counted metric, the largest exponent e such that metric grows like size^e from one size to
+    the next: 1 for a linear path, 2 for a quadratic one.
+    """
+    exponents = {}
+    by_name = {}
+    for result in results:
+        by_name.setdefault(result["name"], []).append(result)
+    for name, name_results in by_name.items():
+        name_results.sort(key=lambda result: result["size"])
+        for metric in ["calls", "entries", "seconds"]:
+            exponent = 0.0
+            for smaller, larger in zip(name_results, name_results[1:]):
+                if smaller[metric] > 0 and larger[metric] > 0:
+                    exponent = max(exponent, log(float(larger[metric]) / smaller[metric])
+                                   / log(float(larger["size"]) / smaller["size"]))
+            exponents[name + "." + metric] = exponent
+    return exponents
+
+
+def check_against_baseline(exponents, baseline):
+    """
+    Returns the regressions: the counted metrics growing faster than the baseline allows. Times are reported only,
+    being too noisy to be checked.
+    """
+    regressions = []
+    for key, maximum in sorted(baseline["max_growth_exponents"].items()):
+        if exponents.get(key, 0.0) > maximum:
+            regressions.append(key + " grows with exponent %.2f, more than %.2f" % (exponents[key], maximum))
+    return regressions
+
+
+def load_baseline(baseline_file=BASELINE_FILE):
+    with open(baseline_file) as a_file:
+        return json.load(a_file)
+
+
+def print_results(results, exponents):
+    print("%-26s %7s %10s %10s %10s" % ("benchmark", "size", "seconds", "calls", "entries"))
+    for result in results:
+        print("%-26s %7d %10.4f %10d %10d" % (result["name"], result["size"], result["seconds"], result["calls"],
+                                             result["entries"]))
+    print("")
+    print("growth exponents (1 = linear, 2 = quadratic):")
+    for key in sorted(exponents):
+        print("  %-36s %.2f" % (key, exponents[key]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the kernel-updater filesystem scanning paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Numbers of kernel versions of the synthetic trees")
+    parser.add_argument("--check", help="Fail when a path grows faster than " + BASELINE_FILE + " allows",
+                        action="store_true")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes)
+    exponents = get_growth_exponents(results)
+    print_results(results, exponents)
+    if args.check:
+        regressions = check_against_baseline(exponents, load_baseline())
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            exit(1)
+
+
+def touch(fname):
+    with open(fname, 'a'):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,52 @@
 import os
+import hashlib
+import sys
+import time
 import shutil
-import multiprocessing
-from subprocess import call
-from operator import itemgetter
-from re import sub
+import threading
+from collections import deque
+from subprocess import Popen, PIPE, DEVNULL
+
+from kernelupdater.bootindex import BootIndex
+from kernelupdater.deletion import TreeDeleter
+from kernelupdater.grub import MkconfigBackend
+from kernelupdater.initramfs import GenkernelInitramfs
+from kernelupdater.inventory import KernelInventory
+from kernelupdater.jobs import JobsPlanner
+from kernelupdater.journal import get_file_hash, get_file_stamp, get_tool_versions
+from kernelupdater.kconfig import ConfigDiff, ConfigDiffCache, get_config_version, get_version_key, \
+    get_loaded_modules_hash, read_config
+from kernelupdater.modules import ModuleRebuilder
+from kernelupdater.plan import Plan, PlannedRemoval, PlannedStep, get_tree_size
+from kernelupdater.profiling import BLOCK_SIZE
+from kernelupdater.retention import RetentionPolicy
+from kernelupdater.scheduler import StepScheduler
+from kernelupdater.version import KernelVersion
 
 
 KERNEL_ROOT_DIR = "/usr/src"
 MODULES_ROOT_DIR = "/lib/modules"
 GRUB_ROOT_DIR = "/boot"
+BUILD_ROOT_DIR = "/var/cache/kernel-updater/build"
+# outputs of a kernel build, whatever the architecture
+BUILT_FILES = ["vmlinux", "System.map", "modules.order"]
 
 
 class SelectedKernel(object):
     """
-    Represents the selected kernel, that is the one /usr/src/linux symbolic link points to
+    Represents the selected kernel, that is the one /usr/src/linux symbolic link points to, or the one of kernel_dir
+    when given, to build a kernel before it is selected.
     """
 
-    def __init__(self, kernel_root_dir=KERNEL_ROOT_DIR):
-        self.link_folder = kernel_root_dir + "/linux"
-        if not os.path.exists(self.link_folder):
-            exit(1)  # Error no symlink available for kernel - aborting
-
-        self.selected_kernel = os.readlink(self.link_folder)
+    def __init__(self, kernel_root_dir=KERNEL_ROOT_DIR, kernel_dir=None):
+        if kernel_dir is not None:
+            self.link_folder = kernel_dir
+            self.selected_kernel = kernel_dir
+        else:
+            self.link_folder = kernel_root_dir + "/linux"
+            if not os.path.exists(self.link_folder):
+                exit(1)  # Error no symlink available for kernel - aborting
+            self.selected_kernel = os.readlink(self.link_folder)
         if self.selected_kernel.startswith('/'):
             self.selected_kernel_dir = self.selected_kernel
             self.selected_kernel = self.selected_kernel[self.selected_kernel.rfind('/')+1:]
@@ -29,6 +54,15 @@ class SelectedKernel(object):
             self.selected_kernel_dir = kernel_root_dir + '/' + self.selected_kernel
         print("Selected kernel is: " + self.selected_kernel + " in dir " + self.selected_kernel_dir)
 
+    def get_version(self):
+        return KernelVersion.parse(self.selected_kernel)
+
+    def get_release(self):
+        return self.get_version().release
+
+    def get_series(self):
+        return self.get_version().get_series()
+
 
 class KernelUpdater(object):
     """
@@ -38,122 +72,567 @@ class KernelUpdater(object):
     """
 
     def __init__(self, config_file, a_selected_kernel, a_command_runner, kernel_root_dir=KERNEL_ROOT_DIR,
-                 modules_root_dir=MODULES_ROOT_DIR, grub_root_dir=GRUB_ROOT_DIR):
+                 modules_root_dir=MODULES_ROOT_DIR, grub_root_dir=GRUB_ROOT_DIR, jobs_plan=None, build_cache=None,
+                 build_root_dir=None, profiler=None, tree_deleter=None, purge_in_background=False, journal=None,
+                 initramfs_backend=None, archiver=None, bundle_publisher=None, bundle_installer=None,
+                 config_target="olddefconfig", config_diff_cache=None, retention_policy=None,
+                 grub_backend=None, module_rebuilder=None):
         self.config_file = config_file
         self.selected_kernel = a_selected_kernel
         self.command_runner = a_command_runner
         self.kernel_root_dir = kernel_root_dir
         self.modules_root_dir = modules_root_dir
         self.grub_root_dir = grub_root_dir
+        self.jobs_plan = jobs_plan
+        self.build_cache = build_cache
+        self.build_root_dir = build_root_dir
+        self.profiler = profiler
+        self.tree_deleter = tree_deleter if tree_deleter is not None else TreeDeleter()
+        self.purge_in_background = purge_in_background
+        self.journal = journal
+        self.initramfs_backend = initramfs_backend if initramfs_backend is not None else GenkernelInitramfs()
+        self.archiver = archiver
+        self.bundle_publisher = bundle_publisher
+        self.bundle_installer = bundle_installer
+        self.config_target = config_target
+        self.config_diff_cache = config_diff_cache
+        self.retention_policy = retention_policy if retention_policy is not None else RetentionPolicy()
+        self.grub_backend = grub_backend if grub_backend is not None else MkconfigBackend()
+        self.module_rebuilder = module_rebuilder if module_rebuilder is not None else ModuleRebuilder()
+        self.inventory = None
+        # the cache statistics are zeroed by the build, they describe an older one when it is skipped
+        self.kernel_built = False
+        # planning only, the fingerprints do not fetch anything
+        self.dry_run = False
+        self.inventory_lock = threading.Lock()
+        # emerge runs of different steps would compete for the portage lock if run at the same time
+        self.emerge_lock = threading.Lock()
+
+    def update_kernel(self, serial=False, resume=False, force=False):
+        self.create_step_scheduler().run(serial=serial, resume=resume, skip_up_to_date=not force)
+
+        if self.build_cache is not None and self.kernel_built:
+            self.print_cache_statistics()
+        print("You can safely reboot now! Thanks for using kernel-updater.py")
 
-    def update_kernel(self):
-        self.copy_config_file()
-        self.build_kernel()
-        self.install_kernel()
-        self.generate_initramfs()
-        self.rebuild_drivers()
+    def prebuild_kernel(self, serial=False):
+        """
+        Configures and builds the kernel without installing it, the run installing it once it is selected finding the
+        build up to date in the journal.
+        """
+        self.create_prebuild_scheduler().run(serial=serial, skip_up_to_date=True)
+        print(self.selected_kernel.get_release() + " is built, it is installed once selected")
+
+    def create_prebuild_scheduler(self):
+        scheduler = self.create_empty_scheduler()
+        scheduler.add_step("copy_config_file", self.copy_config_file, fingerprint=self.fingerprint_config)
+        scheduler.add_step("reconcile_config", self.reconcile_config, ["copy_config_file"],
+                           fingerprint=self.fingerprint_reconcile)
+        scheduler.add_step("build_kernel", self.build_kernel, ["reconcile_config"], fingerprint=self.fingerprint_build)
+        return scheduler
+
+    def print_cache_statistics(self):
+        try:
+            statistics = self.build_cache.get_statistics()
+        except CommandFailedError as error:
+            print("Warning: no ccache statistics, " + str(error))
+            return
+        if statistics is not None:
+            print(statistics.describe())
+
+    def create_step_scheduler(self):
+        if self.bundle_installer is not None:
+            return self.create_deploy_scheduler()
+        scheduler = self.create_prebuild_scheduler()
+        scheduler.add_step("install_kernel", self.install_kernel, ["build_kernel"],
+                           fingerprint=self.fingerprint_install)
+        if self.bundle_publisher is not None:
+            # make install in the staging root after the local one, two makes in a build tree would race
+            scheduler.add_step("publish_bundle", self.publish_bundle, ["install_kernel"])
+        # the chosen config may come from a tree about to be cleaned, so cleaning only waits for the copy
+        self.add_post_install_steps(scheduler, ["install_kernel"], ["copy_config_file"])
+        return scheduler
+
+    def create_deploy_scheduler(self):
+        """
+        Steps of a host installing the kernel bundle published by the builder instead of building it.
+        """
+        scheduler = self.create_empty_scheduler()
+        scheduler.add_step("install_bundle", self.install_bundle, fingerprint=self.fingerprint_bundle)
+        scheduler.add_step("prepare_modules", self.prepare_modules, ["install_bundle"])
+        self.add_post_install_steps(scheduler, ["prepare_modules"], [])
+        return scheduler
+
+    def create_empty_scheduler(self):
+        journal_inputs = self.get_journal_inputs() if self.journal is not None else None
+        return StepScheduler(profiler=self.profiler, journal=self.journal, journal_inputs=journal_inputs)
+
+    def add_post_install_steps(self, scheduler, drivers_dependencies, clean_dependencies):
+        scheduler.add_step("rebuild_drivers", self.rebuild_drivers, drivers_dependencies,
+                           fingerprint=self.fingerprint_drivers)
+        # emerge and depmod write the modules directory the initramfs is made from
+        scheduler.add_step("generate_initramfs", self.generate_initramfs, ["rebuild_drivers"],
+                           fingerprint=self.fingerprint_initramfs)
+        scheduler.add_step("clean_old_kernels", self.clean_old_kernels_step, clean_dependencies)
+        scheduler.add_step("update_grub", self.update_grub,
+                           ["generate_initramfs", "rebuild_drivers", "clean_old_kernels"],
+                           fingerprint=self.fingerprint_grub)
+        if self.purge_in_background:
+            scheduler.add_step("purge_old_trees", self.purge_old_trees, ["update_grub"])
+        else:
+            scheduler.add_step("purge_old_trees", self.purge_old_trees, ["clean_old_kernels"])
 
-        old_kernel_versions_to_clean = self.get_old_kernels_to_clean()
+    def clean_old_kernels_step(self):
+        retention_report = self.get_retention_report()
+        print(retention_report.describe())
+        old_kernel_versions_to_clean = retention_report.to_remove
         self.clean_old_kernels(old_kernel_versions_to_clean)
-
-        self.update_grub()
-
-        print("You can safely reboot now! Thanks for using kernel-updater.py")
+        if self.build_root_dir is not None:
+            self.clean_old_build_dirs(old_kernel_versions_to_clean)
+
+    def get_journal_inputs(self):
+        """
+        What the steps ran against: a step completed with other inputs has to be run again.
+        """
+        return {"kernel": self.selected_kernel.get_release(), "config_sha256": get_file_hash(self.config_file),
+                "build_dir": self.get_build_dir(), "tools": get_tool_versions()}
+
+    def get_build_output_dir(self):
+        build_dir = self.get_build_dir()
+        return build_dir if build_dir is not None else self.selected_kernel.selected_kernel_dir
+
+    def fingerprint_config(self):
+        # the copy is changed by the reconciliation, whose fingerprint tells whether it is still the result
+        return {"chosen": get_file_hash(self.config_file), "copied": os.path.exists(self.get_config_path())}
+
+    def fingerprint_reconcile(self):
+        return {"chosen": get_file_hash(self.config_file), "target": self.config_target,
+                "reconciled": get_file_hash(self.get_config_path())}
+
+    def fingerprint_build(self):
+        build_output_dir = self.get_build_output_dir()
+        return {"config": get_file_hash(self.get_config_path()),
+                "built": [get_file_stamp(build_output_dir + "/" + built_file) for built_file in BUILT_FILES]}
+
+    def fingerprint_install(self):
+        release = self.selected_kernel.get_release()
+        return {"built": self.fingerprint_build()["built"],
+                "installed": [get_file_stamp(artifact.path) for artifact in self.get_boot_artifacts(release, "kernel")],
+                "modules": get_file_stamp(self.modules_root_dir + "/" + release + "/modules.dep")}
+
+    def fingerprint_bundle(self):
+        release = self.selected_kernel.get_release()
+        if self.dry_run:
+            manifest = self.bundle_installer.get_downloaded_manifest(release)
+        else:
+            manifest = self.bundle_installer.get_manifest(release)
+        return {"bundle": manifest["bundle_sha256"] if manifest is not None else None,
+                "installed": [get_file_stamp(artifact.path) for artifact in self.get_boot_artifacts(release, "kernel")],
+                "modules": get_file_stamp(self.modules_root_dir + "/" + release + "/modules.dep")}
+
+    def fingerprint_initramfs(self):
+        release = self.selected_kernel.get_release()
+        return {"installed": [get_file_stamp(artifact.path) for artifact in self.get_boot_artifacts(release, "kernel")],
+                "backend": self.initramfs_backend.get_fingerprint(),
+                "modules": get_file_stamp(self.modules_root_dir + "/" + release + "/modules.dep"),
+                "initramfs": [get_file_stamp(artifact.path)
+                              for artifact in self.get_boot_artifacts(release, "initramfs")]}
+
+    def fingerprint_drivers(self):
+        return {"modules": get_file_stamp(self.modules_root_dir + "/" + self.selected_kernel.get_release()
+                                          + "/modules.dep")}
+
+    def fingerprint_grub(self):
+        boot_index = BootIndex(self.grub_root_dir)
+        return {"boot_files": sorted(artifact.name for release in boot_index.artifacts_by_release
+                                     for artifact in boot_index.get_artifacts(release)
+                                     if artifact.kind in ("kernel", "initramfs")),
+                "grub_cfg": get_file_stamp(self.grub_root_dir + "/grub/grub.cfg")}
+
+    def get_boot_artifacts(self, release, kind):
+        """
+        Boot files of release, read from /boot as it is now and not from the inventory scanned at the start.
+        """
+        return sorted((artifact for artifact in BootIndex(self.grub_root_dir).get_artifacts(release)
+                       if artifact.kind == kind), key=lambda artifact: artifact.name)
+
+    def get_inventory(self):
+        """
+        The kernels installed, scanned once for all the steps.
+        """
+        with self.inventory_lock:
+            if self.inventory is None:
+                self.inventory = KernelInventory(self.kernel_root_dir, self.modules_root_dir, self.grub_root_dir)
+            return self.inventory
+
+    def get_build_dir(self):
+        """
+        Out-of-tree build directory of the selected kernel, shared by all the releases of a series so that a patch
+        level upgrade only rebuilds what changed. None when building inside the source tree.
+        """
+        if self.build_root_dir is None:
+            return None
+        return self.build_root_dir + "/" + self.selected_kernel.get_series()
+
+    def get_config_path(self):
+        build_dir = self.get_build_dir()
+        return (build_dir if build_dir is not None else self.selected_kernel.link_folder) + "/.config"
 
     def copy_config_file(self):
-        print("Copying " + self.config_file + " to " + self.selected_kernel.link_folder + "/.config")
-        shutil.copyfile(self.config_file, self.selected_kernel.link_folder + "/.config")
+        config_path = self.get_config_path()
+        if not os.path.exists(os.path.dirname(config_path)):
+            os.makedirs(os.path.dirname(config_path))
+        if os.path.exists(config_path) and os.path.samefile(self.config_file, config_path):
+            print("Keeping " + config_path + " of the previous build of the series")
+            return
+        print("Copying " + self.config_file + " to " + config_path)
+        shutil.copyfile(self.config_file, config_path)
+
+    def reconcile_config(self):
+        """
+        Sets the symbols of the new sources missing from the copied config without asking, olddefconfig giving them
+        their default value, localmodconfig also disabling the modules not loaded on this host.
+        """
+        config_path = self.get_config_path()
+        config_version = get_config_version(self.config_file)
+        cache_key = None
+        if self.config_diff_cache is not None:
+            config_hash = get_file_hash(config_path)
+            if self.config_target == "localmodconfig":
+                config_hash = hashlib.sha256((config_hash + get_loaded_modules_hash()).encode("utf-8")).hexdigest()
+            cache_key = ConfigDiffCache.get_key(config_version.release if config_version is not None else None,
+                                                self.selected_kernel.get_release(), config_hash, self.config_target)
+            cached = self.config_diff_cache.get(cache_key)
+            if cached is not None:
+                config_diff, cached_config_file = cached
+                print("Reusing the " + self.config_target + " result of " + cached_config_file)
+                shutil.copyfile(cached_config_file, config_path)
+                print(config_diff.describe())
+                return
+
+        options_before = read_config(config_path)
+        reconcile_command = self.get_make_command([self.config_target])
+        self.command_runner.run_command(reconcile_command, env=self.get_make_env())
+        config_diff = ConfigDiff.compute(options_before, read_config(config_path))
+        print(config_diff.describe())
+        if cache_key is not None:
+            self.config_diff_cache.put(cache_key, config_diff, config_path)
 
     def build_kernel(self):
-        nb_cpus = multiprocessing.cpu_count()
-        build_command = ["make", "-j" + str(nb_cpus + 1), "-C", self.selected_kernel.selected_kernel_dir]
-        self.command_runner.run_command(build_command)
+        build_command = self.get_build_command()
+        print(self.jobs_plan.describe())
+        if self.build_cache is not None:
+            self.build_cache.prepare()
+        self.command_runner.run_command(build_command, env=self.get_make_env())
+        self.kernel_built = True
+
+    def get_build_command(self):
+        if self.jobs_plan is None:
+            self.jobs_plan = JobsPlanner().plan()
+        return self.get_make_command(self.jobs_plan.make_options())
 
     def install_kernel(self):
-        install_command = ["make", "-C", self.selected_kernel.selected_kernel_dir, "install"]
-        self.command_runner.run_command(install_command)
-        self.command_runner.run_command(install_command, "to get .old files created")
-
-        modules_install_command = ["make", "-C", self.selected_kernel.selected_kernel_dir, "modules_install"]
-        self.command_runner.run_command(modules_install_command)
+        install_command = self.get_make_command(["install"])
+        self.command_runner.run_command(install_command, env=self.get_make_env())
+        self.copy_old_boot_artifacts()
+
+        modules_install_command = self.get_make_command(["modules_install"])
+        self.command_runner.run_command(modules_install_command, env=self.get_make_env())
+
+    def copy_old_boot_artifacts(self):
+        # a second make install used to create the .old files, copying is enough and does not go through kbuild
+        for artifact in BootIndex(self.grub_root_dir).get_artifacts(self.selected_kernel.get_release()):
+            if not artifact.old and artifact.kind in ("kernel", "System.map", "config"):
+                shutil.copy2(artifact.path, artifact.path + ".old")
+
+    def publish_bundle(self):
+        release = self.selected_kernel.get_release()
+        staging_dir = self.bundle_publisher.create_staging_dir(release)
+        for publish_command in self.get_publish_commands(staging_dir):
+            self.command_runner.run_command(publish_command, env=self.get_make_env())
+        build_output_dir = self.get_build_output_dir()
+        self.bundle_publisher.publish(release, staging_dir, {"config": build_output_dir + "/.config",
+                                                             "Module.symvers": build_output_dir + "/Module.symvers"})
+
+    def get_publish_commands(self, staging_dir):
+        return [self.get_make_command(["INSTALL_PATH=" + staging_dir + "/boot", "install"]),
+                self.get_make_command(["INSTALL_MOD_PATH=" + staging_dir, "modules_install"])]
+
+    def install_bundle(self):
+        self.bundle_installer.install(self.selected_kernel.get_release(), self.grub_root_dir, self.modules_root_dir,
+                                      self.selected_kernel.selected_kernel_dir)
+        self.copy_old_boot_artifacts()
+
+    def prepare_modules(self):
+        """
+        Prepares the source tree with the config of the bundle, for the external modules to be built against it.
+        """
+        self.command_runner.run_command(self.get_prepare_modules_command())
+
+    def get_prepare_modules_command(self):
+        return ["make", "-C", self.selected_kernel.selected_kernel_dir, "modules_prepare"]
+
+    def get_make_command(self, arguments):
+        make_command = ["make"]
+        if self.build_cache is not None:
+            make_command += self.build_cache.make_variables()
+        build_dir = self.get_build_dir()
+        if build_dir is None:
+            return make_command + ["-C", self.selected_kernel.selected_kernel_dir] + arguments
+        # going through the /usr/src/linux link keeps the compiler command lines identical from a release to the next,
+        # so that kbuild only rebuilds the objects whose sources were patched
+        return make_command + ["-C", self.selected_kernel.link_folder, "O=" + build_dir] + arguments
+
+    def get_make_env(self):
+        return self.build_cache.env() if self.build_cache is not None else None
 
     def generate_initramfs(self):
-        initramfs_generation_command = ["genkernel", "initramfs"]
-        self.command_runner.run_command(initramfs_generation_command)
+        self.initramfs_backend.generate(self.command_runner, self.selected_kernel.get_release(), self.modules_root_dir,
+                                        self.grub_root_dir)
 
     def rebuild_drivers(self):
-        merge_back_modules_command = ["emerge", "-1q", "@x11-module-rebuild", "@module-rebuild"]
-        self.command_runner.run_command(merge_back_modules_command)
+        with self.emerge_lock:
+            self.module_rebuilder.rebuild(self.command_runner, self.modules_root_dir,
+                                          self.selected_kernel.get_release(), self.jobs_plan)
+
+    def get_rebuild_drivers_command(self):
+        packages, _ = self.module_rebuilder.get_packages_to_rebuild(self.modules_root_dir,
+                                                                    self.selected_kernel.get_release())
+        return self.module_rebuilder.get_command(packages, self.jobs_plan)
 
     def get_old_kernels_to_clean(self):
-        versions = []
-        dir_list = os.listdir(self.kernel_root_dir)
-        for kernel_dir in dir_list:
-            if "linux-" in kernel_dir:
-                versions.append(self.get_version_int_array_from_kernel_folder(kernel_dir))
-        selected_version = self.get_version_int_array_from_kernel_folder(self.selected_kernel.selected_kernel)
-        versions = sorted(versions, key=itemgetter(0, 1, 2, 3))
-        index_selected = versions.index(selected_version)
-        return [versions[i] for i in range(0, index_selected - 1)]
+        return self.get_retention_report().to_remove
+
+    def get_retention_report(self):
+        return self.retention_policy.select(self.get_inventory(), self.selected_kernel.get_version())
 
     def clean_old_kernels(self, old_kernel_versions_to_clean):
+        inventory = self.get_inventory()
         for version in old_kernel_versions_to_clean:
-            kernel_version_suffix = self.get_kernel_folder_suffix_from_version_int_array(version)
-            version_str = self.get_version_string_from_version_int_array(version)
-            print("cleaning up version " + version_str + "...")
-            self.command_runner.run_command(["emerge", "-C", "=gentoo-sources-" + version_str])
-            self.remove_tree(self.modules_root_dir + "/" + kernel_version_suffix)
-            self.remove_tree(self.kernel_root_dir + "/linux-" + kernel_version_suffix)
-            boot_versioned_files = os.listdir(self.grub_root_dir)
-            for boot_versioned_file in boot_versioned_files:
-                if kernel_version_suffix in boot_versioned_file:
-                    boot_versioned_path = self.grub_root_dir + "/" + boot_versioned_file
-                    print("Removing " + boot_versioned_path)
-                    os.remove(boot_versioned_path)
-
-    def update_grub(self):
-        grub_mkconfig_command = ["grub-mkconfig", "-o", self.grub_root_dir + "/grub/grub.cfg"]
-        self.command_runner.run_command(grub_mkconfig_command)
+            entry = inventory.get_entry(version)
+            print("cleaning up version " + version.release + "...")
+            if self.archiver is not None:
+                config_file = entry.source_dir + "/.config" if entry.source_dir is not None else None
+                self.archiver.archive(entry, config_file)
+            # retired first, emerge does not have to unlink the files of the tree one by one
+            if entry.modules_dir is not None:
+                self.remove_tree(entry.modules_dir)
+            if entry.source_dir is not None:
+                self.remove_tree(entry.source_dir)
+            if entry.source_dir is not None:
+                with self.emerge_lock:
+                    self.command_runner.run_command(self.get_uninstall_command(version))
+            for boot_artifact in entry.boot_artifacts:
+                print("Removing " + boot_artifact.path)
+                self.count_deleted_bytes(boot_artifact.get_size())
+                os.remove(boot_artifact.path)
+        if self.archiver is not None:
+            self.archiver.prune(self.retention_policy.select_archives(self.archiver.get_archived_versions()))
 
     @staticmethod
-    def get_version_int_array_from_kernel_folder(folder_name):
-        string_array = sub('.*linux-', '', folder_name).replace("-gentoo", "").replace("-r", ".").split(".")
-        int_array = [int(num_string) for num_string in string_array]
-        if len(int_array) == 3:
-            int_array.append(-1)
-        return int_array
+    def get_uninstall_command(version):
+        return ["emerge", "-C", version.get_package_atom()]
+
+    def clean_old_build_dirs(self, cleaned_versions):
+        for build_dir in self.get_old_build_dirs(cleaned_versions):
+            self.remove_tree(build_dir)
+
+    def get_old_build_dirs(self, cleaned_versions):
+        """
+        Build directories of the series none of whose source trees is left once cleaned_versions are cleaned.
+        """
+        if not os.path.isdir(self.build_root_dir):
+            return []
+        series_with_sources = set(version.get_series() for version in self.get_inventory().get_source_versions()
+                                  if version not in cleaned_versions)
+        return [self.build_root_dir + "/" + series for series in sorted(os.listdir(self.build_root_dir))
+                if series not in series_with_sources]
 
-    @staticmethod
-    def get_kernel_folder_suffix_from_version_int_array(version_int_array):
-        version_string = ".".join(str(version_int_array[index]) for index in [0, 1, 2]);
-        revision_suffix = "";
-        if version_int_array[3] != -1:
-            revision_suffix = "-r" + str(version_int_array[3])
-        return version_string + "-gentoo" + revision_suffix
+    def update_grub(self):
+        self.grub_backend.update(self.command_runner, self.grub_root_dir)
+
+    def create_plan(self, serial=False, resume=False, force=False):
+        """
+        What update_kernel would do, from the current state and the journal, without changing anything.
+        """
+        self.dry_run = True
+        plan = Plan(self.selected_kernel.get_release(), self.config_file, serial)
+        old_kernel_versions_to_clean = self.get_old_kernels_to_clean()
+        step_commands = self.get_step_commands(old_kernel_versions_to_clean)
+        for step, skip_reason in self.create_step_scheduler().plan(resume=resume, skip_up_to_date=not force):
+            if skip_reason is not None:
+                estimated_seconds = 0
+            elif self.journal is None:
+                # unknown, there is no duration recorded to estimate from
+                estimated_seconds = None
+            else:
+                estimated_seconds = self.journal.get_duration(step.name)
+            plan.add_step(PlannedStep(step.name, step.dependencies, step_commands.get(step.name, []), skip_reason,
+                                      estimated_seconds))
+
+        inventory = self.get_inventory()
+        for version in old_kernel_versions_to_clean:
+            entry = inventory.get_entry(version)
+            for tree_kind, tree_dir in [("modules", entry.modules_dir), ("sources", entry.source_dir)]:
+                if tree_dir is not None:
+                    plan.add_removal(PlannedRemoval(tree_kind, tree_dir, get_tree_size(tree_dir)))
+            for boot_artifact in entry.boot_artifacts:
+                plan.add_removal(PlannedRemoval("boot file", boot_artifact.path, boot_artifact.get_size()))
+        if self.build_root_dir is not None:
+            for build_dir in self.get_old_build_dirs(old_kernel_versions_to_clean):
+                plan.add_removal(PlannedRemoval("build", build_dir, get_tree_size(build_dir)))
+        return plan
+
+    def get_step_commands(self, old_kernel_versions_to_clean):
+        release = self.selected_kernel.get_release()
+        inventory = self.get_inventory()
+        step_commands = {
+            "reconcile_config": [self.get_make_command([self.config_target])],
+            "build_kernel": [self.get_build_command()],
+            "install_kernel": [self.get_make_command(["install"]), self.get_make_command(["modules_install"])],
+            "prepare_modules": [self.get_prepare_modules_command()],
+            "generate_initramfs": self.initramfs_backend.get_commands(release, self.modules_root_dir,
+                                                                      self.grub_root_dir),
+            "rebuild_drivers": [self.get_rebuild_drivers_command()],
+            "clean_old_kernels": [self.get_uninstall_command(version) for version in old_kernel_versions_to_clean
+                                  if inventory.get_entry(version).source_dir is not None],
+            "update_grub": self.grub_backend.get_commands(self.grub_root_dir),
+        }
+        if self.bundle_publisher is not None:
+            step_commands["publish_bundle"] = self.get_publish_commands(self.bundle_publisher.staging_root_dir + "/"
+                                                                        + release)
+        return step_commands
+
+    def remove_tree(self, dir_to_delete):
+        print("Retiring " + dir_to_delete + "...")
+        self.tree_deleter.retire(dir_to_delete)
+
+    def purge_old_trees(self):
+        parent_dirs = [self.kernel_root_dir, self.modules_root_dir]
+        if self.build_root_dir is not None:
+            parent_dirs.append(self.build_root_dir)
+        self.tree_deleter.add_leftovers(parent_dirs)
+        if self.purge_in_background:
+            pid = self.tree_deleter.purge_in_background()
+            if pid is not None:
+                print("Deleting the old trees in the background (pid " + str(pid) + ")")
+            return
+        report = self.tree_deleter.purge()
+        print(report.describe())
+        for path, reason in report.errors:
+            print("Could not delete " + path + ": " + reason)
+        self.count_deleted_bytes(report.bytes)
+
+    def count_deleted_bytes(self, deleted_bytes):
+        if self.profiler is not None:
+            self.profiler.count("bytes_deleted", deleted_bytes)
+
+
+
+
+class CommandFailedError(Exception):
+    """
+    Raised when a command returns a non-zero exit code, so that the following steps are not run on a broken state.
+    """
 
-    @staticmethod
-    def get_version_string_from_version_int_array(version_int_array):
-        version_string = ".".join(str(version_int_array[index]) for index in [0, 1, 2]);
-        if version_int_array[3] != int(-1):
-            version_string += "-r" + str(version_int_array[3])
-        return version_string
+    def __init__(self, result):
+        Exception.__init__(self, "Command " + " ".join(result.command_array) + " failed with exit code "
+                           + str(result.return_code))
+        self.result = result
 
-    @staticmethod
-    def remove_tree(dir_to_delete):
-        print("Deleting " + dir_to_delete + "...")
-        shutil.rmtree(dir_to_delete, ignore_errors=True)
 
+class CommandResult(object):
+    """
+    Outcome of a command: exit code, wall-clock and CPU times, and the last lines of its output.
+    """
 
+    def __init__(self, command_array, comment, return_code, start_time, wall_time, cpu_time, max_rss, bytes_written,
+                 output_tail):
+        self.command_array = command_array
+        self.comment = comment
+        self.return_code = return_code
+        self.start_time = start_time
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+        self.bytes_written = bytes_written
+        self.output_tail = output_tail
 
 
 class CommandRunner(object):
     """
     Runs command line commands. Externalised for tests.
+
+    The output is streamed line by line to the console and to an optional log file, only the last lines being kept in
+    memory. A command returning a non-zero exit code raises a CommandFailedError.
     """
 
-    def run_command(self, command_array, comment=""):
+    def __init__(self, output_tail_lines=200, log_file=None, profiler=None):
+        self.output_tail_lines = output_tail_lines
+        self.log_file = log_file
+        self.profiler = profiler
+        self.results = []
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def run_command(self, command_array, comment="", env=None):
         print("Running " + " ".join(command_array) + (" (" + comment + ")" if comment != "" else ""))
-        call(command_array)
+        result = self.execute(command_array, comment, env)
+        print("Finished " + " ".join(command_array) + " in %.1fs (cpu %.1fs)" % (result.wall_time, result.cpu_time))
+        if self.profiler is not None:
+            self.profiler.record_command(result)
+        if result.return_code != 0:
+            raise CommandFailedError(result)
+        return result
+
+    def execute(self, command_array, comment="", env=None):
+        process_env = None
+        if env:
+            process_env = dict(os.environ)
+            process_env.update(env)
+
+        output_tail = deque(maxlen=self.output_tail_lines)
+        start_time = time.time()
+        process = Popen(command_array, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, env=process_env)
+        with self.lock:
+            self.running += 1
+        try:
+            readers = [threading.Thread(target=self.stream_output, args=(process.stdout, sys.stdout, command_array,
+                                                                         output_tail)),
+                       threading.Thread(target=self.stream_output, args=(process.stderr, sys.stderr, command_array,
+                                                                         output_tail))]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            # wait4 gives the resource usage of this very child, which stays right when commands run in parallel
+            _, status, usage = os.wait4(process.pid, 0)
+            return_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            # reaped here, Popen must not wait for the pid, which may be another child's by now
+            process.returncode = return_code
+        finally:
+            with self.lock:
+                self.running -= 1
+
+        result = CommandResult(command_array, comment, return_code, start_time, time.time() - start_time,
+                               usage.ru_utime + usage.ru_stime, usage.ru_maxrss, usage.ru_oublock * BLOCK_SIZE,
+                               list(output_tail))
+        with self.lock:
+            self.results.append(result)
+        return result
+
+    def stream_output(self, stream, console, command_array, output_tail):
+        prefix = "[" + os.path.basename(command_array[0]) + "] "
+        with stream:
+            for raw_line in iter(stream.readline, b""):
+                line = raw_line.decode(errors="replace").rstrip("\n")
+                with self.lock:
+                    output_tail.append(line)
+                    if self.log_file is not None:
+                        self.log_file.write(prefix + line + "\n")
+                    # lines are prefixed by the command name only when several commands are interleaving their output
+                    console.write((prefix if self.running > 1 else "") + line + "\n")
+                    console.flush()
 
 
 class ConfigToCopyChooser(object):
@@ -162,13 +641,32 @@ class ConfigToCopyChooser(object):
     point for the configuration.
     """
 
-    def __init__(self, selected_kernel, kernel_root_dir=KERNEL_ROOT_DIR):
+    def __init__(self, selected_kernel, kernel_root_dir=KERNEL_ROOT_DIR, build_root_dir=None, config_ranker=None,
+                 automatic=False, ranking_size=0, inventory=None):
         self.selected_kernel = selected_kernel
         self.kernel_root_dir = kernel_root_dir
+        self.inventory = inventory
+        self.build_root_dir = build_root_dir
+        self.config_ranker = config_ranker
+        self.automatic = automatic
+        self.ranking_size = ranking_size
 
     def choose_config_file(self):
         config_files = self.find_config_files()
-        config_files.sort(reverse=True)
+        config_files.sort(key=lambda config_file: get_version_key(get_config_version(config_file)), reverse=True)
+
+        if self.config_ranker is not None and config_files:
+            config_scores = self.config_ranker.rank(config_files)
+            if self.ranking_size:
+                print("Best configs to copy:")
+                for config_score in config_scores[0:self.ranking_size]:
+                    print("  " + config_score.describe())
+            config_files = [config_score.config_file for config_score in config_scores]
+        if self.automatic:
+            if not config_files:
+                raise ValueError("No config file to copy found")
+            print("Chose the .config of " + config_files[0])
+            return config_files[0]
 
         print("Select kernel to copy .config from:")
         for idx, config_file_path in enumerate(config_files):
@@ -176,14 +674,24 @@ class ConfigToCopyChooser(object):
         chosen_index = int(self.do_input("Choice? [0-" + str(len(config_files) - 1) + "]:"))
         return config_files[chosen_index]
 
+    def get_inventory(self):
+        if self.inventory is None:
+            self.inventory = KernelInventory(self.kernel_root_dir, MODULES_ROOT_DIR, GRUB_ROOT_DIR)
+        return self.inventory
+
     def find_config_files(self):
         config_files = []
-        dir_list = os.listdir(self.kernel_root_dir)
-        for kernel_dir in dir_list:
-            a_config_file = self.kernel_root_dir + "/" + kernel_dir + "/.config"
-            if kernel_dir.startswith("linux-") and os.path.exists(a_config_file) \
-                    and kernel_dir != self.selected_kernel.selected_kernel:
+        inventory = self.get_inventory()
+        for version in inventory.get_source_versions():
+            source_dir = inventory.get_entry(version).source_dir
+            a_config_file = source_dir + "/.config"
+            if os.path.exists(a_config_file) and os.path.basename(source_dir) != self.selected_kernel.selected_kernel:
                 config_files.append(a_config_file)
+        if self.build_root_dir is not None and os.path.isdir(self.build_root_dir):
+            for series in os.listdir(self.build_root_dir):
+                a_config_file = self.build_root_dir + "/" + series + "/.config"
+                if os.path.exists(a_config_file):
+                    config_files.append(a_config_file)
         return config_files
 
     def do_input(self, string_to_display):
@@ -0,0 +1,253 @@
+import os
+import json
+import shutil
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+from kernelupdater.compression import CompressingWriter, DecompressingReader, EXTENSIONS
+from kernelupdater.journal import get_file_hash
+from kernelupdater.version import KernelVersion
+
+
+ARCHIVE_DIR = "/var/cache/kernel-updater/archives"
+MANIFEST_EXTENSION = ".json"
+
+
+class KernelArchiver(object):
+    """
+    Packs what is installed of an old kernel (boot files, modules directory and .config) into one compressed tar
+    archive before it is cleaned, so that it can be restored without rebuilding it.
+
+    Each archive comes with a manifest giving the size and hash of its files. Files identical to one of the previous
+    archive are not stored again, the manifest referencing the archive holding them instead. An archive referenced by
+    others is never rewritten, and is only removed with the last manifest referencing it.
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, compression="zstd", threads=0, hash_workers=None):
+        self.archive_dir = archive_dir
+        self.compression = compression
+        self.threads = threads
+        self.hash_workers = hash_workers or os.cpu_count() or 1
+
+    def archive(self, entry, config_file=None):
+        """
+        Archives the kernel of the inventory entry, returning the path of the archive, None when the archive of the
+        release is kept as it is referenced.
+        """
+        release = entry.version.release
+        referencing_releases = self.get_referencing_releases(release)
+        if referencing_releases:
+            # rewritten, it would no longer hold the members the other archives point to
+            print("Keeping the archive of " + release + ", the archives of " + ", ".join(referencing_releases)
+                  + " reference it")
+            return None
+        if not os.path.exists(self.archive_dir):
+            os.makedirs(self.archive_dir)
+        members = self.get_members(entry, config_file)
+        previous_files = self.get_previous_files(entry.version)
+        file_paths = [path for name, path in members if os.path.isfile(path) and not os.path.islink(path)]
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            hashes = dict(zip(file_paths, executor.map(get_file_hash, file_paths)))
+
+        manifest = {"release": release, "compression": self.compression, "files": []}
+        archive_file = self.get_archive_file(release)
+        stored_bytes = 0
+        referenced_bytes = 0
+        temporary_file = archive_file + ".tmp"
+        with open(temporary_file, "wb") as output_file:
+            with CompressingWriter(output_file, self.compression, self.threads) as compressed_output:
+                with tarfile.open(fileobj=compressed_output, mode="w|") as tar:
+                    for name, path in members:
+                        if path not in hashes:
+                            tar.add(path, arcname=name, recursive=False)
+                            continue
+                        size = os.path.getsize(path)
+                        holding_archive = previous_files.get((size, hashes[path]))
+                        if holding_archive is None:
+                            holding_archive = (release, name)
+                            tar.add(path, arcname=name, recursive=False)
+                            stored_bytes += size
+                        else:
+                            referenced_bytes += size
+                        manifest["files"].append({"name": name, "size": size, "sha256": hashes[path],
+                                                  "archive": holding_archive[0], "member": holding_archive[1]})
+        os.rename(temporary_file, archive_file)
+        self.write_manifest(release, manifest)
+        print("Archived " + release + " in " + archive_file + ": %.1f MB stored, %.1f MB identical to previous archives"
+              % (stored_bytes / 1048576.0, referenced_bytes / 1048576.0))
+        return archive_file
+
+    @staticmethod
+    def get_members(entry, config_file):
+        """
+        Names in the archive and paths of what is installed of the kernel, directories before their content.
+        """
+        members = []
+        for boot_artifact in sorted(entry.boot_artifacts, key=lambda artifact: artifact.name):
+            members.append(("boot/" + boot_artifact.name, boot_artifact.path))
+        if entry.modules_dir is not None:
+            members.append(("modules", entry.modules_dir))
+            for dir_path, dir_names, file_names in os.walk(entry.modules_dir):
+                dir_names.sort()
+                relative_dir = os.path.relpath(dir_path, entry.modules_dir)
+                archive_dir = "modules" if relative_dir == "." else "modules/" + relative_dir
+                for name in sorted(dir_names + file_names):
+                    members.append((archive_dir + "/" + name, os.path.join(dir_path, name)))
+        if config_file is not None and os.path.isfile(config_file):
+            members.append(("config", config_file))
+        return members
+
+    def get_previous_files(self, version):
+        """
+        Files of the latest archive of a version older than the given one, by size and hash, with the archive and
+        member holding them.
+        """
+        previous_versions = [archived for archived in self.get_archived_versions() if archived < version]
+        if not previous_versions:
+            return {}
+        manifest = self.read_manifest(previous_versions[-1].release)
+        if manifest is None or manifest["compression"] != self.compression:
+            return {}
+        return dict(((file_record["size"], file_record["sha256"]), (file_record["archive"], file_record["member"]))
+                    for file_record in manifest["files"])
+
+    def get_archived_versions(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        versions = []
+        for name in os.listdir(self.archive_dir):
+            if name.endswith(MANIFEST_EXTENSION):
+                version = KernelVersion.try_parse(name[0:-len(MANIFEST_EXTENSION)])
+                if version is not None:
+                    versions.append(version)
+        return sorted(versions)
+
+    def get_referencing_releases(self, release):
+        """
+        Releases whose archive references members of the archive of release.
+        """
+        referencing_releases = []
+        for version in self.get_archived_versions():
+            if version.release == release:
+                continue
+            manifest = self.read_manifest(version.release)
+            if any(file_record["archive"] == release for file_record in manifest["files"]):
+                referencing_releases.append(version.release)
+        return referencing_releases
+
+    def prune(self, versions):
+        """
+        Removes the manifests of the archives of versions, then the archives no manifest left references.
+        """
+        for version in versions:
+            print("Removing the archive of " + version.release)
+            os.remove(self.archive_dir + "/" + version.release + MANIFEST_EXTENSION)
+        referenced_archives = set()
+        for version in self.get_archived_versions():
+            manifest = self.read_manifest(version.release)
+            referenced_archives.add(self.get_archive_file(version.release, manifest["compression"]))
+            referenced_archives.update(self.get_archive_file(file_record["archive"], manifest["compression"])
+                                       for file_record in manifest["files"])
+        for name in os.listdir(self.archive_dir):
+            archive_file = self.archive_dir + "/" + name
+            if any(name.endswith(".tar" + extension) for extension in EXTENSIONS.values()) \
+                    and archive_file not in referenced_archives:
+                os.remove(archive_file)
+
+    def restore(self, release, boot_dir, modules_root_dir, kernel_root_dir):
+        """
+        Puts back the boot files, modules and, when its source tree is there, .config of an archived kernel.
+        """
+        manifest = self.read_manifest(release)
+        if manifest is None:
+            raise ValueError("No archive of " + release + " in " + self.archive_dir)
+        version = KernelVersion.parse(release)
+        destinations = {"boot": boot_dir,
+                        "modules": modules_root_dir + "/" + release,
+                        "config": kernel_root_dir + "/" + version.get_source_dir_name() + "/.config"}
+
+        # members stored in other archives, by archive
+        referenced_members = {}
+        for file_record in manifest["files"]:
+            if file_record["archive"] != release:
+                referenced_members.setdefault(file_record["archive"], {}) \
+                    .setdefault(file_record["member"], []).append(file_record["name"])
+
+        # archives only reference archives of the same compression
+        compression = manifest["compression"]
+        print("Restoring " + release + " from " + self.get_archive_file(release, compression))
+        self.extract(release, compression, destinations, None)
+        for archive_release, members in sorted(referenced_members.items()):
+            self.extract(archive_release, compression, destinations, members)
+
+    def extract(self, archive_release, compression, destinations, members):
+        """
+        Extracts the members of an archive to their destination, all of them when members is None, else those in
+        members under the names they map to.
+        """
+        archive_file = self.get_archive_file(archive_release, compression)
+        with DecompressingReader(archive_file, compression, self.threads) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                for tar_info in tar:
+                    names = [tar_info.name] if members is None else members.get(tar_info.name, [])
+                    targets = [target for target in (get_destination(name, destinations) for name in names)
+                               if target is not None]
+                    if not targets:
+                        continue
+                    # a streamed member can only be read once
+                    extract_member(tar, tar_info, targets[0])
+                    for target in targets[1:]:
+                        shutil.copy2(targets[0], target)
+
+    def get_archive_file(self, release, compression=None):
+        return self.archive_dir + "/" + release + ".tar" + EXTENSIONS[compression or self.compression]
+
+    def read_manifest(self, release):
+        manifest_file = self.archive_dir + "/" + release + MANIFEST_EXTENSION
+        if not os.path.exists(manifest_file):
+            return None
+        with open(manifest_file) as a_file:
+            return json.load(a_file)
+
+    def write_manifest(self, release, manifest):
+        manifest_file = self.archive_dir + "/" + release + MANIFEST_EXTENSION
+        temporary_file = manifest_file + ".tmp"
+        with open(temporary_file, "w") as a_file:
+            json.dump(manifest, a_file, indent=1, sort_keys=True)
+        os.rename(temporary_file, manifest_file)
+
+
+def get_destination(name, destinations):
+    """
+    Path a member of an archive is restored to, None for the .config of a kernel whose sources are not installed.
+    """
+    parts = name.split("/")
+    if ".." in parts or name.startswith("/"):
+        raise ValueError("Unsafe member in archive: " + name)
+    if parts[0] == "config":
+        return destinations["config"] if os.path.isdir(os.path.dirname(destinations["config"])) else None
+    return os.path.join(destinations[parts[0]], *parts[1:])
+
+
+def extract_member(tar, tar_info, target):
+    if tar_info.isdir():
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        return
+    target_dir = os.path.dirname(target)
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    if os.path.lexists(target):
+        os.remove(target)
+    if tar_info.issym():
+        os.symlink(tar_info.linkname, target)
+        return
+    with open(target, "wb") as target_file:
+        source = tar.extractfile(tar_info)
+        while True:
+            block = source.read(1048576)
+            if not block:
+                break
+            target_file.write(block)
+    os.chmod(target, tar_info.mode)
+    os.utime(target, (tar_info.mtime, tar_info.mtime))
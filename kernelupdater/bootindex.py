@@ -0,0 +1,65 @@
+import os
+import re
+
+
+# kernel images, System.map, config and initramfs files as installed by make install, genkernel and dracut, with the
+# .old copies installkernel makes
+BOOT_FILE_PATTERN = re.compile(r'^(vmlinuz|vmlinux|bzImage|kernel-genkernel-[^-]+|System\.map-genkernel-[^-]+'
+                               r'|System\.map|config|initramfs-genkernel-[^-]+|initramfs|initrd)'
+                               r'-(\d+\.\d+.*?)(\.img)?(\.old)?$')
+KINDS = [("vmlinuz", "kernel"), ("vmlinux", "kernel"), ("bzImage", "kernel"), ("kernel-", "kernel"),
+         ("System.map", "System.map"), ("config", "config"), ("initramfs", "initramfs"), ("initrd", "initramfs")]
+
+
+class BootArtifact(object):
+    """
+    A kernel related file of the boot directory, with the kernel release it belongs to.
+    """
+
+    def __init__(self, entry, kind, release, old):
+        self.name = entry.name
+        self.path = entry.path
+        self.kind = kind
+        self.release = release
+        self.old = old
+        self.entry = entry
+
+    def get_size(self):
+        return self.entry.stat(follow_symlinks=False).st_size
+
+
+class BootIndex(object):
+    """
+    The kernel files of the boot directory by kernel release, built from a single listing of the directory.
+
+    Releases are matched exactly, so that 4.1.1-gentoo does not take the files of 4.1.1-gentoo-r1 or 4.1.10-gentoo.
+    """
+
+    def __init__(self, boot_dir):
+        self.boot_dir = boot_dir
+        self.artifacts_by_release = {}
+        if os.path.isdir(boot_dir):
+            with os.scandir(boot_dir) as entries:
+                for entry in entries:
+                    artifact = self.parse_entry(entry)
+                    if artifact is not None:
+                        self.artifacts_by_release.setdefault(artifact.release, []).append(artifact)
+
+    @staticmethod
+    def parse_entry(entry):
+        match = BOOT_FILE_PATTERN.match(entry.name)
+        if match is None or entry.is_dir(follow_symlinks=False):
+            return None
+        prefix, release, _, old_suffix = match.groups()
+        kind = next(a_kind for kind_prefix, a_kind in KINDS if prefix.startswith(kind_prefix))
+        return BootArtifact(entry, kind, release, old_suffix is not None)
+
+    def get_artifacts(self, release):
+        return list(self.artifacts_by_release.get(release, []))
+
+    def get_kernel_releases(self):
+        """
+        Releases having a kernel image installed.
+        """
+        return sorted(release for release, artifacts in self.artifacts_by_release.items()
+                      if any(artifact.kind == "kernel" for artifact in artifacts))
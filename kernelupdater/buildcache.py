@@ -0,0 +1,73 @@
+import os
+
+
+DEFAULT_CACHE_DIR = "/var/cache/ccache"
+DEFAULT_MAX_SIZE = "10G"
+
+# --print-stats keys of ccache 4, then of ccache 3.7
+HIT_KEYS = ["direct_cache_hit", "preprocessed_cache_hit", "cache_hit_direct", "cache_hit_preprocessed"]
+MISS_KEYS = ["cache_miss"]
+SIZE_KEY = "cache_size_kibibyte"
+
+
+class CacheStatistics(object):
+    """
+    Hits and misses of the compiler cache since the start of the run, and its size.
+    """
+
+    def __init__(self, hits, misses, size_kb):
+        self.hits = hits
+        self.misses = misses
+        self.size_kb = size_kb
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def describe(self):
+        return "ccache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (%.1f%% hit ratio), " \
+               % (100 * self.hit_ratio()) + "%.1f MB in cache" % (self.size_kb / 1024.0)
+
+
+class BuildCache(object):
+    """
+    Compiles the kernel through ccache, so that only the files changed since the previous build are really compiled.
+
+    ccache evicts the least recently used entries once the cache grows over its maximum size.
+    """
+
+    def __init__(self, command_runner, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, compiler="gcc"):
+        self.command_runner = command_runner
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.compiler = compiler
+
+    def env(self):
+        return {"CCACHE_DIR": self.cache_dir, "CCACHE_MAXSIZE": self.max_size}
+
+    def make_variables(self):
+        # the same variables must be given to every make call, a changed CC making kbuild rebuild everything
+        return ["CC=ccache " + self.compiler, "HOSTCC=ccache " + self.compiler]
+
+    def prepare(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.command_runner.run_command(["ccache", "--max-size", self.max_size], "cap cache size", env=self.env())
+        self.command_runner.run_command(["ccache", "--zero-stats"], "count this run only", env=self.env())
+
+    def get_statistics(self):
+        result = self.command_runner.run_command(["ccache", "--print-stats"], env=self.env())
+        if result is None:
+            return None
+        return self.parse_statistics(result.output_tail)
+
+    @staticmethod
+    def parse_statistics(lines):
+        values = {}
+        for line in lines:
+            fields = line.split("\t")
+            if len(fields) == 2 and fields[1].strip().isdigit():
+                values[fields[0].strip()] = int(fields[1])
+        hits = sum(values.get(key, 0) for key in HIT_KEYS)
+        misses = sum(values.get(key, 0) for key in MISS_KEYS)
+        return CacheStatistics(hits, misses, values.get(SIZE_KEY, 0))
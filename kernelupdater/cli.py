@@ -1,26 +1,365 @@
 import argparse
 import os
+import time
 
-from kernelupdater import SelectedKernel, CommandRunner, KernelUpdater, KERNEL_ROOT_DIR, ConfigToCopyChooser
+from kernelupdater.archive import KernelArchiver, ARCHIVE_DIR
+from kernelupdater.buildcache import BuildCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+from kernelupdater.deletion import TreeDeleter, DEFAULT_WORKERS
+from kernelupdater.fleet import BundlePublisher, BundleInstaller, create_transport
+from kernelupdater.grub import EntriesBackend, MkconfigBackend
+from kernelupdater.initramfs import GenkernelInitramfs, DracutInitramfs, BuiltinInitramfs, INITRAMFS_CACHE_DIR
+from kernelupdater.jobs import JobsPlanner, DEFAULT_MEMORY_PER_JOB_MB
+from kernelupdater.journal import Journal, JOURNAL_FILE
+from kernelupdater.kconfig import ConfigRanker, ConfigDiffCache, RUNNING_CONFIG_FILE, CONFIG_DIFF_CACHE_DIR
+from kernelupdater.profiling import Profiler
+from kernelupdater.retention import RetentionPolicy, DEFAULT_KEEP_ARCHIVES, DEFAULT_KEEP_LAST
+from kernelupdater.watch import SourceWatcher, lower_priority, DEFAULT_CPU_PERCENT, DEFAULT_SETTLE_SECONDS
+from kernelupdater import SelectedKernel, CommandRunner, KernelUpdater, KERNEL_ROOT_DIR, ConfigToCopyChooser, \
+    CommandFailedError, BUILD_ROOT_DIR
 
 
 def main():
     parser = argparse.ArgumentParser(description="Gentoo: builds latest merged kernel, installs it, and does all"
                                                  " necessary post processes")
     parser.add_argument("-f", "--force", help="Force rebuild, reinstall and post processes", action="store_true")
+    parser.add_argument("--resume", help="Resume an interrupted upgrade, skipping the steps it completed whose kernel,"
+                                         " config and tools did not change since", action="store_true")
+    parser.add_argument("--journal", default=JOURNAL_FILE,
+                        help="File recording the completed steps (default: %(default)s)")
+    parser.add_argument("--serial", help="Run the steps one after another instead of running independent steps"
+                                         " at the same time", action="store_true")
+    parser.add_argument("--log-file", help="Append the output of all the commands run to this file")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of make jobs, computed from the CPUs, memory and"
+                                                       " load of the machine by default")
+    parser.add_argument("-l", "--load-average", type=float, help="Load average above which make does not start new"
+                                                                 " jobs, the number of usable CPUs by default")
+    parser.add_argument("--memory-per-job", type=int, default=DEFAULT_MEMORY_PER_JOB_MB,
+                        help="Memory in MB one make job is expected to use (default: %(default)s)")
+    parser.add_argument("--ccache", help="Compile through ccache and print the cache statistics at the end",
+                        action="store_true")
+    parser.add_argument("--ccache-dir", default=DEFAULT_CACHE_DIR, help="ccache directory (default: %(default)s)")
+    parser.add_argument("--ccache-size", default=DEFAULT_MAX_SIZE,
+                        help="Size above which ccache evicts old entries (default: %(default)s)")
+    parser.add_argument("--build-dir", nargs="?", const=BUILD_ROOT_DIR,
+                        help="Build out of the source tree, in a directory per kernel series kept across upgrades so"
+                             " that patch level upgrades only rebuild what changed (default: " + BUILD_ROOT_DIR + ")")
+    parser.add_argument("--profile", help="Write the timings of every step and command of the run to this file, as"
+                                          " a Chrome trace with a summary of the run")
+    parser.add_argument("--purge-in-background", help="Delete the old source and module trees in a background"
+                                                      " process once grub is updated", action="store_true")
+    parser.add_argument("--delete-workers", type=int, default=DEFAULT_WORKERS,
+                        help="Threads deleting the old trees (default: %(default)s)")
+    parser.add_argument("--initramfs", choices=["genkernel", "dracut", "builtin"], default="genkernel",
+                        help="Tool generating the initramfs, builtin appending the modules of the new kernel to a"
+                             " cached base archive (default: %(default)s)")
+    parser.add_argument("--initramfs-compression", choices=["zstd", "xz", "gzip"],
+                        help="Initramfs compression, multithreaded when zstd, xz or pigz is installed (default: the"
+                             " tool's own, zstd for builtin)")
+    parser.add_argument("--initramfs-base", help="Root of the kernel independent initramfs content (busybox, udev,"
+                                                 " firmware, init...) for the builtin generator")
+    parser.add_argument("--initramfs-cache", default=INITRAMFS_CACHE_DIR,
+                        help="Directory of the cached builtin initramfs base archives (default: %(default)s)")
+    parser.add_argument("--archive", help="Archive the boot files, modules and .config of the old kernels before"
+                                          " cleaning them, so that they can be restored with --restore",
+                        action="store_true")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="Directory of the archives (default: %(default)s)")
+    parser.add_argument("--keep-archives", type=int, default=DEFAULT_KEEP_ARCHIVES,
+                        help="Archives kept, the oldest being removed once there are more (default: %(default)s)")
+    parser.add_argument("--archive-compression", choices=["zstd", "xz", "gzip"], default="zstd",
+                        help="Compression of the archives (default: %(default)s)")
+    parser.add_argument("--restore", metavar="RELEASE", help="Restore the archived kernel RELEASE (e.g. 4.12.4-gentoo)"
+                                                             " and update grub, instead of upgrading")
+    parser.add_argument("--publish-to", metavar="DIR", help="Also install the built kernel into a staging root and"
+                                                              " publish it as a bundle in DIR for --deploy-from")
+    parser.add_argument("--deploy-from", metavar="SOURCE",
+                        help="Do not build: install the bundle of the selected kernel published in SOURCE, a"
+                             " directory or an http URL, then rebuild the modules, initramfs and grub config")
+    parser.add_argument("--auto-config", help="Copy the best ranked config without asking, configs being ranked by"
+                                              " similarity to the running kernel's, match with the symbols of the"
+                                              " new sources and version", action="store_true")
+    parser.add_argument("--show-ranking", metavar="N", type=int, default=0,
+                        help="Print the N best ranked configs with their scores")
+    parser.add_argument("--running-config", default=RUNNING_CONFIG_FILE,
+                        help="Config of the running kernel the candidate configs are compared to (default:"
+                             " %(default)s)")
+    parser.add_argument("--config-target", choices=["olddefconfig", "localmodconfig"], default="olddefconfig",
+                        help="make target setting the new symbols of the copied config without asking, localmodconfig"
+                             " also disabling the modules not loaded on this host (default: %(default)s)")
+    parser.add_argument("--config-diff-cache", nargs="?", const=CONFIG_DIFF_CACHE_DIR,
+                        help="Cache the reconciled config and its diff per version pair in this directory, which"
+                             " hosts upgrading the same way can share (default: " + CONFIG_DIFF_CACHE_DIR + ")")
+    parser.add_argument("--dry-run", help="Print what would be done, with the commands of each step, the files"
+                                          " removed and the estimated duration, without changing anything",
+                        action="store_true")
+    parser.add_argument("--plan-format", choices=["text", "json"], default="text",
+                        help="Format of the --dry-run plan (default: %(default)s)")
+    parser.add_argument("--keep-last", type=int, default=DEFAULT_KEEP_LAST,
+                        help="Kernels kept, the selected one and the ones before it (default: %(default)s)")
+    parser.add_argument("--keep-per-series", type=int, default=0,
+                        help="Also keep the N newest kernels of each series, e.g. 4.14 (default: %(default)s)")
+    parser.add_argument("--min-boot-free", type=int, metavar="MB",
+                        help="Also remove the oldest kept kernels until /boot has MB free, the running, default boot"
+                             " and selected kernels being always kept")
+    parser.add_argument("--prune-newer", help="Apply the retention policy to the kernels newer than the selected one"
+                                              " too, which are kept otherwise", action="store_true")
+    parser.add_argument("--grub", choices=["mkconfig", "entries"], default="mkconfig",
+                        help="How the grub config is updated, entries only rewriting its Linux entries and the"
+                             " loader/entries files, grub-mkconfig being run when the grub settings changed since the"
+                             " last run (default: %(default)s)")
+    parser.add_argument("--watch", help="Watch " + KERNEL_ROOT_DIR + " for new source trees and configure and build"
+                                        " each at low priority once merged, with the best ranked config, leaving"
+                                        " its install to --confirm", action="store_true")
+    parser.add_argument("--settle", type=int, default=DEFAULT_SETTLE_SECONDS, metavar="SECONDS",
+                        help="Seconds a new source tree has to stay unchanged to be considered merged (default:"
+                             " %(default)s)")
+    parser.add_argument("--prebuild-cpu", type=int, default=DEFAULT_CPU_PERCENT, metavar="PERCENT",
+                        help="Share of the CPUs the builds of --watch may use (default: %(default)s)")
+    parser.add_argument("--confirm", nargs="?", const="", metavar="RELEASE",
+                        help="Select the kernel RELEASE prebuilt by --watch, the newest by default, and install it,"
+                             " the build being skipped as up to date")
     args = parser.parse_args()
+    if args.initramfs == "builtin" and args.initramfs_base is None:
+        parser.error("--initramfs builtin requires --initramfs-base")
+    if args.publish_to and args.deploy_from:
+        parser.error("--publish-to and --deploy-from are exclusive")
+    if args.watch and args.confirm is not None:
+        parser.error("--watch and --confirm are exclusive")
+
+    if args.watch:
+        watch_sources(args)
+        return
+    if args.confirm is not None:
+        select_prebuilt_kernel(args.confirm, Journal(args.journal), SourceWatcher(KERNEL_ROOT_DIR), CommandRunner())
 
     selected_kernel = SelectedKernel()
 
-    if os.path.exists(KERNEL_ROOT_DIR + "/linux/.config") and not args.force:
-        print("A config file exists already in " + KERNEL_ROOT_DIR + "/linux - skipping")
+    archiver = None
+    if args.archive or args.restore:
+        archiver = KernelArchiver(archive_dir=args.archive_dir, compression=args.archive_compression)
+    if args.restore:
+        restore_kernel(archiver, args.restore, selected_kernel, create_grub_backend(args))
+        return
+
+    journal = Journal(args.journal)
+    recorded_config = get_recorded_config(journal, selected_kernel)
+
+    # without a journal record, there is no telling which config the existing one was copied from
+    if recorded_config is None and not args.resume and not args.force and args.deploy_from is None \
+            and not args.dry_run:
+        if args.build_dir is not None:
+            if is_built_in(args.build_dir + "/" + selected_kernel.get_series(), selected_kernel):
+                print(selected_kernel.selected_kernel + " was already built in " + args.build_dir + " - skipping")
+                exit(1)
+        elif os.path.exists(KERNEL_ROOT_DIR + "/linux/.config"):
+            print("A config file exists already in " + KERNEL_ROOT_DIR + "/linux - skipping")
+            exit(1)
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(run_info={"kernel": selected_kernel.get_release()})
+
+    log_file = open(args.log_file, "a") if args.log_file else None
+    command_runner = CommandRunner(log_file=log_file, profiler=profiler)
+    config_ranker = None
+    if args.auto_config or args.show_ranking:
+        config_ranker = ConfigRanker(selected_kernel.selected_kernel_dir, running_config_file=args.running_config)
+    config_to_copy_chooser = ConfigToCopyChooser(selected_kernel=selected_kernel, build_root_dir=args.build_dir,
+                                                 config_ranker=config_ranker, automatic=args.auto_config,
+                                                 ranking_size=args.show_ranking)
+
+    if args.deploy_from is not None or args.dry_run and recorded_config is None and not args.auto_config:
+        chosen_config = None
+    elif recorded_config is not None and not args.force:
+        print("Reusing config " + recorded_config + ", the steps up to date will be skipped")
+        chosen_config = recorded_config
+    else:
+        try:
+            chosen_config = config_to_copy_chooser.choose_config_file()
+        except ValueError as error:
+            print(str(error) + " - aborting")
+            exit(1)
+        if not args.dry_run:
+            journal.set_value("kernel", selected_kernel.get_release())
+            journal.set_value("config_file", chosen_config)
+
+    kernel_updater = create_kernel_updater(args, selected_kernel, chosen_config, command_runner, journal,
+                                           profiler=profiler, archiver=archiver)
+    if args.dry_run:
+        try:
+            plan = kernel_updater.create_plan(serial=args.serial, resume=args.resume, force=args.force)
+        finally:
+            if log_file is not None:
+                log_file.close()
+        print(plan.to_json() if args.plan_format == "json" else plan.describe())
+        return
+    try:
+        kernel_updater.update_kernel(serial=args.serial, resume=args.resume, force=args.force)
+    except (CommandFailedError, ValueError) as error:
+        print(str(error) + " - aborting")
         exit(1)
+    finally:
+        if log_file is not None:
+            log_file.close()
+        if profiler is not None:
+            profiler.print_summary()
+            profiler.write_report(args.profile)
+
+
+def create_kernel_updater(args, selected_kernel, chosen_config, command_runner, journal, profiler=None,
+                          archiver=None):
+    jobs_plan = JobsPlanner(memory_per_job_mb=args.memory_per_job).plan(jobs=args.jobs,
+                                                                        load_average=args.load_average)
+
+    build_cache = None
+    if args.ccache:
+        build_cache = BuildCache(command_runner, cache_dir=args.ccache_dir, max_size=args.ccache_size)
+
+    return KernelUpdater(config_file=chosen_config, a_selected_kernel=selected_kernel,
+                         a_command_runner=command_runner, jobs_plan=jobs_plan, build_cache=build_cache,
+                         build_root_dir=args.build_dir, profiler=profiler,
+                         tree_deleter=TreeDeleter(workers=args.delete_workers),
+                         purge_in_background=args.purge_in_background, journal=journal,
+                         initramfs_backend=create_initramfs_backend(args), archiver=archiver,
+                         bundle_publisher=BundlePublisher(create_transport(args.publish_to))
+                         if args.publish_to else None,
+                         bundle_installer=BundleInstaller(create_transport(args.deploy_from))
+                         if args.deploy_from else None,
+                         config_target=args.config_target,
+                         config_diff_cache=ConfigDiffCache(args.config_diff_cache)
+                         if args.config_diff_cache else None,
+                         retention_policy=RetentionPolicy(keep_last=args.keep_last,
+                                                          keep_per_series=args.keep_per_series,
+                                                          min_boot_free_mb=args.min_boot_free,
+                                                          prune_newer=args.prune_newer,
+                                                          keep_archives=args.keep_archives),
+                         grub_backend=create_grub_backend(args))
+
+
+def watch_sources(args):
+    """
+    Prebuilds each source tree merged from now on, at low priority, until interrupted.
+    """
+    source_watcher = SourceWatcher(KERNEL_ROOT_DIR, settle_seconds=args.settle)
+    lower_priority(args.prebuild_cpu)
+    while True:
+        tree_name = source_watcher.wait_for_new_tree()
+        tree_dir = KERNEL_ROOT_DIR + "/" + tree_name
+        print("New sources in " + tree_dir + ", waiting for them to be fully merged")
+        if not source_watcher.wait_until_settled(tree_dir) or prebuild_kernel(args, tree_dir, source_watcher):
+            source_watcher.mark_known(tree_name)
+        elif source_watcher.record_failure(tree_name):
+            # retried later, in case it failed on something transient
+            time.sleep(source_watcher.poll_interval)
+
+
+def prebuild_kernel(args, tree_dir, source_watcher):
+    """
+    Configures and builds the kernel of tree_dir, returning whether it succeeded.
+
+    It is built through the /usr/src/linux link, pointed to tree_dir meanwhile: the compiler command lines are then the
+    ones of the run confirming it, which finds the objects up to date.
+    """
+    link_folder = KERNEL_ROOT_DIR + "/linux"
+    previous_tree_dir = os.readlink(link_folder) if os.path.islink(link_folder) else None
+    point_link(link_folder, tree_dir)
+    log_file = open(args.log_file, "a") if args.log_file else None
+    try:
+        selected_kernel = SelectedKernel()
+        release = selected_kernel.get_release()
+        command_runner = CommandRunner(log_file=log_file)
+        config_to_copy_chooser = ConfigToCopyChooser(selected_kernel=selected_kernel, build_root_dir=args.build_dir,
+                                                     config_ranker=ConfigRanker(
+                                                         selected_kernel.selected_kernel_dir,
+                                                         running_config_file=args.running_config),
+                                                     automatic=True)
+        chosen_config = config_to_copy_chooser.choose_config_file()
+        create_kernel_updater(args, selected_kernel, chosen_config, command_runner, Journal(args.journal)) \
+            .prebuild_kernel(serial=args.serial)
+    except (CommandFailedError, ValueError) as error:
+        print(str(error) + " - prebuild of " + tree_dir + " failed")
+        return False
+    finally:
+        if log_file is not None:
+            log_file.close()
+        if previous_tree_dir is not None:
+            point_link(link_folder, previous_tree_dir)
+        else:
+            os.remove(link_folder)
+    # the run confirming the kernel reuses the config
+    source_watcher.record_prebuilt(release, chosen_config)
+    print("Run kernel-updater --confirm " + release + " to install it")
+    return True
+
+
+def point_link(link_folder, target):
+    os.symlink(target, link_folder + ".tmp")
+    os.rename(link_folder + ".tmp", link_folder)
+
+
+def select_prebuilt_kernel(release, journal, source_watcher, command_runner):
+    """
+    Selects the kernel prebuilt by the watch, the newest when release is empty, recording the config it was built with
+    in the journal for the run installing it.
+    """
+    if not release:
+        prebuilt_releases = source_watcher.get_prebuilt_releases()
+        if not prebuilt_releases:
+            print("No prebuilt kernel to confirm - aborting")
+            exit(1)
+        release = prebuilt_releases[0]
+    config_file = source_watcher.get_prebuilt_config(release)
+    try:
+        command_runner.run_command(["eselect", "kernel", "set", "linux-" + release])
+    except CommandFailedError as error:
+        print(str(error) + " - aborting")
+        exit(1)
+    if config_file is not None:
+        journal.set_value("kernel", release)
+        journal.set_value("config_file", config_file)
+    source_watcher.forget_prebuilt(release)
+
+
+def get_recorded_config(journal, selected_kernel):
+    """
+    The config chosen by the previous run for the selected kernel, if any and still there.
+    """
+    if journal.get_value("kernel") != selected_kernel.get_release():
+        return None
+    config_file = journal.get_value("config_file")
+    return config_file if config_file is not None and os.path.exists(config_file) else None
+
+
+def restore_kernel(archiver, release, selected_kernel, grub_backend):
+    kernel_updater = KernelUpdater(config_file=None, a_selected_kernel=selected_kernel,
+                                   a_command_runner=CommandRunner(), grub_backend=grub_backend)
+    try:
+        archiver.restore(release, kernel_updater.grub_root_dir, kernel_updater.modules_root_dir,
+                         kernel_updater.kernel_root_dir)
+        kernel_updater.update_grub()
+    except (ValueError, CommandFailedError) as error:
+        print(str(error) + " - aborting")
+        exit(1)
+    print(release + " restored, it can be chosen in the grub menu")
+
+
+def create_initramfs_backend(args):
+    if args.initramfs == "dracut":
+        return DracutInitramfs(compression=args.initramfs_compression)
+    if args.initramfs == "builtin":
+        return BuiltinInitramfs(args.initramfs_base, cache_dir=args.initramfs_cache,
+                                compression=args.initramfs_compression or "zstd")
+    return GenkernelInitramfs(compression=args.initramfs_compression)
+
 
-    command_runner = CommandRunner()
-    config_to_copy_chooser = ConfigToCopyChooser(selected_kernel=selected_kernel)
+def create_grub_backend(args):
+    if args.grub == "entries":
+        return EntriesBackend()
+    return MkconfigBackend()
 
-    chosen_config = config_to_copy_chooser.choose_config_file()
 
-    kernel_updater = KernelUpdater(config_file=chosen_config, a_selected_kernel=selected_kernel,
-                                   a_command_runner=command_runner)
-    kernel_updater.update_kernel()
+def is_built_in(build_dir, selected_kernel):
+    release_file = build_dir + "/include/config/kernel.release"
+    if not os.path.exists(release_file):
+        return False
+    with open(release_file) as a_file:
+        return a_file.read().strip() == selected_kernel.get_release()
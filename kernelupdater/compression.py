@@ -0,0 +1,93 @@
+import gzip
+import lzma
+import shutil
+from subprocess import Popen, PIPE
+
+
+# multithreaded tools first, the python modules being used when none of them is installed
+COMPRESSION_TOOLS = {
+    "zstd": [["zstd", "-q", "-T{threads}", "-c"]],
+    "xz": [["xz", "-T{threads}", "--check=crc32", "-c"]],
+    "gzip": [["pigz", "-p{threads}", "-c"], ["gzip", "-c"]],
+}
+EXTENSIONS = {"zstd": ".zst", "xz": ".xz", "gzip": ".gz"}
+
+
+def get_compression_command(compression, threads=0, decompress=False):
+    if compression not in COMPRESSION_TOOLS:
+        raise ValueError("Unknown compression: " + compression)
+    for command in COMPRESSION_TOOLS[compression]:
+        if shutil.which(command[0]) is not None:
+            # pigz has no "all the CPUs" value, it uses them all by default
+            command = [argument.format(threads=threads) for argument in command
+                       if not (threads == 0 and argument == "-p{threads}")]
+            return command + ["-d"] if decompress else command
+    return None
+
+
+class CompressingWriter(object):
+    """
+    Binary stream compressing what is written to it into output_file, through the multithreaded compression tool
+    when installed.
+    """
+
+    def __init__(self, output_file, compression, threads=0):
+        self.process = None
+        command = get_compression_command(compression, threads)
+        if command is not None:
+            self.process = Popen(command, stdin=PIPE, stdout=output_file)
+            self.stream = self.process.stdin
+        elif compression == "gzip":
+            self.stream = gzip.GzipFile(fileobj=output_file, mode="wb")
+        elif compression == "xz":
+            # the kernel only knows the crc32 check of xz
+            self.stream = lzma.LZMAFile(output_file, "wb", check=lzma.CHECK_CRC32)
+        else:
+            raise ValueError("No " + compression + " compression tool installed")
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+        if self.process is not None and self.process.wait() != 0:
+            raise IOError("Compression failed with exit code " + str(self.process.returncode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DecompressingReader(object):
+    """
+    Binary stream of the decompressed content of compressed_file.
+    """
+
+    def __init__(self, compressed_file, compression, threads=0):
+        self.process = None
+        command = get_compression_command(compression, threads, decompress=True)
+        if command is not None:
+            self.process = Popen(command + [compressed_file], stdout=PIPE)
+            self.stream = self.process.stdout
+        elif compression == "gzip":
+            self.stream = gzip.open(compressed_file, "rb")
+        elif compression == "xz":
+            self.stream = lzma.open(compressed_file, "rb")
+        else:
+            raise ValueError("No " + compression + " compression tool installed")
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+        if self.process is not None:
+            self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
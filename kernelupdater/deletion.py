@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from subprocess import Popen, DEVNULL
+
+
+TRASH_DIR_NAME = ".kernel-updater-trash"
+DEFAULT_WORKERS = 8
+BACKGROUND_NICENESS = 10
+
+
+class DeletionReport(object):
+    """
+    What a deletion freed, and the paths it could not delete with the reason.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.directories = 0
+        self.bytes = 0
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def add(self, files, directories, freed_bytes, errors):
+        with self.lock:
+            self.files += files
+            self.directories += directories
+            self.bytes += freed_bytes
+            self.errors.extend(errors)
+
+    def describe(self):
+        return "Deleted " + str(self.files) + " files and " + str(self.directories) + " directories, " \
+               + "%.1f MB freed" % (self.bytes / 1048576.0) \
+               + (", " + str(len(self.errors)) + " failures" if self.errors else "")
+
+
+class TreeDeleter(object):
+    """
+    Deletes directory trees in two times. Retiring a tree renames it into a trash directory next to it, which is
+    atomic and immediate. Purging then unlinks the retired trees, directories being emptied in parallel by several
+    threads with unlinks relative to the directory file descriptor.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self.trash_dirs = []
+        self.lock = threading.Lock()
+
+    def retire(self, tree_dir):
+        if not os.path.lexists(tree_dir):
+            return None
+        trash_dir = os.path.join(os.path.dirname(os.path.abspath(tree_dir)), TRASH_DIR_NAME)
+        if not os.path.isdir(trash_dir):
+            os.mkdir(trash_dir, 0o700)
+        trash_path = os.path.join(trash_dir, os.path.basename(tree_dir) + "." + str(int(time.time() * 1000000)))
+        os.rename(tree_dir, trash_path)
+        with self.lock:
+            if trash_dir not in self.trash_dirs:
+                self.trash_dirs.append(trash_dir)
+        return trash_path
+
+    def add_leftovers(self, parent_dirs):
+        """
+        Adds the trash directories of parent_dirs, left by interrupted runs, to the ones to purge.
+        """
+        with self.lock:
+            for parent_dir in parent_dirs:
+                trash_dir = os.path.join(os.path.abspath(parent_dir), TRASH_DIR_NAME)
+                if os.path.isdir(trash_dir) and trash_dir not in self.trash_dirs:
+                    self.trash_dirs.append(trash_dir)
+
+    def purge(self):
+        """
+        Deletes everything in the trash directories of the trees retired by this run and of the leftovers added,
+        whatever else they contain.
+        """
+        with self.lock:
+            trash_dirs, self.trash_dirs = self.trash_dirs, []
+        return self.purge_trash_dirs(trash_dirs)
+
+    def purge_in_background(self):
+        """
+        Purges in a detached low priority process that outlives this one, returning its pid.
+        """
+        with self.lock:
+            trash_dirs, self.trash_dirs = self.trash_dirs, []
+        if not trash_dirs:
+            return None
+        # the process lowers its own priority, preexec_fn is not safe with the threads of this one
+        process = Popen([sys.executable, "-m", "kernelupdater.deletion"] + trash_dirs, stdin=DEVNULL,
+                        stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+        return process.pid
+
+    def purge_trash_dirs(self, trash_dirs):
+        report = DeletionReport()
+        for trash_dir in trash_dirs:
+            if os.path.isdir(trash_dir):
+                self.delete_tree(trash_dir, report)
+        return report
+
+    def delete_tree(self, tree_dir, report):
+        """
+        Deletes tree_dir and everything below it, the files of each directory being unlinked by a worker thread.
+        """
+        directories = [tree_dir]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = set([executor.submit(self.empty_directory, tree_dir, report)])
+            while running:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    for sub_dir in future.result():
+                        directories.append(sub_dir)
+                        running.add(executor.submit(self.empty_directory, sub_dir, report))
+
+        # directories are only empty once their sub directories are deleted: deepest first
+        errors = []
+        removed_directories = 0
+        for directory in sorted(directories, key=lambda path: path.count(os.sep), reverse=True):
+            try:
+                os.rmdir(directory)
+                removed_directories += 1
+            except OSError as error:
+                errors.append((directory, error.strerror))
+        report.add(0, removed_directories, 0, errors)
+
+    @staticmethod
+    def empty_directory(directory, report):
+        """
+        Unlinks the files of directory, returning its sub directories.
+        """
+        sub_dirs = []
+        errors = []
+        files = 0
+        freed_bytes = 0
+        try:
+            directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+        except OSError as error:
+            report.add(0, 0, 0, [(directory, error.strerror)])
+            return sub_dirs
+        try:
+            with os.scandir(directory_fd) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            sub_dirs.append(os.path.join(directory, entry.name))
+                            continue
+                        size = entry.stat(follow_symlinks=False).st_size
+                        os.unlink(entry.name, dir_fd=directory_fd)
+                        files += 1
+                        freed_bytes += size
+                    except OSError as error:
+                        errors.append((os.path.join(directory, entry.name), error.strerror))
+        finally:
+            os.close(directory_fd)
+        report.add(files, 0, freed_bytes, errors)
+        return sub_dirs
+
+
+def main():
+    os.setpriority(os.PRIO_PROCESS, 0, BACKGROUND_NICENESS)
+    report = TreeDeleter().purge_trash_dirs(sys.argv[1:])
+    print(report.describe())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+import urllib.request
+from urllib.error import URLError
+
+from kernelupdater.compression import CompressingWriter, DecompressingReader, EXTENSIONS
+from kernelupdater.journal import get_file_hash
+
+
+STAGING_ROOT_DIR = "/var/cache/kernel-updater/staging"
+DOWNLOAD_DIR = "/var/cache/kernel-updater/bundles"
+# files of the build tree the deploying hosts need to build out of tree modules against the bundled kernel
+BUILD_FILES = ["config", "Module.symvers"]
+# links of the module directory to the source and build trees, made again by the deploying hosts for their own trees
+TREE_LINKS = ["build", "source"]
+
+
+def get_bundle_name(release, compression):
+    return "linux-" + release + ".tar" + EXTENSIONS[compression]
+
+
+def get_manifest_name(release):
+    return "linux-" + release + ".json"
+
+
+class DirectoryTransport(object):
+    """
+    Bundles published to and fetched from a directory, local or mounted from a file server.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def publish(self, file_path):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        target = os.path.join(self.directory, os.path.basename(file_path))
+        shutil.copyfile(file_path, target + ".tmp")
+        os.rename(target + ".tmp", target)
+
+    def fetch(self, name, destination):
+        source = os.path.join(self.directory, name)
+        if not os.path.exists(source):
+            raise ValueError("No " + name + " in " + self.directory)
+        shutil.copyfile(source, destination)
+
+
+class HttpTransport(object):
+    """
+    Bundles fetched from a web server serving the directory the builder publishes to.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def publish(self, file_path):
+        raise ValueError("Cannot publish to " + self.base_url + ", publish to the directory it serves")
+
+    def fetch(self, name, destination):
+        try:
+            with urllib.request.urlopen(self.base_url + "/" + name) as response:
+                with open(destination, "wb") as a_file:
+                    shutil.copyfileobj(response, a_file)
+        except URLError as error:
+            raise ValueError("Cannot fetch " + self.base_url + "/" + name + ": " + str(error))
+
+
+def create_transport(location):
+    if location.startswith("http://") or location.startswith("https://"):
+        return HttpTransport(location)
+    return DirectoryTransport(location)
+
+
+class BundlePublisher(object):
+    """
+    Packs a kernel installed into a staging root, with the build files needed to build modules against it, into a
+    compressed bundle and publishes it with a manifest of the sha256 of the bundle and of each of its files.
+    """
+
+    def __init__(self, transport, staging_root_dir=STAGING_ROOT_DIR, compression="zstd", threads=0):
+        self.transport = transport
+        self.staging_root_dir = staging_root_dir
+        self.compression = compression
+        self.threads = threads
+
+    def create_staging_dir(self, release):
+        """
+        Empty staging root for the install of the release, boot files going in its boot directory.
+        """
+        staging_dir = self.staging_root_dir + "/" + release
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        os.makedirs(staging_dir + "/boot")
+        return staging_dir
+
+    def publish(self, release, staging_dir, build_files):
+        """
+        Publishes what was installed in staging_dir, with build_files, a dict from BUILD_FILES to their path.
+        """
+        members = []
+        for name in sorted(os.listdir(staging_dir + "/boot")):
+            members.append(("boot/" + name, staging_dir + "/boot/" + name))
+        modules_dir = staging_dir + "/lib/modules/" + release
+        if os.path.isdir(modules_dir):
+            members.append(("modules", modules_dir))
+            # they point to the trees of the builder, which the deploying hosts do not have
+            for name in TREE_LINKS:
+                if os.path.islink(modules_dir + "/" + name):
+                    os.remove(modules_dir + "/" + name)
+        for dir_path, dir_names, file_names in os.walk(modules_dir):
+            dir_names.sort()
+            relative_dir = os.path.relpath(dir_path, modules_dir)
+            archive_dir = "modules" if relative_dir == "." else "modules/" + relative_dir
+            for name in sorted(dir_names + file_names):
+                members.append((archive_dir + "/" + name, os.path.join(dir_path, name)))
+        for name in BUILD_FILES:
+            if build_files.get(name) is not None and os.path.isfile(build_files[name]):
+                members.append(("build/" + name, build_files[name]))
+
+        manifest = {"release": release, "compression": self.compression, "files": {}}
+        bundle_file = self.staging_root_dir + "/" + get_bundle_name(release, self.compression)
+        with open(bundle_file, "wb") as output_file:
+            with CompressingWriter(output_file, self.compression, self.threads) as compressed_output:
+                with tarfile.open(fileobj=compressed_output, mode="w|") as tar:
+                    for name, path in members:
+                        tar.add(path, arcname=name, recursive=False)
+                        if os.path.isfile(path) and not os.path.islink(path):
+                            manifest["files"][name] = get_file_hash(path)
+        manifest["bundle_sha256"] = get_file_hash(bundle_file)
+        manifest_file = self.staging_root_dir + "/" + get_manifest_name(release)
+        with open(manifest_file, "w") as a_file:
+            json.dump(manifest, a_file, indent=1, sort_keys=True)
+
+        # the manifest last, hosts never find a manifest whose bundle is not there yet
+        self.transport.publish(bundle_file)
+        self.transport.publish(manifest_file)
+        print("Published " + get_bundle_name(release, self.compression) + " (%.1f MB, %d files)"
+              % (os.path.getsize(bundle_file) / 1048576.0, len(manifest["files"])))
+        shutil.rmtree(staging_dir)
+        os.remove(bundle_file)
+        os.remove(manifest_file)
+
+
+class BundleInstaller(object):
+    """
+    Fetches the bundle of a release published by the builder, checks it against its manifest and installs it.
+    """
+
+    def __init__(self, transport, download_dir=DOWNLOAD_DIR, threads=0):
+        self.transport = transport
+        self.download_dir = download_dir
+        self.threads = threads
+        self.manifests = {}
+
+    def get_manifest(self, release):
+        if release not in self.manifests:
+            if not os.path.isdir(self.download_dir):
+                os.makedirs(self.download_dir)
+            manifest_file = self.download_dir + "/" + get_manifest_name(release)
+            self.transport.fetch(get_manifest_name(release), manifest_file)
+            with open(manifest_file) as a_file:
+                self.manifests[release] = json.load(a_file)
+        return self.manifests[release]
+
+    def get_downloaded_manifest(self, release):
+        """
+        Manifest of release as last fetched, None when it never was, without fetching it.
+        """
+        if release in self.manifests:
+            return self.manifests[release]
+        manifest_file = self.download_dir + "/" + get_manifest_name(release)
+        if not os.path.exists(manifest_file):
+            return None
+        with open(manifest_file) as a_file:
+            return json.load(a_file)
+
+    def install(self, release, boot_dir, modules_root_dir, source_dir):
+        """
+        Installs the boot files and modules of the bundle, and its build files in the source tree of the release.
+        """
+        manifest = self.get_manifest(release)
+        compression = manifest["compression"]
+        bundle_file = self.download_dir + "/" + get_bundle_name(release, compression)
+        print("Fetching " + get_bundle_name(release, compression))
+        self.transport.fetch(get_bundle_name(release, compression), bundle_file)
+        if get_file_hash(bundle_file) != manifest["bundle_sha256"]:
+            raise ValueError("Checksum mismatch of " + bundle_file)
+
+        destinations = {"boot": boot_dir, "modules": modules_root_dir + "/" + release, "build": source_dir}
+        installed_files = set()
+        with DecompressingReader(bundle_file, compression, self.threads) as stream:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                symbolic_links = set()
+                for tar_info in tar:
+                    target = get_target(tar_info, destinations)
+                    # nothing is written through a link of the bundle, which could point anywhere
+                    if any("/".join(tar_info.name.split("/")[0:index]) in symbolic_links
+                           for index in range(1, tar_info.name.count("/") + 1)):
+                        raise ValueError("Member below a symbolic link in bundle: " + tar_info.name)
+                    if tar_info.isfile():
+                        install_file(tar, tar_info, target, manifest["files"].get(tar_info.name))
+                        installed_files.add(tar_info.name)
+                    elif tar_info.isdir():
+                        if not os.path.isdir(target):
+                            os.makedirs(target)
+                    elif tar_info.issym():
+                        if os.path.lexists(target):
+                            os.remove(target)
+                        os.symlink(tar_info.linkname, target)
+                        symbolic_links.add(tar_info.name)
+        missing_files = set(manifest["files"]) - installed_files
+        if missing_files:
+            raise ValueError("Files missing from " + bundle_file + ": " + ", ".join(sorted(missing_files)))
+        for name in TREE_LINKS:
+            link = destinations["modules"] + "/" + name
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(source_dir, link)
+        os.remove(bundle_file)
+
+
+def get_target(tar_info, destinations):
+    """
+    Where a member of a bundle is installed, refusing anything that would end up out of its destination.
+    """
+    parts = tar_info.name.split("/")
+    if tar_info.name.startswith("/") or ".." in parts or parts[0] not in destinations:
+        raise ValueError("Unexpected member in bundle: " + tar_info.name)
+    if parts[0] != "modules" and len(parts) != 2:
+        raise ValueError("Unexpected member in bundle: " + tar_info.name)
+    if parts[0] == "build" and (len(parts) != 2 or parts[1] not in BUILD_FILES):
+        raise ValueError("Unexpected build file in bundle: " + tar_info.name)
+    if not (tar_info.isfile() or tar_info.isdir() or tar_info.issym()):
+        raise ValueError("Unexpected file type in bundle: " + tar_info.name)
+    if parts[0] == "build":
+        return os.path.join(destinations["build"], "." + parts[1] if parts[1] == "config" else parts[1])
+    return os.path.join(destinations[parts[0]], *parts[1:])
+
+
+def install_file(tar, tar_info, target, expected_hash):
+    """
+    Writes the member to a temporary file renamed to target once its sha256 is checked.
+    """
+    if expected_hash is None:
+        raise ValueError(tar_info.name + " is not in the manifest")
+    target_dir = os.path.dirname(target)
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    file_hash = hashlib.sha256()
+    temporary_file = target + ".tmp"
+    with open(temporary_file, "wb") as target_file:
+        source = tar.extractfile(tar_info)
+        for block in iter(lambda: source.read(1048576), b""):
+            file_hash.update(block)
+            target_file.write(block)
+    if file_hash.hexdigest() != expected_hash:
+        os.remove(temporary_file)
+        raise ValueError("Checksum mismatch of " + tar_info.name)
+    os.chmod(temporary_file, tar_info.mode)
+    os.utime(temporary_file, (tar_info.mtime, tar_info.mtime))
+    os.rename(temporary_file, target)
@@ -0,0 +1,356 @@
+import os
+import re
+import hashlib
+
+from kernelupdater.bootindex import BootIndex
+from kernelupdater.version import KernelVersion
+
+
+GRUB_CONFIG_FILES = ["/etc/default/grub", "/etc/grub.d"]
+GRUB_FINGERPRINT_FILE = "/var/lib/kernel-updater/grub-config.sha256"
+LINUX_SECTION_BEGIN = "### BEGIN /etc/grub.d/10_linux ###"
+LINUX_SECTION_END = "### END /etc/grub.d/10_linux ###"
+BLS_ENTRIES_DIR = "loader/entries"
+MACHINE_ID_FILE = "/etc/machine-id"
+KERNEL_COMMAND_LINE_FILE = "/proc/cmdline"
+OLD_SUFFIX = ".old"
+
+
+def get_grub_config_file(boot_dir):
+    return boot_dir + "/grub/grub.cfg"
+
+
+def get_mkconfig_command(boot_dir):
+    return ["grub-mkconfig", "-o", get_grub_config_file(boot_dir)]
+
+
+class MkconfigBackend(object):
+    """
+    Regenerates the whole grub config with grub-mkconfig, running every /etc/grub.d script.
+    """
+
+    def update(self, command_runner, boot_dir):
+        command_runner.run_command(get_mkconfig_command(boot_dir))
+
+    def get_commands(self, boot_dir):
+        return [get_mkconfig_command(boot_dir)]
+
+
+class EntriesBackend(object):
+    """
+    Only rewrites the Linux menu entries of grub.cfg, the section written by /etc/grub.d/10_linux, from the kernels
+    installed in the boot directory, and the Boot Loader Specification entries of loader/entries when there are some.
+
+    Entries are derived from an entry of the current grub.cfg, the release it boots being replaced, the initrd line
+    being dropped for the kernels without initramfs and added for those with one. The new grub.cfg is checked with
+    grub-script-check before being renamed over the old one.
+
+    grub-mkconfig is run instead when the grub settings and scripts changed since its last run through this backend,
+    when grub.cfg has no Linux section, and on first use.
+    """
+
+    def __init__(self, fingerprint_file=GRUB_FINGERPRINT_FILE, grub_config_files=GRUB_CONFIG_FILES):
+        self.fingerprint_file = fingerprint_file
+        self.grub_config_files = grub_config_files
+
+    def update(self, command_runner, boot_dir):
+        releases = get_kernel_releases(boot_dir)
+        if self.needs_mkconfig(boot_dir):
+            print("Running grub-mkconfig, the grub settings changed since its last run or grub.cfg has no Linux entry")
+            command_runner.run_command(get_mkconfig_command(boot_dir))
+            self.save_fingerprint()
+        else:
+            grub_config_file = get_grub_config_file(boot_dir)
+            with open(grub_config_file) as a_file:
+                grub_config = a_file.read()
+            temporary_file = grub_config_file + ".tmp"
+            with open(temporary_file, "w") as a_file:
+                a_file.write(rewrite_linux_section(grub_config, releases, boot_dir))
+            try:
+                command_runner.run_command(["grub-script-check", temporary_file])
+            except Exception:
+                os.remove(temporary_file)
+                raise
+            os.rename(temporary_file, grub_config_file)
+            print("Rewrote the Linux entries of " + grub_config_file + " for " + ", ".join(releases))
+        if os.path.isdir(boot_dir + "/" + BLS_ENTRIES_DIR):
+            write_bls_entries(boot_dir, [release for release in releases if not release.endswith(OLD_SUFFIX)])
+
+    def get_commands(self, boot_dir):
+        if self.needs_mkconfig(boot_dir):
+            return [get_mkconfig_command(boot_dir)]
+        return [["grub-script-check", get_grub_config_file(boot_dir) + ".tmp"]]
+
+    def needs_mkconfig(self, boot_dir):
+        grub_config_file = get_grub_config_file(boot_dir)
+        if not os.path.exists(grub_config_file) or not os.path.exists(self.fingerprint_file):
+            return True
+        with open(grub_config_file) as a_file:
+            grub_config = a_file.read()
+        if LINUX_SECTION_BEGIN not in grub_config or find_template_release(grub_config) is None:
+            return True
+        with open(self.fingerprint_file) as a_file:
+            return a_file.read().strip() != self.get_fingerprint()
+
+    def get_fingerprint(self):
+        """
+        Hash of the names, modes and contents of the grub settings and scripts.
+        """
+        config_hash = hashlib.sha256()
+        paths = []
+        for config_path in self.grub_config_files:
+            if os.path.isdir(config_path):
+                paths += sorted(os.path.join(config_path, name) for name in os.listdir(config_path))
+            elif os.path.exists(config_path):
+                paths.append(config_path)
+        for path in paths:
+            if os.path.isfile(path):
+                config_hash.update(("%s\0%o\0" % (path, os.stat(path).st_mode)).encode("utf-8"))
+                with open(path, "rb") as a_file:
+                    config_hash.update(a_file.read())
+        return config_hash.hexdigest()
+
+    def save_fingerprint(self):
+        fingerprint_dir = os.path.dirname(self.fingerprint_file)
+        if fingerprint_dir and not os.path.isdir(fingerprint_dir):
+            os.makedirs(fingerprint_dir)
+        with open(self.fingerprint_file + ".tmp", "w") as a_file:
+            a_file.write(self.get_fingerprint() + "\n")
+        os.rename(self.fingerprint_file + ".tmp", self.fingerprint_file)
+
+
+def get_kernel_releases(boot_dir):
+    """
+    Releases with a kernel image in the boot directory, newest first, the .old images as <release>.old right after the
+    release, as grub-mkconfig lists them.
+    """
+    images = []
+    for release, artifacts in BootIndex(boot_dir).artifacts_by_release.items():
+        version = KernelVersion.try_parse(release)
+        if version is None:
+            continue
+        for old in set(artifact.old for artifact in artifacts if artifact.kind == "kernel"):
+            images.append((version, not old, release + OLD_SUFFIX if old else release))
+    return [release for _, _, release in sorted(images, reverse=True)]
+
+
+def strip_old(release):
+    return release[0:-len(OLD_SUFFIX)] if release.endswith(OLD_SUFFIX) else release
+
+
+def replace_release(text, old_release, new_release):
+    # not in the middle of another release: 4.14.1 is not in 4.14.10
+    return re.sub(r'(?<![\w.])' + re.escape(old_release) + r'(?!\w|\.\d)', new_release, text)
+
+
+KERNEL_LINE_PATTERN = re.compile(r'^(\s*)linux(16|efi)?(\s+)(\S*?/)(?:vmlinuz|vmlinux|bzImage|kernel-genkernel-[^-]+)'
+                                 r'-(\S+)', re.MULTILINE)
+INITRD_LINE_PATTERN = re.compile(r'^\s*initrd(?:16|efi)?\s+(.*)$', re.MULTILINE)
+
+
+def find_template_release(text):
+    match = KERNEL_LINE_PATTERN.search(text)
+    return match.group(5) if match is not None else None
+
+
+def find_initramfs(boot_dir, name):
+    """
+    Name of the initramfs file to boot for name, the one of the release for a .old kernel without .old initramfs,
+    None when neither exists.
+    """
+    for candidate in [name, re.sub(r'\.old(\.img)?$', r'\1', name)]:
+        if os.path.exists(boot_dir + "/" + candidate):
+            return candidate
+    return None
+
+
+def split_blocks(lines):
+    """
+    Splits lines into top level blocks, a menuentry or submenu with its body, or a single other line.
+    """
+    blocks = []
+    block = []
+    depth = 0
+    for line in lines:
+        block.append(line)
+        depth += line.count("{") - line.count("}")
+        if depth <= 0:
+            blocks.append(block)
+            block = []
+            depth = 0
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def derive_entry(template_lines, template_release, release, boot_dir):
+    """
+    Entry booting release made from the entry booting template_release, with the initrd line naming the initramfs of
+    release: dropped when there is none, added when the template entry has none.
+    """
+    has_initrd_line = any(INITRD_LINE_PATTERN.match(line) is not None for line in template_lines)
+    entry_lines = []
+    for line in template_lines:
+        line = replace_release(line, template_release, release)
+        if template_release.endswith(OLD_SUFFIX):
+            # the initramfs of a .old entry may be the one of its release
+            line = replace_release(line, strip_old(template_release), strip_old(release))
+        initrd_match = INITRD_LINE_PATTERN.match(line)
+        if initrd_match is not None:
+            initrd_paths = []
+            for path in initrd_match.group(1).split():
+                # microcode images are kept, the missing initramfs dropped
+                name = find_initramfs(boot_dir, os.path.basename(path))
+                if name is not None:
+                    initrd_paths.append(path[0:len(path) - len(os.path.basename(path))] + name)
+            if not initrd_paths:
+                continue
+            line = line[0:initrd_match.start(1)] + " ".join(initrd_paths) + line[initrd_match.end(1):]
+        entry_lines.append(line)
+        kernel_match = KERNEL_LINE_PATTERN.match(line)
+        if kernel_match is not None and not has_initrd_line:
+            initramfs_name = get_initramfs_name(boot_dir, release)
+            if initramfs_name is not None:
+                indent, suffix, separator, kernel_dir = kernel_match.group(1, 2, 3, 4)
+                entry_lines.append(indent + "initrd" + (suffix or "") + separator + kernel_dir + initramfs_name + "\n")
+    return entry_lines
+
+
+def get_initramfs_name(boot_dir, release):
+    """
+    Name of the initramfs of the kernel image release, the one of its release for a .old image without .old initramfs.
+    """
+    initramfs_artifacts = [artifact for artifact in BootIndex(boot_dir).get_artifacts(strip_old(release))
+                           if artifact.kind == "initramfs"]
+    for old in [release.endswith(OLD_SUFFIX), False]:
+        names = sorted(artifact.name for artifact in initramfs_artifacts if artifact.old == old)
+        if names:
+            return names[0]
+    return None
+
+
+def rewrite_blocks(blocks, releases, boot_dir):
+    """
+    Rewrites the menu entries of blocks for releases: an entry for a single kernel, booting the newest, and a group of
+    entries (normal and recovery) per release made from the group of the first release found.
+    """
+    lines = []
+    index = 0
+    while index < len(blocks):
+        block = blocks[index]
+        first_line = block[0].lstrip()
+        template_release = find_template_release("".join(block))
+        if first_line.startswith("submenu"):
+            lines.append(block[0])
+            inner_blocks = split_blocks(block[1:-1])
+            lines += rewrite_blocks(inner_blocks, releases, boot_dir)
+            lines.append(block[-1])
+            index += 1
+        elif first_line.startswith("menuentry") and template_release is not None:
+            # the entries of the same release following each other make the group
+            group = [block]
+            index += 1
+            while index < len(blocks) and blocks[index][0].lstrip().startswith("menuentry") \
+                    and find_template_release("".join(blocks[index])) == template_release:
+                group.append(blocks[index])
+                index += 1
+            is_release_titled = template_release in block[0]
+            for release in (releases if is_release_titled else releases[0:1]):
+                for group_block in group:
+                    lines += derive_entry(group_block, template_release, release, boot_dir)
+            if is_release_titled:
+                # the other releases of the original list are replaced by the derived ones
+                while index < len(blocks) and blocks[index][0].lstrip().startswith("menuentry") \
+                        and find_template_release("".join(blocks[index])) is not None:
+                    index += 1
+        else:
+            lines += block
+            index += 1
+    return lines
+
+
+def rewrite_linux_section(grub_config, releases, boot_dir):
+    start = grub_config.index(LINUX_SECTION_BEGIN) + len(LINUX_SECTION_BEGIN) + 1
+    end = grub_config.index(LINUX_SECTION_END, start)
+    section_lines = grub_config[start:end].splitlines(True)
+    if not releases:
+        new_section = "".join(block_line for block in split_blocks(section_lines) for block_line in block
+                              if find_template_release("".join(block)) is None)
+    else:
+        new_section = "".join(rewrite_blocks(split_blocks(section_lines), releases, boot_dir))
+    return grub_config[0:start] + new_section + grub_config[end:]
+
+
+def write_bls_entries(boot_dir, releases):
+    """
+    Makes the Boot Loader Specification entries of loader/entries match the installed kernels, new entries derived
+    from an existing one when there is one. The entries of other systems and tools are left alone.
+    """
+    entries_dir = boot_dir + "/" + BLS_ENTRIES_DIR
+    entries_by_release = {}
+    for name in os.listdir(entries_dir):
+        if name.endswith(".conf"):
+            with open(entries_dir + "/" + name) as a_file:
+                content = a_file.read()
+            match = re.search(r'^version\s+(\S+)', content, re.MULTILINE)
+            if match is not None:
+                entries_by_release[match.group(1)] = (name, content)
+
+    template = None
+    versions = [KernelVersion.try_parse(release) for release in entries_by_release if release in releases]
+    versions = [version for version in versions if version is not None]
+    if versions:
+        # the entry of the newest kernel installed here, the most likely to have the current options
+        template_release = max(versions).release
+        template = (template_release,) + entries_by_release[template_release]
+    # only the entries named as this backend names them are removed, once no kernel image of their release is left
+    boot_index = BootIndex(boot_dir)
+    for release, (name, content) in entries_by_release.items():
+        if name == get_machine_id() + "-" + release + ".conf" and release not in releases \
+                and not any(artifact.kind == "kernel" for artifact in boot_index.get_artifacts(release)):
+            print("Removing the boot entry " + name)
+            os.remove(entries_dir + "/" + name)
+    for release in releases:
+        if release in entries_by_release:
+            continue
+        if template is not None:
+            name = replace_release(template[1], template[0], release)
+            content = "".join(derive_entry(template[2].splitlines(True), template[0], release, boot_dir))
+        else:
+            name = get_machine_id() + "-" + release + ".conf"
+            content = create_bls_entry(boot_dir, release)
+        with open(entries_dir + "/" + name + ".tmp", "w") as a_file:
+            a_file.write(content)
+        os.rename(entries_dir + "/" + name + ".tmp", entries_dir + "/" + name)
+        print("Added the boot entry " + name)
+
+
+def create_bls_entry(boot_dir, release):
+    # paths are relative to the root of the file system the entries are on
+    prefix = "/" if os.path.ismount(boot_dir) else "/boot/"
+    lines = ["title Gentoo Linux " + release, "version " + release]
+    for artifact in BootIndex(boot_dir).get_artifacts(release):
+        if artifact.kind == "kernel" and not artifact.old:
+            lines.append("linux " + prefix + artifact.name)
+    for artifact in BootIndex(boot_dir).get_artifacts(release):
+        if artifact.kind == "initramfs" and not artifact.old:
+            lines.append("initrd " + prefix + artifact.name)
+    lines.append("options " + get_kernel_options())
+    return "\n".join(lines) + "\n"
+
+
+def get_machine_id():
+    if not os.path.exists(MACHINE_ID_FILE):
+        return "gentoo"
+    with open(MACHINE_ID_FILE) as a_file:
+        return a_file.read().strip() or "gentoo"
+
+
+def get_kernel_options():
+    """
+    Command line of the running kernel, without the image the boot loader added.
+    """
+    if not os.path.exists(KERNEL_COMMAND_LINE_FILE):
+        return ""
+    with open(KERNEL_COMMAND_LINE_FILE) as a_file:
+        return " ".join(option for option in a_file.read().split() if not option.startswith("BOOT_IMAGE="))
@@ -0,0 +1,186 @@
+import os
+import stat
+import shutil
+import hashlib
+
+from kernelupdater.compression import CompressingWriter, EXTENSIONS
+
+
+INITRAMFS_CACHE_DIR = "/var/cache/kernel-updater/initramfs"
+CPIO_BLOCK = 4
+
+
+class GenkernelInitramfs(object):
+    """
+    Generates the initramfs with genkernel, from scratch each time.
+    """
+
+    def __init__(self, compression=None):
+        self.compression = compression
+
+    def generate(self, command_runner, release, modules_root_dir, boot_dir):
+        for command in self.get_commands(release, modules_root_dir, boot_dir):
+            command_runner.run_command(command)
+
+    def get_commands(self, release, modules_root_dir, boot_dir):
+        initramfs_generation_command = ["genkernel", "initramfs"]
+        if self.compression is not None:
+            initramfs_generation_command.append("--compress-initramfs-type=" + self.compression)
+        return [initramfs_generation_command]
+
+    def get_fingerprint(self):
+        return {"backend": "genkernel", "compression": self.compression}
+
+
+class DracutInitramfs(object):
+    """
+    Generates the initramfs with dracut.
+    """
+
+    def __init__(self, compression=None):
+        self.compression = compression
+
+    def generate(self, command_runner, release, modules_root_dir, boot_dir):
+        for command in self.get_commands(release, modules_root_dir, boot_dir):
+            command_runner.run_command(command)
+
+    def get_commands(self, release, modules_root_dir, boot_dir):
+        initramfs_generation_command = ["dracut", "--force", "--kver", release]
+        if self.compression is not None:
+            initramfs_generation_command.append("--" + self.compression)
+        initramfs_generation_command.append(boot_dir + "/initramfs-" + release + ".img")
+        return [initramfs_generation_command]
+
+    def get_fingerprint(self):
+        return {"backend": "dracut", "compression": self.compression}
+
+
+class BuiltinInitramfs(object):
+    """
+    Builds the initramfs as two concatenated compressed cpio archives, which the kernel unpacks one after the other:
+    the version independent base (busybox, udev, lvm, firmware...) taken from base_dir, built once and cached, then
+    the modules of the kernel release, the only part built at each upgrade.
+    """
+
+    def __init__(self, base_dir, cache_dir=INITRAMFS_CACHE_DIR, compression="zstd", threads=0):
+        self.base_dir = base_dir
+        self.cache_dir = cache_dir
+        self.compression = compression
+        self.threads = threads
+
+    def generate(self, command_runner, release, modules_root_dir, boot_dir):
+        base_layer = self.get_base_layer()
+        initramfs_file = boot_dir + "/initramfs-" + release + ".img"
+        print("Building " + initramfs_file + " from " + base_layer + " and the modules of " + release)
+        temporary_file = initramfs_file + ".tmp"
+        with open(temporary_file, "wb") as initramfs:
+            with open(base_layer, "rb") as base:
+                shutil.copyfileobj(base, initramfs)
+            initramfs.flush()
+            with CompressingWriter(initramfs, self.compression, self.threads) as modules_layer:
+                cpio_writer = CpioWriter(modules_layer)
+                for parent_dir in ["lib", "lib/modules"]:
+                    if not os.path.lexists(os.path.join(self.base_dir, parent_dir)):
+                        cpio_writer.add_directory(parent_dir)
+                cpio_writer.add_tree(modules_root_dir + "/" + release, "lib/modules/" + release)
+                cpio_writer.close()
+        os.rename(temporary_file, initramfs_file)
+
+    def get_commands(self, release, modules_root_dir, boot_dir):
+        # built in process
+        return []
+
+    def get_fingerprint(self):
+        return {"backend": "builtin", "compression": self.compression, "base": get_tree_fingerprint(self.base_dir)}
+
+    def get_base_layer(self):
+        base_layer = self.cache_dir + "/base-" + get_tree_fingerprint(self.base_dir)[0:16] + ".cpio" \
+            + EXTENSIONS[self.compression]
+        if os.path.exists(base_layer):
+            return base_layer
+        print("Building the initramfs base layer " + base_layer + " from " + self.base_dir)
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        temporary_file = base_layer + ".tmp"
+        with open(temporary_file, "wb") as base:
+            with CompressingWriter(base, self.compression, self.threads) as compressed_base:
+                cpio_writer = CpioWriter(compressed_base)
+                cpio_writer.add_tree(self.base_dir, "")
+                cpio_writer.close()
+        os.rename(temporary_file, base_layer)
+        return base_layer
+
+
+class CpioWriter(object):
+    """
+    Writes a cpio archive in the "newc" format the kernel unpacks, files being owned by root.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.next_inode = 1
+
+    def add_tree(self, root_dir, archive_root):
+        for dir_path, dir_names, file_names in os.walk(root_dir):
+            dir_names.sort()
+            relative_dir = os.path.relpath(dir_path, root_dir)
+            archive_dir = archive_root if relative_dir == "." else os.path.join(archive_root, relative_dir)
+            if archive_dir:
+                self.add(dir_path, archive_dir)
+            # symbolic links to directories are listed with the directories, and not walked into
+            linked_dirs = [name for name in dir_names if os.path.islink(os.path.join(dir_path, name))]
+            for name in sorted(file_names + linked_dirs):
+                self.add(os.path.join(dir_path, name), os.path.join(archive_dir, name))
+
+    def add_directory(self, archive_name):
+        self.write_entry(archive_name, stat.S_IFDIR | 0o755, 2, 0, b"")
+
+    def add(self, path, archive_name):
+        path_stat = os.lstat(path)
+        if stat.S_ISDIR(path_stat.st_mode):
+            self.write_entry(archive_name, path_stat.st_mode, 2, int(path_stat.st_mtime), b"")
+        elif stat.S_ISLNK(path_stat.st_mode):
+            self.write_entry(archive_name, path_stat.st_mode, 1, int(path_stat.st_mtime),
+                             os.fsencode(os.readlink(path)))
+        elif stat.S_ISREG(path_stat.st_mode):
+            with open(path, "rb") as a_file:
+                self.write_header(archive_name, path_stat.st_mode, 1, int(path_stat.st_mtime), path_stat.st_size)
+                shutil.copyfileobj(a_file, self.stream)
+                self.write_padding(path_stat.st_size)
+
+    def close(self):
+        self.write_entry("TRAILER!!!", 0, 1, 0, b"")
+
+    def write_entry(self, archive_name, mode, nlink, mtime, data):
+        self.write_header(archive_name, mode, nlink, mtime, len(data))
+        self.stream.write(data)
+        self.write_padding(len(data))
+
+    def write_header(self, archive_name, mode, nlink, mtime, size):
+        name = os.fsencode(archive_name) + b"\0"
+        fields = [self.next_inode, mode, 0, 0, nlink, mtime, size, 0, 0, 0, 0, len(name), 0]
+        self.next_inode += 1
+        header = b"070701" + b"".join(b"%08X" % field for field in fields) + name
+        self.stream.write(header)
+        self.write_padding(len(header))
+
+    def write_padding(self, length):
+        if length % CPIO_BLOCK:
+            self.stream.write(b"\0" * (CPIO_BLOCK - length % CPIO_BLOCK))
+
+
+def get_tree_fingerprint(root_dir):
+    """
+    Hash of the names, types, modes, sizes and modification times of everything under root_dir.
+    """
+    tree_hash = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names.sort()
+        for name in sorted(dir_names + file_names):
+            path = os.path.join(dir_path, name)
+            path_stat = os.lstat(path)
+            link_target = os.readlink(path) if stat.S_ISLNK(path_stat.st_mode) else ""
+            tree_hash.update(("%s\0%o\0%d\0%d\0%s\n" % (os.path.relpath(path, root_dir), path_stat.st_mode,
+                                                         path_stat.st_size, path_stat.st_mtime_ns,
+                                                         link_target)).encode("utf-8", "surrogateescape"))
+    return tree_hash.hexdigest()
@@ -0,0 +1,72 @@
+import os
+
+from kernelupdater.bootindex import BootIndex
+from kernelupdater.version import KernelVersion
+
+
+class KernelEntry(object):
+    """
+    What is installed of a kernel version: its source tree, its modules directory and its boot files, if any.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.source_dir = None
+        self.modules_dir = None
+        self.boot_artifacts = []
+
+
+class KernelInventory(object):
+    """
+    The kernels found in the source, modules and boot directories, scanned once and cross-referenced by version.
+    """
+
+    def __init__(self, kernel_root_dir, modules_root_dir, boot_dir):
+        self.kernel_root_dir = kernel_root_dir
+        self.modules_root_dir = modules_root_dir
+        self.boot_dir = boot_dir
+        self.entries = {}
+
+        for name, path in list_dirs(kernel_root_dir):
+            version = KernelVersion.try_parse(name) if name.startswith("linux-") else None
+            if version is not None:
+                self.get_or_create_entry(version).source_dir = path
+
+        for name, path in list_dirs(modules_root_dir):
+            version = KernelVersion.try_parse(name)
+            if version is not None:
+                self.get_or_create_entry(version).modules_dir = path
+
+        self.boot_index = BootIndex(boot_dir)
+        for release, artifacts in self.boot_index.artifacts_by_release.items():
+            version = KernelVersion.try_parse(release)
+            if version is not None:
+                self.get_or_create_entry(version).boot_artifacts = artifacts
+
+    def get_or_create_entry(self, version):
+        if version not in self.entries:
+            self.entries[version] = KernelEntry(version)
+        return self.entries[version]
+
+    def get_entry(self, version):
+        return self.entries.get(version) or KernelEntry(version)
+
+    def get_versions(self):
+        return sorted(self.entries)
+
+    def get_source_versions(self):
+        return sorted(version for version, entry in self.entries.items() if entry.source_dir is not None)
+
+    def get_boot_versions(self):
+        return sorted(version for version, entry in self.entries.items()
+                      if any(artifact.kind == "kernel" for artifact in entry.boot_artifacts))
+
+
+def list_dirs(root_dir):
+    """
+    Names and paths of the directories of root_dir, symbolic links excluded.
+    """
+    if not os.path.isdir(root_dir):
+        return []
+    with os.scandir(root_dir) as entries:
+        return [(entry.name, entry.path) for entry in entries if entry.is_dir(follow_symlinks=False)]
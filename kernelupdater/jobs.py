@@ -0,0 +1,116 @@
+import os
+import multiprocessing
+from math import ceil
+
+
+PROC_ROOT_DIR = "/proc"
+CGROUP_ROOT_DIR = "/sys/fs/cgroup"
+DEFAULT_MEMORY_PER_JOB_MB = 512
+
+
+class JobsPlan(object):
+    """
+    Number of make jobs and load average limit to use, with the limit that decided the number of jobs.
+    """
+
+    def __init__(self, jobs, load_average, limit, limits):
+        self.jobs = jobs
+        self.load_average = load_average
+        self.limit = limit
+        self.limits = limits
+
+    def make_options(self):
+        return ["-j" + str(self.jobs), "-l" + format_load_average(self.load_average)]
+
+    def describe(self):
+        details = ", ".join(name + "=" + str(value) for name, value in sorted(self.limits.items()))
+        return "Using " + str(self.jobs) + " jobs and load average " + format_load_average(self.load_average) \
+            + " (limited by " + self.limit + "; " + details + ")"
+
+
+class JobsPlanner(object):
+    """
+    Works out how many make jobs the machine can take, from the CPUs this process may use (affinity mask and cgroup
+    cpu.max), the memory available for the jobs and the current system load.
+    """
+
+    def __init__(self, memory_per_job_mb=DEFAULT_MEMORY_PER_JOB_MB, proc_root_dir=PROC_ROOT_DIR,
+                 cgroup_root_dir=CGROUP_ROOT_DIR):
+        self.memory_per_job_mb = memory_per_job_mb
+        self.proc_root_dir = proc_root_dir
+        self.cgroup_root_dir = cgroup_root_dir
+
+    def plan(self, jobs=None, load_average=None):
+        cpus = self.get_usable_cpus()
+        if load_average is None:
+            load_average = float(cpus)
+
+        if jobs is not None:
+            return JobsPlan(jobs, load_average, "command line", {"command line": jobs})
+
+        # one job more than CPUs keeps them busy while other jobs wait on I/O
+        limits = {"cpus": cpus + 1}
+        available_memory_kb = self.get_available_memory_kb()
+        if available_memory_kb is not None:
+            limits["memory"] = max(1, available_memory_kb // (self.memory_per_job_mb * 1024))
+        current_load = self.get_current_load()
+        if current_load is not None:
+            limits["load"] = max(1, int(cpus - current_load)) + 1
+
+        limit = min(sorted(limits), key=lambda name: limits[name])
+        return JobsPlan(limits[limit], load_average, limit, limits)
+
+    def get_usable_cpus(self):
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except (AttributeError, OSError):
+            cpus = multiprocessing.cpu_count()
+        cgroup_cpus = self.get_cgroup_cpus()
+        if cgroup_cpus is not None:
+            cpus = min(cpus, cgroup_cpus)
+        return cpus
+
+    def get_cgroup_cpus(self):
+        """
+        Smallest cpu.max quota, rounded up to whole CPUs, of the cgroup v2 of this process and of its ancestors.
+        """
+        cgroup_path = None
+        for line in read_lines(self.proc_root_dir + "/self/cgroup"):
+            if line.startswith("0::"):
+                cgroup_path = line[3:].strip()
+        if cgroup_path is None:
+            return None
+
+        cpus = None
+        while True:
+            for line in read_lines(self.cgroup_root_dir + cgroup_path.rstrip("/") + "/cpu.max"):
+                quota, period = line.split()
+                if quota != "max":
+                    quota_cpus = max(1, int(ceil(float(quota) / float(period))))
+                    cpus = quota_cpus if cpus is None else min(cpus, quota_cpus)
+            if cgroup_path in ("", "/"):
+                return cpus
+            cgroup_path = os.path.dirname(cgroup_path.rstrip("/"))
+
+    def get_available_memory_kb(self):
+        for line in read_lines(self.proc_root_dir + "/meminfo"):
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1])
+        return None
+
+    def get_current_load(self):
+        for line in read_lines(self.proc_root_dir + "/loadavg"):
+            return float(line.split()[0])
+        return None
+
+
+def read_lines(file_path):
+    try:
+        with open(file_path) as a_file:
+            return a_file.read().splitlines()
+    except (IOError, OSError):
+        return []
+
+
+def format_load_average(load_average):
+    return ("%.2f" % load_average).rstrip("0").rstrip(".")
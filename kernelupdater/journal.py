@@ -0,0 +1,110 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+STATE_DIR = "/var/lib/kernel-updater"
+JOURNAL_FILE = STATE_DIR + "/journal.json"
+# tools whose upgrade between two runs invalidates what was built or generated with them
+TOOLS = ["make", "gcc", "ld", "genkernel", "dracut", "grub-mkconfig", "emerge"]
+
+
+class Journal(object):
+    """
+    On-disk record of the steps completed, with the inputs they ran against, so that an interrupted upgrade can be
+    resumed without redoing what is still valid.
+
+    The file is rewritten through a temporary file and a rename after each step, so that it is never left half written.
+    """
+
+    def __init__(self, journal_file=JOURNAL_FILE):
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.content = {"steps": {}, "values": {}}
+        if os.path.exists(journal_file):
+            try:
+                with open(journal_file) as a_file:
+                    self.content = json.load(a_file)
+            except ValueError:
+                print("Ignoring the unreadable journal " + journal_file)
+
+    def is_completed(self, step_name, inputs):
+        with self.lock:
+            step_record = self.content["steps"].get(step_name)
+        return step_record is not None and step_record["inputs"] == inputs
+
+    def get_completed_inputs(self, step_name):
+        with self.lock:
+            step_record = self.content["steps"].get(step_name)
+        return step_record["inputs"] if step_record is not None else None
+
+    def record(self, step_name, inputs, completed_at, duration=None):
+        with self.lock:
+            self.content["steps"][step_name] = {"inputs": inputs, "completed_at": completed_at, "duration": duration}
+            self.save()
+
+    def get_duration(self, step_name):
+        """
+        How long the last successful run of the step took, in seconds, if known.
+        """
+        with self.lock:
+            step_record = self.content["steps"].get(step_name)
+        return step_record.get("duration") if step_record is not None else None
+
+    def get_value(self, key):
+        with self.lock:
+            return self.content["values"].get(key)
+
+    def set_value(self, key, value):
+        with self.lock:
+            self.content["values"][key] = value
+            self.save()
+
+    def save(self):
+        journal_dir = os.path.dirname(self.journal_file)
+        if journal_dir and not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+        temporary_file = self.journal_file + ".tmp"
+        with open(temporary_file, "w") as a_file:
+            json.dump(self.content, a_file, indent=1, sort_keys=True)
+            a_file.flush()
+            os.fsync(a_file.fileno())
+        os.rename(temporary_file, self.journal_file)
+
+
+def get_file_hash(file_path):
+    if file_path is None or not os.path.exists(file_path):
+        return None
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as a_file:
+        for block in iter(lambda: a_file.read(1048576), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_file_stamp(file_path):
+    """
+    Size and modification time of a file, cheaper than a hash for the large build and install outputs.
+    """
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [file_stat.st_size, file_stat.st_mtime_ns]
+
+
+def get_tool_versions(tools=TOOLS):
+    """
+    Identifies the installed tools by the real path, size and modification time of their executable, which changes
+    with each upgrade, without running them.
+    """
+    tool_versions = {}
+    for tool in tools:
+        tool_path = shutil.which(tool)
+        if tool_path is not None:
+            real_path = os.path.realpath(tool_path)
+            tool_stat = os.stat(real_path)
+            tool_versions[tool] = real_path + ":" + str(tool_stat.st_size) + ":" + str(int(tool_stat.st_mtime))
+    return tool_versions
@@ -0,0 +1,214 @@
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+
+from kernelupdater.version import KernelVersion
+
+
+RUNNING_CONFIG_FILE = "/proc/config.gz"
+CONFIG_DIFF_CACHE_DIR = "/var/cache/kernel-updater/config-diffs"
+LOADED_MODULES_FILE = "/proc/modules"
+CONFIG_LINE_PATTERN = re.compile(r'^(CONFIG_\w+)=(.*)$')
+NOT_SET_LINE_PATTERN = re.compile(r'^# (CONFIG_\w+) is not set$')
+KCONFIG_SYMBOL_PATTERN = re.compile(r'^\s*(?:menu)?config\s+(\w+)\s*$', re.MULTILINE)
+# weights of the criteria in the score of a config, each criterion being between 0 and 1
+SIMILARITY_WEIGHT = 0.5
+COVERAGE_WEIGHT = 0.3
+RECENCY_WEIGHT = 0.2
+
+
+def read_config(config_file):
+    """
+    Options of a .config, gzipped or not, as a dict from symbol to value, "n" for the options not set.
+    """
+    options = {}
+    opener = gzip.open if config_file.endswith(".gz") else open
+    with opener(config_file, "rt", errors="replace") as a_file:
+        for line in a_file:
+            line = line.rstrip("\n")
+            match = CONFIG_LINE_PATTERN.match(line)
+            if match is not None:
+                options[match.group(1)] = match.group(2)
+                continue
+            match = NOT_SET_LINE_PATTERN.match(line)
+            if match is not None:
+                options[match.group(1)] = "n"
+    return options
+
+
+def get_enabled_options(options):
+    return frozenset((symbol, value) for symbol, value in options.items() if value != "n")
+
+
+def get_kconfig_symbols(source_dir):
+    """
+    Symbols declared by the Kconfig files of a source tree.
+    """
+    symbols = set()
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        # no Kconfig files in the build output nor in the git metadata
+        dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+        for name in file_names:
+            if name.startswith("Kconfig"):
+                with open(os.path.join(dir_path, name), errors="replace") as a_file:
+                    symbols.update("CONFIG_" + symbol for symbol in KCONFIG_SYMBOL_PATTERN.findall(a_file.read()))
+    return frozenset(symbols)
+
+
+def get_jaccard_index(first_set, second_set):
+    if not first_set and not second_set:
+        return 0.0
+    return len(first_set & second_set) / float(len(first_set | second_set))
+
+
+class ConfigScore(object):
+    def __init__(self, config_file, version, similarity, coverage, recency):
+        self.config_file = config_file
+        self.version = version
+        self.similarity = similarity
+        self.coverage = coverage
+        self.recency = recency
+        self.score = SIMILARITY_WEIGHT * similarity + COVERAGE_WEIGHT * coverage + RECENCY_WEIGHT * recency
+
+    def describe(self):
+        return "%.3f (running kernel %.3f, new Kconfig %.3f, recency %.3f) %s" \
+               % (self.score, self.similarity, self.coverage, self.recency, self.config_file)
+
+
+class ConfigRanker(object):
+    """
+    Ranks candidate .config files for a new kernel, the best first, by similarity of their enabled options to the
+    config of the running kernel, by how well their symbols match the ones declared by the Kconfig files of the new
+    sources, and by version.
+
+    Each config is parsed once into a set, comparisons are set operations.
+    """
+
+    def __init__(self, source_dir, running_config_file=RUNNING_CONFIG_FILE):
+        self.source_dir = source_dir
+        self.running_config_file = running_config_file
+
+    def rank(self, config_files):
+        running_options = frozenset()
+        if self.running_config_file is not None and os.path.exists(self.running_config_file):
+            running_options = get_enabled_options(read_config(self.running_config_file))
+        kconfig_symbols = get_kconfig_symbols(self.source_dir)
+
+        versions = dict((config_file, get_config_version(config_file)) for config_file in config_files)
+        by_version = sorted(config_files, key=lambda config_file: get_version_key(versions[config_file]))
+        scores = []
+        for index, config_file in enumerate(by_version):
+            options = read_config(config_file)
+            recency = index / float(len(by_version) - 1) if len(by_version) > 1 else 1.0
+            scores.append(ConfigScore(config_file, versions[config_file],
+                                      get_jaccard_index(get_enabled_options(options), running_options),
+                                      get_jaccard_index(frozenset(options), kconfig_symbols), recency))
+        return sorted(scores, key=lambda config_score: (config_score.score, config_score.recency), reverse=True)
+
+
+def get_config_version(config_file):
+    """
+    Version of the kernel a .config is in the source or build tree of, None when unknown.
+    """
+    config_dir = os.path.dirname(config_file)
+    release_file = config_dir + "/include/config/kernel.release"
+    if os.path.exists(release_file):
+        with open(release_file) as a_file:
+            version = KernelVersion.try_parse(a_file.read().strip())
+        if version is not None:
+            return version
+    return KernelVersion.try_parse(os.path.basename(config_dir))
+
+
+def get_version_key(version):
+    """
+    Sort key of possibly unknown versions, unknown ones first.
+    """
+    return (0, ()) if version is None else (1, version.key)
+
+
+class ConfigDiff(object):
+    """
+    Symbols added, removed, or whose value changed from a config to another, by symbol. Symbols not set count as set
+    to "n".
+    """
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    @staticmethod
+    def compute(before_options, after_options):
+        before_symbols = frozenset(before_options)
+        after_symbols = frozenset(after_options)
+        return ConfigDiff(dict((symbol, after_options[symbol]) for symbol in after_symbols - before_symbols),
+                          dict((symbol, before_options[symbol]) for symbol in before_symbols - after_symbols),
+                          dict((symbol, [before_options[symbol], after_options[symbol]])
+                               for symbol in before_symbols & after_symbols
+                               if before_options[symbol] != after_options[symbol]))
+
+    def to_dict(self):
+        return {"added": self.added, "removed": self.removed, "changed": self.changed}
+
+    @staticmethod
+    def from_dict(content):
+        return ConfigDiff(content["added"], content["removed"], content["changed"])
+
+    def describe(self):
+        lines = [str(len(self.added)) + " symbols added, " + str(len(self.removed)) + " removed, "
+                 + str(len(self.changed)) + " changed"]
+        lines += ["  + " + symbol + "=" + self.added[symbol] for symbol in sorted(self.added)]
+        lines += ["  - " + symbol + "=" + self.removed[symbol] for symbol in sorted(self.removed)]
+        lines += ["  ~ " + symbol + "=" + self.changed[symbol][0] + " -> " + self.changed[symbol][1]
+                  for symbol in sorted(self.changed)]
+        return "\n".join(lines)
+
+
+class ConfigDiffCache(object):
+    """
+    Configs resulting from the reconciliation of a config with new sources, and their diff, by versions, hash of the
+    config and make target. The directory can be shared by hosts upgrading the same way.
+    """
+
+    def __init__(self, cache_dir=CONFIG_DIFF_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def get_key(from_release, to_release, config_hash, target):
+        return (from_release or "unknown") + "_" + to_release + "_" + target + "_" + config_hash[0:16]
+
+    def get(self, key):
+        """
+        The cached diff and the path of the resulting config, or None.
+        """
+        diff_file = self.cache_dir + "/" + key + ".json"
+        config_file = self.cache_dir + "/" + key + ".config"
+        if not os.path.exists(diff_file) or not os.path.exists(config_file):
+            return None
+        with open(diff_file) as a_file:
+            return ConfigDiff.from_dict(json.load(a_file)), config_file
+
+    def put(self, key, config_diff, config_file):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # the config before the diff, a reader finding the diff finds the config
+        shutil.copyfile(config_file, self.cache_dir + "/" + key + ".config.tmp")
+        os.rename(self.cache_dir + "/" + key + ".config.tmp", self.cache_dir + "/" + key + ".config")
+        with open(self.cache_dir + "/" + key + ".json.tmp", "w") as a_file:
+            json.dump(config_diff.to_dict(), a_file, indent=1, sort_keys=True)
+        os.rename(self.cache_dir + "/" + key + ".json.tmp", self.cache_dir + "/" + key + ".json")
+
+
+def get_loaded_modules_hash(loaded_modules_file=LOADED_MODULES_FILE):
+    """
+    Hash of the names of the loaded modules, which localmodconfig keeps.
+    """
+    if not os.path.exists(loaded_modules_file):
+        return ""
+    with open(loaded_modules_file) as a_file:
+        names = sorted(line.split(" ", 1)[0] for line in a_file if line.strip())
+    return hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
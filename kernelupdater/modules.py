@@ -0,0 +1,164 @@
+import os
+import re
+import mmap
+
+from kernelupdater.jobs import format_load_average
+from kernelupdater.plan import format_duration
+
+
+VDB_DIR = "/var/db/pkg"
+EMERGE_LOG_FILE = "/var/log/emerge.log"
+# packages of the kernels themselves, which own the in-tree modules
+KERNEL_CATEGORY = "sys-kernel"
+EMERGE_START_PATTERN = re.compile(r'^(\d+):\s+>>> emerge \(\d+ of \d+\) (\S+) to ')
+EMERGE_END_PATTERN = re.compile(r'^(\d+):\s+::: completed emerge \(\d+ of \d+\) (\S+) to ')
+
+
+class ModulePackage(object):
+    """
+    An installed package owning kernel modules, with the module files it installed by kernel release.
+    """
+
+    def __init__(self, cpv):
+        self.cpv = cpv
+        self.modules_by_release = {}
+
+    def get_atom(self):
+        return "=" + self.cpv
+
+
+def find_module_packages(vdb_dir, modules_root_dir):
+    """
+    Packages of the installed package database owning files in the module directories, as the @module-rebuild set,
+    the kernel packages aside.
+    """
+    prefix = modules_root_dir.rstrip("/") + "/"
+    packages = []
+    for category in sorted(os.listdir(vdb_dir)):
+        category_dir = vdb_dir + "/" + category
+        if category == KERNEL_CATEGORY or not os.path.isdir(category_dir):
+            continue
+        for name in sorted(os.listdir(category_dir)):
+            contents_file = category_dir + "/" + name + "/CONTENTS"
+            if not os.path.exists(contents_file):
+                continue
+            package = ModulePackage(category + "/" + name)
+            with open(contents_file, errors="replace") as a_file:
+                for line in a_file:
+                    # obj <path> <md5> <mtime>, paths may contain spaces
+                    if not line.startswith("obj " + prefix):
+                        continue
+                    path = line[4:].rstrip("\n").rsplit(" ", 2)[0]
+                    release = path[len(prefix):].split("/", 1)[0]
+                    package.modules_by_release.setdefault(release, []).append(path)
+            if package.modules_by_release:
+                packages.append(package)
+    return packages
+
+
+def is_built_for(module_file, release, kernel_built_time=None):
+    """
+    Whether a module file exists, is not older than the kernel build and, when not compressed, has the vermagic of
+    release.
+    """
+    if not os.path.isfile(module_file):
+        return False
+    # a release rebuilt keeps its vermagic, the modules built before are stale against its symbols
+    if kernel_built_time is not None and os.path.getmtime(module_file) < kernel_built_time:
+        return False
+    if not module_file.endswith(".ko") or os.path.getsize(module_file) == 0:
+        return True
+    with open(module_file, "rb") as a_file:
+        with mmap.mmap(a_file.fileno(), 0, access=mmap.ACCESS_READ) as module_map:
+            return module_map.find(b"vermagic=" + release.encode("utf-8") + b" ") != -1
+
+
+def get_kernel_built_time(modules_root_dir, release):
+    """
+    When the kernel of release was last built, from the Module.symvers of its build directory, or else from the
+    modules.order of its modules directory. None when neither is there.
+    """
+    modules_dir = modules_root_dir + "/" + release
+    for stamp_file in [modules_dir + "/build/Module.symvers", modules_dir + "/modules.order"]:
+        if os.path.exists(stamp_file):
+            return os.path.getmtime(stamp_file)
+    return None
+
+
+def get_emerge_durations(emerge_log_file, offset):
+    """
+    Seconds each package took to merge, from the lines emerge logged after offset.
+    """
+    start_times = {}
+    durations = {}
+    with open(emerge_log_file, errors="replace") as a_file:
+        a_file.seek(offset)
+        for line in a_file:
+            match = EMERGE_START_PATTERN.match(line)
+            if match is not None:
+                start_times[match.group(2)] = int(match.group(1))
+                continue
+            match = EMERGE_END_PATTERN.match(line)
+            if match is not None and match.group(2) in start_times:
+                durations[match.group(2)] = int(match.group(1)) - start_times.pop(match.group(2))
+    return durations
+
+
+class ModuleRebuilder(object):
+    """
+    Rebuilds the out of tree modules for a new kernel, resolving the @module-rebuild set from the installed package
+    database so that the packages whose modules are already built for the release, since its kernel was last built,
+    are not merged again.
+
+    Packages are merged by a single emerge run with as many jobs as the machine can take, and the time each one took
+    is taken from the emerge log. @x11-module-rebuild is always passed on to emerge.
+    """
+
+    def __init__(self, vdb_dir=VDB_DIR, emerge_log_file=EMERGE_LOG_FILE):
+        self.vdb_dir = vdb_dir
+        self.emerge_log_file = emerge_log_file
+
+    def get_packages_to_rebuild(self, modules_root_dir, release):
+        """
+        The module packages to rebuild for release and the ones up to date, None and [] when there is no package
+        database to resolve them from.
+        """
+        if not os.path.isdir(self.vdb_dir):
+            return None, []
+        kernel_built_time = get_kernel_built_time(modules_root_dir, release)
+        packages = []
+        up_to_date_packages = []
+        for package in find_module_packages(self.vdb_dir, modules_root_dir):
+            module_files = package.modules_by_release.get(release, [])
+            if module_files and all(is_built_for(module_file, release, kernel_built_time)
+                                    for module_file in module_files):
+                up_to_date_packages.append(package)
+            else:
+                packages.append(package)
+        return packages, up_to_date_packages
+
+    @staticmethod
+    def get_command(packages, jobs_plan):
+        command = ["emerge", "-1q"]
+        if jobs_plan is not None:
+            # each package builds with its own make jobs, the load average keeps them from overloading the machine
+            jobs = jobs_plan.jobs if packages is None else max(1, min(jobs_plan.jobs, len(packages) + 1))
+            command += ["--jobs=" + str(jobs), "--load-average=" + format_load_average(jobs_plan.load_average)]
+        command.append("@x11-module-rebuild")
+        if packages is None:
+            command.append("@module-rebuild")
+        else:
+            command += [package.get_atom() for package in packages]
+        return command
+
+    def rebuild(self, command_runner, modules_root_dir, release, jobs_plan):
+        packages, up_to_date_packages = self.get_packages_to_rebuild(modules_root_dir, release)
+        for package in up_to_date_packages:
+            print("Skipping " + package.cpv + ", its modules are built for " + release)
+        log_offset = os.path.getsize(self.emerge_log_file) if os.path.exists(self.emerge_log_file) else None
+        command_runner.run_command(self.get_command(packages, jobs_plan))
+        if log_offset is None or not os.path.exists(self.emerge_log_file):
+            return
+        for cpv, seconds in sorted(get_emerge_durations(self.emerge_log_file, log_offset).items(),
+                                   key=lambda item: item[1], reverse=True):
+            print("Rebuilt " + cpv + " in " + format_duration(seconds))
@@ -0,0 +1,117 @@
+import os
+import json
+
+
+class PlannedStep(object):
+    def __init__(self, name, dependencies, commands, skip_reason, estimated_seconds):
+        self.name = name
+        self.dependencies = dependencies
+        self.commands = commands
+        self.skip_reason = skip_reason
+        self.estimated_seconds = estimated_seconds
+
+    def to_dict(self):
+        return {"name": self.name, "dependencies": list(self.dependencies), "commands": self.commands,
+                "skip_reason": self.skip_reason, "estimated_seconds": self.estimated_seconds}
+
+
+class PlannedRemoval(object):
+    def __init__(self, kind, path, size):
+        self.kind = kind
+        self.path = path
+        self.size = size
+
+    def to_dict(self):
+        return {"kind": self.kind, "path": self.path, "bytes": self.size}
+
+
+class Plan(object):
+    """
+    What an update would do: the commands of each step that would run, the trees and boot files it would remove and
+    the time it would take according to the durations of the previous runs.
+    """
+
+    def __init__(self, kernel, config_file, serial):
+        self.kernel = kernel
+        self.config_file = config_file
+        self.serial = serial
+        self.steps = []
+        self.removals = []
+
+    def add_step(self, planned_step):
+        self.steps.append(planned_step)
+
+    def add_removal(self, planned_removal):
+        self.removals.append(planned_removal)
+
+    def get_freed_bytes(self):
+        return sum(removal.size for removal in self.removals)
+
+    def get_estimated_seconds(self):
+        """
+        Estimated duration of the run, the longest chain of dependent steps when they run at the same time. Steps
+        never completed before count for nothing.
+        """
+        if self.serial:
+            return sum(step.estimated_seconds or 0 for step in self.steps)
+        finish_times = {}
+        for step in self.steps:
+            start_time = max([finish_times[dependency] for dependency in step.dependencies] or [0])
+            finish_times[step.name] = start_time + (step.estimated_seconds or 0)
+        return max(finish_times.values() or [0])
+
+    def has_unknown_durations(self):
+        return any(step.estimated_seconds is None for step in self.steps)
+
+    def to_dict(self):
+        return {"kernel": self.kernel, "config_file": self.config_file,
+                "steps": [step.to_dict() for step in self.steps],
+                "removals": [removal.to_dict() for removal in self.removals],
+                "freed_bytes": self.get_freed_bytes(), "estimated_seconds": self.get_estimated_seconds(),
+                "unknown_durations": self.has_unknown_durations()}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=1, sort_keys=True)
+
+    def describe(self):
+        lines = ["Plan for " + self.kernel + " with config " + str(self.config_file) + ":"]
+        for step in self.steps:
+            if step.skip_reason is not None:
+                lines.append("  " + step.name + ": skipped, " + step.skip_reason)
+                continue
+            lines.append("  " + step.name + ": " + format_duration(step.estimated_seconds))
+            lines += ["    $ " + " ".join(command) for command in step.commands]
+        if self.removals:
+            lines.append("Removals:")
+            lines += ["  %s %s (%.1f MB)" % (removal.kind, removal.path, removal.size / 1048576.0)
+                      for removal in self.removals]
+        lines.append("%.1f MB freed, about %s%s" % (self.get_freed_bytes() / 1048576.0,
+                                                    format_duration(self.get_estimated_seconds()),
+                                                    " plus the steps never run before"
+                                                    if self.has_unknown_durations() else ""))
+        return "\n".join(lines)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "duration unknown"
+    return "%dm%02ds" % (int(seconds) // 60, int(seconds) % 60)
+
+
+def get_tree_size(tree_dir):
+    """
+    Bytes of the files of a tree, symbolic links not followed.
+    """
+    size = 0
+    pending_dirs = [tree_dir]
+    while pending_dirs:
+        try:
+            with os.scandir(pending_dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    else:
+                        size += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return size
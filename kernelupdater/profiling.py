@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+
+BLOCK_SIZE = 512
+
+
+class Span(object):
+    """
+    A timed part of an upgrade run: a step of the pipeline, or a command run by one of the steps.
+    """
+
+    def __init__(self, name, category, start_time, thread_name):
+        self.name = name
+        self.category = category
+        self.start_time = start_time
+        self.end_time = start_time
+        self.thread_name = thread_name
+        self.counters = {}
+
+    def duration(self):
+        return self.end_time - self.start_time
+
+
+class Profiler(object):
+    """
+    Records the start, end, duration, peak memory of the child processes and bytes written or deleted of every step and
+    command of a run, and writes them as a Chrome trace (chrome://tracing, Perfetto) with a summary of the run.
+    """
+
+    def __init__(self, run_info=None):
+        self.run_info = dict(run_info or {})
+        self.run_info.setdefault("host", os.uname()[1])
+        self.start_time = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.current = threading.local()
+
+    @contextmanager
+    def span(self, name, category="step"):
+        span = Span(name, category, time.time(), threading.current_thread().name)
+        usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        previous_span = getattr(self.current, "span", None)
+        self.current.span = span
+        try:
+            yield span
+        finally:
+            self.current.span = previous_span
+            usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            span.end_time = time.time()
+            # the peak RSS of the children is a high-water mark of all the children waited for so far
+            span.counters["peak_child_rss_kb"] = usage_after.ru_maxrss
+            span.counters["child_cpu_time"] = usage_after.ru_utime + usage_after.ru_stime \
+                - usage_before.ru_utime - usage_before.ru_stime
+            span.counters["bytes_written"] = span.counters.get("bytes_written", 0) \
+                + (usage_after.ru_oublock - usage_before.ru_oublock) * BLOCK_SIZE
+            with self.lock:
+                self.spans.append(span)
+
+    def count(self, name, value):
+        """
+        Adds value to the counter name of the span being recorded in this thread, if any.
+        """
+        span = getattr(self.current, "span", None)
+        if span is not None:
+            span.counters[name] = span.counters.get(name, 0) + value
+
+    def record_command(self, result):
+        span = Span(" ".join(result.command_array), "command", result.start_time, threading.current_thread().name)
+        span.end_time = result.start_time + result.wall_time
+        span.counters["cpu_time"] = result.cpu_time
+        span.counters["peak_rss_kb"] = result.max_rss
+        span.counters["bytes_written"] = result.bytes_written
+        span.counters["return_code"] = result.return_code
+        with self.lock:
+            self.spans.append(span)
+
+    def get_summary(self):
+        steps = sorted((span for span in self.spans if span.category == "step"), key=Span.duration, reverse=True)
+        commands = sorted((span for span in self.spans if span.category == "command"), key=Span.duration,
+                          reverse=True)
+        end_time = max([self.start_time] + [span.end_time for span in self.spans])
+        return {
+            "run": self.run_info,
+            "started_at": self.start_time,
+            "duration": end_time - self.start_time,
+            "slowest_step": steps[0].name if steps else None,
+            "steps": [self.describe_span(span) for span in steps],
+            "slowest_commands": [self.describe_span(span) for span in commands[0:10]],
+        }
+
+    def to_chrome_trace(self):
+        thread_ids = {}
+        events = []
+        for span in sorted(self.spans, key=lambda a_span: a_span.start_time):
+            thread_id = thread_ids.setdefault(span.thread_name, len(thread_ids) + 1)
+            events.append({"name": span.name, "cat": span.category, "ph": "X", "pid": 1, "tid": thread_id,
+                           "ts": int((span.start_time - self.start_time) * 1000000),
+                           "dur": int(span.duration() * 1000000), "args": span.counters})
+        for thread_name, thread_id in thread_ids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": thread_id,
+                           "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms", "summary": self.get_summary()}
+
+    def write_report(self, report_file):
+        temporary_file = report_file + ".tmp"
+        with open(temporary_file, "w") as a_file:
+            json.dump(self.to_chrome_trace(), a_file, indent=1, sort_keys=True)
+        os.rename(temporary_file, report_file)
+
+    def print_summary(self):
+        summary = self.get_summary()
+        print("Run took %.1fs, slowest step: %s" % (summary["duration"], summary["slowest_step"]))
+        for step in summary["steps"]:
+            print("  %-20s %8.1fs" % (step["name"], step["duration"]))
+
+    @staticmethod
+    def describe_span(span):
+        description = {"name": span.name, "start": span.start_time, "duration": span.duration()}
+        description.update(span.counters)
+        return description
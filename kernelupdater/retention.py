@@ -0,0 +1,146 @@
+import os
+import re
+
+
+DEFAULT_KEEP_LAST = 2
+DEFAULT_KEEP_ARCHIVES = 5
+GRUBENV_SAVED_ENTRY_PATTERN = re.compile(r'^saved_entry=(.*)$', re.MULTILINE)
+
+
+class RetentionReport(object):
+    """
+    The versions a retention policy removes, and why each of the others is kept.
+    """
+
+    def __init__(self):
+        self.to_remove = []
+        self.kept = []
+        self.boot_bytes_reclaimed = 0
+        self.boot_free_bytes = None
+
+    def keep(self, version, reason):
+        self.kept.append((version, reason))
+
+    def remove(self, version, boot_bytes):
+        self.to_remove.append(version)
+        self.boot_bytes_reclaimed += boot_bytes
+
+    def describe(self):
+        lines = ["Keeping " + version.release + " (" + reason + ")" for version, reason in self.kept]
+        lines.append("Removing " + str(len(self.to_remove)) + " kernels"
+                     + (": " + ", ".join(version.release for version in self.to_remove) if self.to_remove else "")
+                     + ", %.1f MB reclaimed in /boot" % (self.boot_bytes_reclaimed / 1048576.0))
+        if self.boot_free_bytes is not None:
+            lines.append("%.1f MB free in /boot afterwards" % (self.boot_free_bytes / 1048576.0))
+        return "\n".join(lines)
+
+
+class RetentionPolicy(object):
+    """
+    Chooses the kernels to remove among the ones of the inventory.
+
+    Kept are: the selected kernel and the keep_last - 1 versions before it, the keep_per_series newest of each series,
+    the versions newer than the selected one unless prune_newer, and always the protected ones, the running and
+    default boot kernels. When /boot would still have less than min_boot_free_mb free, the oldest of the kept
+    versions that are neither protected nor newer than the selected one are removed too, until it has.
+
+    Of the archives of the removed kernels, the keep_archives newest are kept.
+    """
+
+    def __init__(self, keep_last=DEFAULT_KEEP_LAST, keep_per_series=0, min_boot_free_mb=None, prune_newer=False,
+                 protected_releases=None, keep_archives=DEFAULT_KEEP_ARCHIVES):
+        self.keep_last = keep_last
+        self.keep_per_series = keep_per_series
+        self.min_boot_free_mb = min_boot_free_mb
+        self.prune_newer = prune_newer
+        self.protected_releases = protected_releases
+        self.keep_archives = keep_archives
+
+    def get_protected_releases(self, boot_dir, releases):
+        if self.protected_releases is not None:
+            return dict(self.protected_releases)
+        protected_releases = {os.uname().release: "running"}
+        default_release = get_default_boot_release(boot_dir, releases)
+        if default_release is not None:
+            protected_releases.setdefault(default_release, "default boot entry")
+        return protected_releases
+
+    def select(self, inventory, selected_version):
+        """
+        Goes once over the versions of the inventory, newest first, returning a RetentionReport.
+        """
+        versions = sorted(inventory.entries, reverse=True)
+        protected_releases = self.get_protected_releases(inventory.boot_dir, [version.release for version in versions])
+        report = RetentionReport()
+        kept_by_series = {}
+        kept_before_selected = 0
+        removable_kept = []
+        for version in versions:
+            if version == selected_version:
+                reason = "selected"
+            elif version.release in protected_releases:
+                reason = protected_releases[version.release]
+            elif selected_version is not None and version > selected_version and not self.prune_newer:
+                reason = "newer than the selected kernel"
+            elif selected_version is not None and version < selected_version \
+                    and kept_before_selected < self.keep_last - 1:
+                reason = "one of the last " + str(self.keep_last)
+                kept_before_selected += 1
+            elif kept_by_series.get(version.get_series(), 0) < self.keep_per_series:
+                reason = "one of the last " + str(self.keep_per_series) + " of " + version.get_series()
+            else:
+                reason = None
+
+            if reason is None:
+                report.remove(version, get_boot_size(inventory.get_entry(version)))
+                continue
+            kept_by_series[version.get_series()] = kept_by_series.get(version.get_series(), 0) + 1
+            report.keep(version, reason)
+            # the newer kernels are left alone unless prune_newer, even to free /boot
+            if version != selected_version and version.release not in protected_releases \
+                    and not (selected_version is not None and version > selected_version and not self.prune_newer):
+                removable_kept.append(version)
+
+        if self.min_boot_free_mb is not None and os.path.isdir(inventory.boot_dir):
+            boot_stat = os.statvfs(inventory.boot_dir)
+            free_bytes = boot_stat.f_bavail * boot_stat.f_frsize + report.boot_bytes_reclaimed
+            # oldest first
+            for version in reversed(removable_kept):
+                if free_bytes >= self.min_boot_free_mb * 1048576:
+                    break
+                boot_bytes = get_boot_size(inventory.get_entry(version))
+                if boot_bytes == 0:
+                    continue
+                report.kept = [(kept, reason) for kept, reason in report.kept if kept != version]
+                report.remove(version, boot_bytes)
+                free_bytes += boot_bytes
+            report.boot_free_bytes = free_bytes
+        report.to_remove.sort()
+        return report
+
+    def select_archives(self, archived_versions):
+        """
+        Archived versions whose archive is removed, oldest first.
+        """
+        return sorted(archived_versions)[0:max(0, len(archived_versions) - self.keep_archives)]
+
+
+def get_boot_size(entry):
+    return sum(boot_artifact.get_size() for boot_artifact in entry.boot_artifacts)
+
+
+def get_default_boot_release(boot_dir, releases):
+    """
+    Release of the entry saved as default in the grub environment block, if any.
+    """
+    grubenv_file = boot_dir + "/grub/grubenv"
+    if not os.path.exists(grubenv_file):
+        return None
+    with open(grubenv_file, errors="replace") as a_file:
+        match = GRUBENV_SAVED_ENTRY_PATTERN.search(a_file.read())
+    if match is None:
+        return None
+    # entries are named after the release, as in gnulinux-4.14.10-gentoo-advanced-<uuid>, the longest match wins
+    matching_releases = [release for release in releases
+                         if re.search(r'(^|[^\w.])' + re.escape(release) + r'($|[^\w.])', match.group(1))]
+    return max(matching_releases, key=len) if matching_releases else None
@@ -0,0 +1,140 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Step(object):
+    """
+    A named unit of work of the update pipeline, with the names of the steps that must be done before it can start.
+
+    The optional fingerprint function describes the inputs and outputs of the step: a step whose fingerprint is the
+    same as after its last success has nothing to do.
+    """
+
+    def __init__(self, name, function, dependencies=(), fingerprint=None):
+        self.name = name
+        self.function = function
+        self.dependencies = tuple(dependencies)
+        self.fingerprint = fingerprint
+
+
+class StepScheduler(object):
+    """
+    Runs steps as soon as all of their dependencies are done, independent steps running at the same time.
+
+    Steps are run in declaration order when serial, which is the order the pipeline used to have.
+
+    With a journal, each completed step is recorded with the inputs of the run. When resuming, a step recorded with the
+    same inputs is skipped, unless one of its dependencies had to be run again. Steps with a fingerprint are also
+    skipped outside of resuming when up to date, whatever their dependencies did.
+    """
+
+    def __init__(self, max_workers=4, profiler=None, journal=None, journal_inputs=None):
+        self.max_workers = max_workers
+        self.profiler = profiler
+        self.journal = journal
+        self.journal_inputs = journal_inputs
+        self.steps = []
+        self.resume = False
+        self.skip_up_to_date = False
+        self.executed = set()
+        self.lock = threading.Lock()
+
+    def add_step(self, name, function, dependencies=(), fingerprint=None):
+        known_names = [step.name for step in self.steps]
+        if name in known_names:
+            raise ValueError("Step " + name + " declared twice")
+        for dependency in dependencies:
+            if dependency not in known_names:
+                raise ValueError("Step " + name + " depends on unknown step " + dependency)
+        self.steps.append(Step(name, function, dependencies, fingerprint))
+
+    def run(self, serial=False, resume=False, skip_up_to_date=False):
+        self.resume = resume
+        self.skip_up_to_date = skip_up_to_date
+        self.executed = set()
+        if serial:
+            for step in self.steps:
+                self.run_step(step)
+        else:
+            self.run_parallel()
+
+    def plan(self, resume=False, skip_up_to_date=False):
+        """
+        The steps in declaration order, each with the reason it would be skipped or None when it would run, without
+        running anything. Steps are judged on the current state, not on what the steps before them would change.
+        """
+        self.resume = resume
+        self.skip_up_to_date = skip_up_to_date
+        self.executed = set()
+        planned_steps = []
+        for step in self.steps:
+            skip_reason = self.get_skip_reason(step)
+            if skip_reason is None:
+                self.executed.add(step.name)
+            planned_steps.append((step, skip_reason))
+        return planned_steps
+
+    def run_parallel(self):
+        done = set()
+        pending = list(self.steps)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for step in [step for step in pending if done.issuperset(step.dependencies)]:
+                    pending.remove(step)
+                    running[executor.submit(self.run_step, step)] = step
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # let the steps already started finish, but do not start any new one
+                        wait(running)
+                        raise error
+                    done.add(step.name)
+
+    def run_step(self, step):
+        skip_reason = self.get_skip_reason(step)
+        if skip_reason is not None:
+            print("Skipping step " + step.name + ", " + skip_reason)
+            return
+        print("Running step " + step.name + "...")
+        start_time = time.time()
+        if self.profiler is None:
+            step.function()
+        else:
+            with self.profiler.span(step.name):
+                step.function()
+        with self.lock:
+            self.executed.add(step.name)
+        if self.journal is not None:
+            completed_at = time.time()
+            self.journal.record(step.name, self.get_step_inputs(step), completed_at, completed_at - start_time)
+
+    def get_skip_reason(self, step):
+        if self.is_up_to_date(step):
+            return "up to date"
+        if self.can_skip(step):
+            return "completed by a previous run"
+        return None
+
+    def get_step_inputs(self, step):
+        inputs = dict(self.journal_inputs or {})
+        if step.fingerprint is not None:
+            inputs["fingerprint"] = step.fingerprint()
+        return inputs
+
+    def is_up_to_date(self, step):
+        if self.journal is None or step.fingerprint is None or not (self.skip_up_to_date or self.resume):
+            return False
+        return self.journal.is_completed(step.name, self.get_step_inputs(step))
+
+    def can_skip(self, step):
+        if not self.resume or self.journal is None or step.fingerprint is not None:
+            return False
+        with self.lock:
+            if self.executed.intersection(step.dependencies):
+                return False
+        return self.journal.is_completed(step.name, self.journal_inputs)
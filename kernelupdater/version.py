@@ -0,0 +1,92 @@
+import re
+from functools import lru_cache, total_ordering
+
+
+# linux-4.14.8-gentoo-r1, 4.15-rc3, 5.10.1-gentoo-x86_64, 6.1.2-gentoo-dist...
+VERSION_PATTERN = re.compile(r'^(?:linux-)?(\d+)\.(\d+)(?:\.(\d+))?(?:-rc(\d+))?(?:-(.+?))?(?:-r(\d+))?$')
+
+
+@total_ordering
+class KernelVersion(object):
+    """
+    A kernel release, as found in the names of the source trees, module directories and boot files.
+
+    Versions are hashable and ordered: release candidates come before the release, which comes before its gentoo
+    revisions.
+    """
+
+    __slots__ = ("release", "major", "minor", "patch", "rc", "local", "revision", "key")
+
+    def __init__(self, release, major, minor, patch, rc, local, revision):
+        self.release = release
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+        self.rc = rc
+        self.local = local
+        self.revision = revision
+        self.key = (major, minor, patch, 0 if rc else 1, rc, revision, local, release)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def parse(name):
+        """
+        Parses a release or a source tree name, raising ValueError when it is not one.
+        """
+        match = VERSION_PATTERN.match(name)
+        if match is None:
+            raise ValueError("Not a kernel version: " + name)
+        major, minor, patch, rc, local, revision = match.groups()
+        return KernelVersion(re.sub('^linux-', '', name), int(major), int(minor), int(patch or 0), int(rc or 0),
+                             local or "", int(revision or 0))
+
+    @staticmethod
+    def try_parse(name):
+        try:
+            return KernelVersion.parse(name)
+        except ValueError:
+            return None
+
+    def get_series(self):
+        return str(self.major) + "." + str(self.minor)
+
+    def get_source_dir_name(self):
+        return "linux-" + self.release
+
+    def get_package_version(self):
+        package_version = str(self.major) + "." + str(self.minor)
+        # release candidates of a series are 4.15_rc3, not 4.15.0_rc3
+        if self.patch or not self.rc:
+            package_version += "." + str(self.patch)
+        if self.rc:
+            package_version += "_rc" + str(self.rc)
+        if self.revision:
+            package_version += "-r" + str(self.revision)
+        return package_version
+
+    def get_package_atom(self):
+        if self.local.endswith("dist"):
+            package_name = "gentoo-kernel"
+        elif self.local:
+            package_name = self.local.split("-")[0] + "-sources"
+        else:
+            package_name = "vanilla-sources"
+        return "=" + package_name + "-" + self.get_package_version()
+
+    def __eq__(self, other):
+        return isinstance(other, KernelVersion) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return self.release
+
+    def __repr__(self):
+        return "KernelVersion(" + self.release + ")"
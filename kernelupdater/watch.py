@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import subprocess
+
+from kernelupdater.jobs import CGROUP_ROOT_DIR, JobsPlanner
+from kernelupdater.journal import STATE_DIR
+from kernelupdater.plan import get_tree_size
+from kernelupdater.version import KernelVersion
+
+
+WATCH_STATE_FILE = STATE_DIR + "/watch.json"
+PREBUILD_CGROUP = "kernel-updater-prebuild"
+CGROUP_PERIOD_US = 100000
+DEFAULT_CPU_PERCENT = 50
+DEFAULT_SETTLE_SECONDS = 60
+DEFAULT_SETTLE_TIMEOUT = 3600
+MAX_PREBUILD_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 300
+# from linux/inotify.h
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher(object):
+    """
+    The directories created in or moved into a directory, from the inotify events of the kernel.
+    """
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, directory.encode("utf-8"), IN_CREATE | IN_MOVED_TO | IN_ONLYDIR) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "Cannot watch " + directory)
+
+    def wait(self, timeout):
+        """
+        Names of the directories that appeared, waiting for some up to timeout seconds.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = os.read(self.fd, 65536)
+        names = []
+        offset = 0
+        while offset < len(events):
+            _, mask, _, length = INOTIFY_EVENT_HEADER.unpack_from(events, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            if mask & IN_ISDIR:
+                names.append(events[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace"))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    The directories that appeared in a directory, from listings, where inotify is not available.
+    """
+
+    def __init__(self, directory, poll_interval):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.names = set(os.listdir(directory))
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+        names = set(os.listdir(self.directory))
+        new_names = sorted(name for name in names - self.names if os.path.isdir(self.directory + "/" + name))
+        self.names = names
+        return new_names
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, poll_interval):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as error:
+        print("Polling " + directory + " every " + str(poll_interval) + "s, inotify is not available: " + str(error))
+        return PollingWatcher(directory, poll_interval)
+
+
+class SourceWatcher(object):
+    """
+    Waits for new kernel source trees to be merged in the kernel root directory.
+
+    The trees already handled, and the releases prebuilt and waiting to be confirmed, are kept in the state file, so
+    that a restart does not build them again. The trees there when the watch is first started are not built. A tree
+    whose prebuild failed is retried up to max_attempts times in all.
+    """
+
+    def __init__(self, kernel_root_dir, state_file=WATCH_STATE_FILE, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 poll_interval=DEFAULT_POLL_INTERVAL, settle_timeout=DEFAULT_SETTLE_TIMEOUT,
+                 max_attempts=MAX_PREBUILD_ATTEMPTS):
+        self.kernel_root_dir = kernel_root_dir
+        self.state_file = state_file
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.settle_timeout = settle_timeout
+        self.max_attempts = max_attempts
+        self.state = {"known_trees": [], "prebuilt": {}, "failed_attempts": {}}
+        if os.path.exists(state_file):
+            with open(state_file) as a_file:
+                self.state.update(json.load(a_file))
+        else:
+            self.state["known_trees"] = self.get_source_trees()
+            self.save()
+
+    def get_source_trees(self):
+        return sorted(name for name in os.listdir(self.kernel_root_dir)
+                      if KernelVersion.try_parse(name) is not None and name.startswith("linux-")
+                      and os.path.isdir(self.kernel_root_dir + "/" + name)
+                      and not os.path.islink(self.kernel_root_dir + "/" + name))
+
+    def get_new_trees(self):
+        """
+        Source trees not handled yet, oldest first.
+        """
+        return sorted((name for name in self.get_source_trees() if name not in self.state["known_trees"]),
+                      key=KernelVersion.parse)
+
+    def wait_for_new_tree(self):
+        """
+        Blocks until a new source tree is there, returning the newest, the events only waking up the listing.
+        """
+        watcher = create_watcher(self.kernel_root_dir, self.poll_interval)
+        try:
+            while True:
+                new_trees = self.get_new_trees()
+                if new_trees:
+                    return new_trees[-1]
+                watcher.wait(self.poll_interval)
+        finally:
+            watcher.close()
+
+    def wait_until_settled(self, tree_dir):
+        """
+        Waits until the size of the tree stops changing, returning False if it is removed meanwhile, or if it has no
+        Makefile or still changes after settle_timeout seconds.
+        """
+        deadline = time.monotonic() + self.settle_timeout
+        tree_size = None
+        while True:
+            if not os.path.isdir(tree_dir):
+                return False
+            new_tree_size = get_tree_size(tree_dir) if os.path.exists(tree_dir + "/Makefile") else None
+            if new_tree_size is not None and new_tree_size == tree_size:
+                return True
+            if time.monotonic() >= deadline:
+                print("Giving up on " + tree_dir + ", not a complete source tree after "
+                      + str(self.settle_timeout) + "s")
+                return False
+            tree_size = new_tree_size
+            time.sleep(self.settle_seconds)
+
+    def mark_known(self, tree_name):
+        if tree_name not in self.state["known_trees"]:
+            self.state["known_trees"].append(tree_name)
+            self.state["failed_attempts"].pop(tree_name, None)
+            self.save()
+
+    def record_failure(self, tree_name):
+        """
+        Counts a failed prebuild of the tree, which is marked known once it failed max_attempts times. Returns
+        whether it is retried.
+        """
+        attempts = self.state["failed_attempts"].get(tree_name, 0) + 1
+        if attempts >= self.max_attempts:
+            print("Giving up on " + tree_name + " after " + str(attempts) + " failed prebuilds")
+            self.mark_known(tree_name)
+            return False
+        self.state["failed_attempts"][tree_name] = attempts
+        self.save()
+        return True
+
+    def record_prebuilt(self, release, config_file):
+        self.state["prebuilt"][release] = {"config_file": config_file, "prebuilt_at": time.time()}
+        self.save()
+
+    def get_prebuilt_config(self, release):
+        """
+        Config file release was prebuilt with, None when it was not prebuilt.
+        """
+        prebuilt = self.state["prebuilt"].get(release)
+        return prebuilt["config_file"] if prebuilt is not None else None
+
+    def forget_prebuilt(self, release):
+        if self.state["prebuilt"].pop(release, None) is not None:
+            self.save()
+
+    def get_prebuilt_releases(self):
+        """
+        Releases prebuilt and not confirmed yet, newest first.
+        """
+        return sorted(self.state["prebuilt"], key=KernelVersion.parse, reverse=True)
+
+    def save(self):
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.isdir(state_dir):
+            os.makedirs(state_dir)
+        with open(self.state_file + ".tmp", "w") as a_file:
+            json.dump(self.state, a_file, indent=1, sort_keys=True)
+        os.rename(self.state_file + ".tmp", self.state_file)
+
+
+def lower_priority(cpu_percent=DEFAULT_CPU_PERCENT, cgroup_root_dir=CGROUP_ROOT_DIR):
+    """
+    Makes this process and the commands it runs yield to the other work of the machine: lowest CPU and idle I/O
+    priority, and a cgroup capping it to cpu_percent of the usable CPUs, which the jobs planner then sizes make for.
+    """
+    os.nice(19)
+    try:
+        subprocess.call(["ionice", "-c", "3", "-p", str(os.getpid())])
+    except OSError as error:
+        print("Keeping the I/O priority, ionice failed: " + str(error))
+
+    cpus = JobsPlanner(cgroup_root_dir=cgroup_root_dir).get_usable_cpus()
+    cgroup_dir = cgroup_root_dir + "/" + PREBUILD_CGROUP
+    try:
+        with open(cgroup_root_dir + "/cgroup.subtree_control", "w") as a_file:
+            a_file.write("+cpu")
+        if not os.path.isdir(cgroup_dir):
+            os.mkdir(cgroup_dir)
+        with open(cgroup_dir + "/cpu.max", "w") as a_file:
+            a_file.write("%d %d" % (max(1000, cpus * cpu_percent * CGROUP_PERIOD_US // 100), CGROUP_PERIOD_US))
+        with open(cgroup_dir + "/cgroup.procs", "w") as a_file:
+            a_file.write(str(os.getpid()))
+        print("Capped to " + str(cpu_percent) + "% of " + str(cpus) + " CPUs in " + cgroup_dir)
+    except OSError as error:
+        print("Not capping the CPU use, the cgroup " + cgroup_dir + " cannot be set up: " + str(error))
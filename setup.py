@@ -29,11 +29,16 @@ setup(
         'Development Status :: 3 - Alpha',
         'Topic :: System :: Operating System Kernels :: Linux',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5'
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11'
     ],
+    python_requires='>=3.7',
     keywords='gentoo kernel linux',
-    packages=find_packages(exclude=['contrib', 'tests']),
+    packages=find_packages(exclude=['contrib', 'tests', 'benchmarks']),
     entry_points={
         'console_scripts': [
             'kernel-updater=kernelupdater.cli:main',
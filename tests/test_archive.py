@@ -0,0 +1,96 @@
+import os
+import json
+import shutil
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.archive import KernelArchiver
+from kernelupdater.inventory import KernelInventory
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+def read(fname):
+    with open(fname) as a_file:
+        return a_file.read()
+
+
+class KernelArchiverTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.kernel_root_dir = self.root_dir + "/usr/src"
+        self.modules_root_dir = self.root_dir + "/lib/modules"
+        self.boot_dir = self.root_dir + "/boot"
+        self.archive_dir = self.root_dir + "/archives"
+        os.makedirs(self.boot_dir)
+        for release in ["4.11.8-gentoo", "4.11.9-gentoo"]:
+            os.makedirs(self.kernel_root_dir + "/linux-" + release)
+            write(self.kernel_root_dir + "/linux-" + release + "/.config", "CONFIG_" + release + "=y\n")
+            os.makedirs(self.modules_root_dir + "/" + release + "/kernel/drivers")
+            write(self.modules_root_dir + "/" + release + "/kernel/drivers/e1000e.ko", "same module")
+            write(self.modules_root_dir + "/" + release + "/modules.dep", "deps of " + release)
+            os.symlink(self.kernel_root_dir + "/linux-" + release, self.modules_root_dir + "/" + release + "/build")
+            write(self.boot_dir + "/vmlinuz-" + release, "kernel " + release)
+        self.inventory = KernelInventory(self.kernel_root_dir, self.modules_root_dir, self.boot_dir)
+        self.archiver = KernelArchiver(archive_dir=self.archive_dir, compression="gzip", hash_workers=2)
+
+    def archive(self, release):
+        entry = [entry for version, entry in self.inventory.entries.items() if version.release == release][0]
+        self.archiver.archive(entry, entry.source_dir + "/.config")
+
+    def test_files_identical_to_previous_archive_are_referenced(self):
+        self.archive("4.11.8-gentoo")
+        self.archive("4.11.9-gentoo")
+
+        with open(self.archive_dir + "/4.11.9-gentoo.json") as a_file:
+            manifest = json.load(a_file)
+        archives_by_name = dict((file_record["name"], file_record["archive"]) for file_record in manifest["files"])
+        self.assertEqual({"boot/vmlinuz-4.11.9-gentoo": "4.11.9-gentoo",
+                          "modules/kernel/drivers/e1000e.ko": "4.11.8-gentoo",
+                          "modules/modules.dep": "4.11.9-gentoo",
+                          "config": "4.11.9-gentoo"}, archives_by_name)
+
+    def test_restore(self):
+        self.archive("4.11.8-gentoo")
+        self.archive("4.11.9-gentoo")
+        shutil.rmtree(self.modules_root_dir + "/4.11.9-gentoo")
+        os.remove(self.boot_dir + "/vmlinuz-4.11.9-gentoo")
+        os.remove(self.kernel_root_dir + "/linux-4.11.9-gentoo/.config")
+
+        self.archiver.restore("4.11.9-gentoo", self.boot_dir, self.modules_root_dir, self.kernel_root_dir)
+
+        restored_modules_dir = self.modules_root_dir + "/4.11.9-gentoo"
+        self.assertEqual("kernel 4.11.9-gentoo", read(self.boot_dir + "/vmlinuz-4.11.9-gentoo"))
+        self.assertEqual("same module", read(restored_modules_dir + "/kernel/drivers/e1000e.ko"))
+        self.assertEqual("deps of 4.11.9-gentoo", read(restored_modules_dir + "/modules.dep"))
+        self.assertEqual(self.kernel_root_dir + "/linux-4.11.9-gentoo", os.readlink(restored_modules_dir + "/build"))
+        self.assertEqual("CONFIG_4.11.9-gentoo=y\n", read(self.kernel_root_dir + "/linux-4.11.9-gentoo/.config"))
+
+    def test_restore_of_unknown_release_fails(self):
+        with self.assertRaises(ValueError):
+            self.archiver.restore("4.10.1-gentoo", self.boot_dir, self.modules_root_dir, self.kernel_root_dir)
+
+    def test_referenced_archive_is_not_rewritten(self):
+        self.archive("4.11.8-gentoo")
+        self.archive("4.11.9-gentoo")
+        write(self.modules_root_dir + "/4.11.8-gentoo/kernel/drivers/e1000e.ko", "restored then changed")
+
+        self.archive("4.11.8-gentoo")
+        shutil.rmtree(self.modules_root_dir + "/4.11.9-gentoo")
+        self.archiver.restore("4.11.9-gentoo", self.boot_dir, self.modules_root_dir, self.kernel_root_dir)
+
+        self.assertEqual("same module", read(self.modules_root_dir + "/4.11.9-gentoo/kernel/drivers/e1000e.ko"))
+
+    def test_pruned_archive_is_kept_while_referenced(self):
+        self.archive("4.11.8-gentoo")
+        self.archive("4.11.9-gentoo")
+
+        self.archiver.prune([version for version in self.archiver.get_archived_versions()
+                             if version.release == "4.11.8-gentoo"])
+
+        self.assertEqual(["4.11.9-gentoo"], [version.release for version in self.archiver.get_archived_versions()])
+        self.assertTrue(os.path.exists(self.archive_dir + "/4.11.8-gentoo.tar.gz"))
+        self.archiver.prune(self.archiver.get_archived_versions())
+        self.assertEqual([], os.listdir(self.archive_dir))
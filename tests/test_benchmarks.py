@@ -0,0 +1,25 @@
+import unittest
+from benchmarks import scanning
+
+
+class ScanningBenchmarksTest(unittest.TestCase):
+    def test_scanning_paths_do_not_grow_faster_than_baseline(self):
+        results = scanning.run_benchmarks([20, 40, 80])
+
+        regressions = scanning.check_against_baseline(scanning.get_growth_exponents(results),
+                                                      scanning.load_baseline())
+
+        self.assertEqual([], regressions)
+
+    def test_synthetic_trees_mix_revisions_and_stray_files(self):
+        trees = scanning.SyntheticTrees(6)
+        try:
+            kernel_updater = trees.create_kernel_updater()
+            self.assertEqual("linux-4.0.1-gentoo-r2", kernel_updater.selected_kernel.selected_kernel)
+            self.assertEqual(4, len(kernel_updater.get_old_kernels_to_clean()))
+        finally:
+            trees.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
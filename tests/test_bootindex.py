@@ -0,0 +1,50 @@
+import os
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.bootindex import BootIndex
+
+
+def touch(fname, times=None):
+    with open(fname, 'a'):
+        os.utime(fname, times)
+
+
+class BootIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.boot_dir = mkdtemp()
+        for name in ["vmlinuz-4.14.8-gentoo-r1", "vmlinuz-4.14.8-gentoo-r1.old", "System.map-4.14.8-gentoo-r1",
+                     "config-4.14.8-gentoo-r1", "initramfs-genkernel-x86_64-4.14.8-gentoo-r1",
+                     "vmlinuz-4.14.10-gentoo", "initramfs-4.14.10-gentoo.img", "config-4.13.16-gentoo.old",
+                     "memtest86+.bin", "grub.cfg"]:
+            touch(self.boot_dir + "/" + name)
+        os.mkdir(self.boot_dir + "/grub")
+        self.boot_index = BootIndex(self.boot_dir)
+
+    def test_artifacts_by_release(self):
+        artifacts = self.boot_index.get_artifacts("4.14.8-gentoo-r1")
+
+        self.assertEqual(["System.map", "config", "initramfs", "kernel", "kernel"],
+                         sorted(artifact.kind for artifact in artifacts))
+        self.assertEqual(["vmlinuz-4.14.8-gentoo-r1.old"], [artifact.name for artifact in artifacts if artifact.old])
+        self.assertEqual(["initramfs-4.14.10-gentoo.img", "vmlinuz-4.14.10-gentoo"],
+                         sorted(artifact.name for artifact in self.boot_index.get_artifacts("4.14.10-gentoo")))
+        self.assertEqual([], self.boot_index.get_artifacts("4.14.8-gentoo"))
+
+    def test_genkernel_files(self):
+        for name in ["kernel-genkernel-x86_64-4.11.8-gentoo", "initramfs-genkernel-x86_64-4.11.8-gentoo",
+                     "System.map-genkernel-x86_64-4.11.8-gentoo"]:
+            touch(self.boot_dir + "/" + name)
+
+        artifacts = BootIndex(self.boot_dir).get_artifacts("4.11.8-gentoo")
+
+        self.assertEqual([("System.map", "System.map-genkernel-x86_64-4.11.8-gentoo"),
+                          ("initramfs", "initramfs-genkernel-x86_64-4.11.8-gentoo"),
+                          ("kernel", "kernel-genkernel-x86_64-4.11.8-gentoo")],
+                         sorted((artifact.kind, artifact.name) for artifact in artifacts))
+
+    def test_installed_kernel_releases(self):
+        self.assertEqual(["4.14.10-gentoo", "4.14.8-gentoo-r1"], self.boot_index.get_kernel_releases())
+
+
+if __name__ == '__main__':
+    unittest.main()
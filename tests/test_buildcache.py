@@ -0,0 +1,42 @@
+import unittest
+from kernelupdater.buildcache import BuildCache
+
+
+class RecordingCommandRunner(object):
+    def __init__(self):
+        self.commands = []
+        self.envs = []
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(" ".join(command_array))
+        self.envs.append(env)
+
+
+class BuildCacheTest(unittest.TestCase):
+    def test_parse_ccache4_statistics(self):
+        statistics = BuildCache.parse_statistics(["stats_updated_timestamp\t1700000000",
+                                                  "direct_cache_hit\t900",
+                                                  "preprocessed_cache_hit\t100",
+                                                  "cache_miss\t250",
+                                                  "cache_size_kibibyte\t2048",
+                                                  "not a stats line"])
+
+        self.assertEqual(1000, statistics.hits)
+        self.assertEqual(250, statistics.misses)
+        self.assertAlmostEqual(0.8, statistics.hit_ratio())
+        self.assertIn("2.0 MB", statistics.describe())
+
+    def test_prepare_caps_size_in_cache_dir(self):
+        command_runner = RecordingCommandRunner()
+        build_cache = BuildCache(command_runner, cache_dir="/tmp/kernel-ccache-test", max_size="2G")
+
+        build_cache.prepare()
+
+        self.assertEqual(["ccache --max-size 2G", "ccache --zero-stats"], command_runner.commands)
+        self.assertEqual("/tmp/kernel-ccache-test", command_runner.envs[0]["CCACHE_DIR"])
+        self.assertEqual(["CC=ccache gcc", "HOSTCC=ccache gcc"], build_cache.make_variables())
+        self.assertIsNone(build_cache.get_statistics())
+
+
+if __name__ == '__main__':
+    unittest.main()
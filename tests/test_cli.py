@@ -0,0 +1,56 @@
+import os
+import unittest
+from tempfile import mkdtemp
+import kernelupdater
+from kernelupdater.cli import get_recorded_config, select_prebuilt_kernel
+from kernelupdater.journal import Journal
+from kernelupdater.watch import SourceWatcher
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class EselectInterceptor(kernelupdater.CommandRunner):
+    def __init__(self, kernel_root_dir):
+        self.kernel_root_dir = kernel_root_dir
+        self.commands = []
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(command_array)
+        os.remove(self.kernel_root_dir + "/linux")
+        os.symlink(self.kernel_root_dir + "/" + command_array[-1], self.kernel_root_dir + "/linux")
+
+
+class SelectPrebuiltKernelTest(unittest.TestCase):
+    def setUp(self):
+        self.kernel_root_dir = mkdtemp()
+        self.journal = Journal(mkdtemp() + "/journal.json")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.8-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.8-gentoo", self.kernel_root_dir + "/linux")
+        self.source_watcher = SourceWatcher(self.kernel_root_dir, state_file=mkdtemp() + "/watch.json")
+        for release, config_name in [("4.14.10-gentoo", "older.config"), ("4.14.12-gentoo", "newer.config")]:
+            os.mkdir(self.kernel_root_dir + "/linux-" + release)
+            write(self.kernel_root_dir + "/" + config_name, "CONFIG_64BIT=y\n")
+            self.source_watcher.record_prebuilt(release, self.kernel_root_dir + "/" + config_name)
+
+    def test_confirming_the_older_prebuilt_kernel_reuses_its_config(self):
+        command_runner = EselectInterceptor(self.kernel_root_dir)
+
+        select_prebuilt_kernel("4.14.10-gentoo", self.journal, self.source_watcher, command_runner)
+
+        self.assertEqual([["eselect", "kernel", "set", "linux-4.14.10-gentoo"]], command_runner.commands)
+        self.assertEqual(self.kernel_root_dir + "/older.config",
+                         get_recorded_config(self.journal, kernelupdater.SelectedKernel(self.kernel_root_dir)))
+        self.assertEqual(["4.14.12-gentoo"], self.source_watcher.get_prebuilt_releases())
+
+    def test_confirming_selects_the_newest_prebuilt_kernel_by_default(self):
+        select_prebuilt_kernel("", self.journal, self.source_watcher, EselectInterceptor(self.kernel_root_dir))
+
+        self.assertEqual(self.kernel_root_dir + "/newer.config",
+                         get_recorded_config(self.journal, kernelupdater.SelectedKernel(self.kernel_root_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
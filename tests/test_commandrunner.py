@@ -0,0 +1,56 @@
+import gc
+import threading
+import unittest
+import warnings
+import kernelupdater
+
+
+class CommandRunnerTest(unittest.TestCase):
+    def test_output_is_captured_and_timed(self):
+        command_runner = kernelupdater.CommandRunner(output_tail_lines=2)
+
+        result = command_runner.run_command(["sh", "-c", "echo one; echo two >&2; echo three"])
+
+        self.assertEqual(0, result.return_code)
+        self.assertEqual(2, len(result.output_tail))
+        self.assertIn("three", result.output_tail)
+        self.assertGreaterEqual(result.wall_time, 0)
+        self.assertEqual([result], command_runner.results)
+
+    def test_failure_raises_with_exit_code(self):
+        command_runner = kernelupdater.CommandRunner()
+
+        with self.assertRaises(kernelupdater.CommandFailedError) as context:
+            command_runner.run_command(["sh", "-c", "echo broken >&2; exit 3"])
+
+        self.assertEqual(3, context.exception.result.return_code)
+        self.assertEqual(["broken"], context.exception.result.output_tail)
+
+    def test_child_is_known_to_be_reaped(self):
+        command_runner = kernelupdater.CommandRunner()
+
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter("always", ResourceWarning)
+            command_runner.run_command(["true"])
+            gc.collect()
+
+        self.assertEqual([], [str(warning.message) for warning in caught_warnings
+                              if issubclass(warning.category, ResourceWarning)])
+
+    def test_several_commands_at_once(self):
+        command_runner = kernelupdater.CommandRunner()
+        results = {}
+        threads = [threading.Thread(target=lambda name=name: results.update(
+            {name: command_runner.run_command(["sh", "-c", "sleep 0.1; echo " + name])})) for name in ["a", "b"]]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(["a"], results["a"].output_tail)
+        self.assertEqual(["b"], results["b"].output_tail)
+        self.assertEqual(2, len(command_runner.results))
+
+if __name__ == '__main__':
+    unittest.main()
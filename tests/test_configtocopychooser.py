@@ -33,6 +33,36 @@ class ConfigToCopyChooserTest(unittest.TestCase):
 
         self.assertEqual(self.temp_root_dir + "/linux-4.12.3-gentoo/.config", chosen)
 
+    def test_config_in_version_order(self):
+        os.mkdir(self.temp_root_dir + "/linux-4.9.1-gentoo")
+        touch(self.temp_root_dir + "/linux-4.9.1-gentoo/.config")
+        os.mkdir(self.temp_root_dir + "/linux-4.12.10-gentoo")
+        touch(self.temp_root_dir + "/linux-4.12.10-gentoo/.config")
+        config_to_copy_chooser = ConfigToCopyChooserMock(choice=0, selected_kernel=self.selected_kernel, kernel_root_dir=self.temp_root_dir)
+
+        chosen = config_to_copy_chooser.choose_config_file()
+
+        self.assertEqual(self.temp_root_dir + "/linux-4.12.10-gentoo/.config", chosen)
+
+    def test_automatic_choice_does_not_ask(self):
+        config_to_copy_chooser = kernelupdater.ConfigToCopyChooser(selected_kernel=self.selected_kernel,
+                                                                   kernel_root_dir=self.temp_root_dir, automatic=True)
+        config_to_copy_chooser.do_input = None
+
+        chosen = config_to_copy_chooser.choose_config_file()
+
+        self.assertEqual(self.temp_root_dir + "/linux-4.12.3-gentoo/.config", chosen)
+
+    def test_only_the_kernel_source_trees_of_the_inventory_are_offered(self):
+        os.mkdir(self.temp_root_dir + "/linux-firmware")
+        touch(self.temp_root_dir + "/linux-firmware/.config")
+        config_to_copy_chooser = kernelupdater.ConfigToCopyChooser(selected_kernel=self.selected_kernel,
+                                                                   kernel_root_dir=self.temp_root_dir)
+
+        self.assertEqual(sorted(self.temp_root_dir + "/" + name + "/.config"
+                                for name in ["linux-4.11.8-gentoo", "linux-4.12.2-gentoo", "linux-4.12.3-gentoo"]),
+                         sorted(config_to_copy_chooser.find_config_files()))
+
 
 class ConfigToCopyChooserMock(kernelupdater.ConfigToCopyChooser):
     def __init__(self, choice, selected_kernel, kernel_root_dir):
@@ -0,0 +1,65 @@
+import os
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.deletion import TreeDeleter, TRASH_DIR_NAME
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class TreeDeleterTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.tree_dir = self.root_dir + "/linux-4.11.8-gentoo"
+        for index in range(5):
+            os.makedirs(self.tree_dir + "/drivers/net/" + str(index))
+            write(self.tree_dir + "/drivers/net/" + str(index) + "/driver.o", "x" * 100)
+        write(self.tree_dir + "/Makefile", "x" * 10)
+        os.symlink("Makefile", self.tree_dir + "/Makefile.link")
+
+    def test_retire_then_purge(self):
+        tree_deleter = TreeDeleter(workers=3)
+
+        trash_path = tree_deleter.retire(self.tree_dir)
+
+        self.assertFalse(os.path.exists(self.tree_dir))
+        self.assertTrue(os.path.isdir(trash_path))
+
+        report = tree_deleter.purge()
+
+        self.assertEqual([], os.listdir(self.root_dir))
+        self.assertEqual(7, report.files)
+        self.assertEqual(5 * 100 + 10 + len("Makefile"), report.bytes)
+        self.assertEqual(1 + 1 + 1 + 1 + 5, report.directories)
+        self.assertEqual([], report.errors)
+
+    def test_missing_tree_is_ignored(self):
+        tree_deleter = TreeDeleter()
+
+        self.assertIsNone(tree_deleter.retire(self.root_dir + "/linux-4.1.1-gentoo"))
+        self.assertEqual(0, tree_deleter.purge().files)
+
+    def test_leftovers_of_interrupted_runs_are_purged(self):
+        os.makedirs(self.root_dir + "/" + TRASH_DIR_NAME + "/linux-4.9.1-gentoo.1234")
+        tree_deleter = TreeDeleter()
+
+        tree_deleter.retire(self.tree_dir)
+        tree_deleter.purge()
+
+        self.assertEqual([], os.listdir(self.root_dir))
+
+    def test_leftovers_are_purged_without_retiring(self):
+        os.makedirs(self.root_dir + "/" + TRASH_DIR_NAME + "/linux-4.9.1-gentoo.1234")
+        tree_deleter = TreeDeleter()
+
+        tree_deleter.add_leftovers([self.root_dir, self.root_dir + "/none"])
+        report = tree_deleter.purge()
+
+        self.assertEqual(["linux-4.11.8-gentoo"], os.listdir(self.root_dir))
+        self.assertEqual(2, report.directories)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import io
+import os
+import json
+import tarfile
+import threading
+import unittest
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from tempfile import mkdtemp
+import kernelupdater
+from kernelupdater.fleet import BundlePublisher, BundleInstaller, DirectoryTransport, HttpTransport, \
+    get_bundle_name, get_manifest_name
+from kernelupdater.journal import get_file_hash
+from kernelupdater.modules import ModuleRebuilder
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+def read(fname):
+    with open(fname) as a_file:
+        return a_file.read()
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class CommandRecorder(kernelupdater.CommandRunner):
+    def __init__(self):
+        self.commands = []
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(" ".join(command_array))
+
+
+class FleetTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.published_dir = self.root_dir + "/published"
+        self.source_dir = self.root_dir + "/usr/src/linux-4.14.10-gentoo"
+        self.boot_dir = self.root_dir + "/boot"
+        self.modules_root_dir = self.root_dir + "/lib/modules"
+        os.makedirs(self.source_dir)
+        os.makedirs(self.boot_dir)
+        os.makedirs(self.modules_root_dir)
+
+    def publish(self):
+        publisher = BundlePublisher(DirectoryTransport(self.published_dir), staging_root_dir=self.root_dir + "/staging",
+                                    compression="gzip")
+        staging_dir = publisher.create_staging_dir("4.14.10-gentoo")
+        write(staging_dir + "/boot/vmlinuz-4.14.10-gentoo", "kernel")
+        os.makedirs(staging_dir + "/lib/modules/4.14.10-gentoo/kernel/drivers")
+        write(staging_dir + "/lib/modules/4.14.10-gentoo/kernel/drivers/e1000e.ko", "module")
+        os.symlink("/usr/src/linux-4.14.10-gentoo", staging_dir + "/lib/modules/4.14.10-gentoo/build")
+        write(self.root_dir + "/built.config", "CONFIG_64BIT=y\n")
+        write(self.root_dir + "/Module.symvers", "symbols")
+        publisher.publish("4.14.10-gentoo", staging_dir, {"config": self.root_dir + "/built.config",
+                                                          "Module.symvers": self.root_dir + "/Module.symvers"})
+
+    def assert_installed(self):
+        self.assertEqual("kernel", read(self.boot_dir + "/vmlinuz-4.14.10-gentoo"))
+        self.assertEqual("module", read(self.modules_root_dir + "/4.14.10-gentoo/kernel/drivers/e1000e.ko"))
+        for name in ["build", "source"]:
+            self.assertEqual(self.source_dir, os.readlink(self.modules_root_dir + "/4.14.10-gentoo/" + name))
+        self.assertEqual("CONFIG_64BIT=y\n", read(self.source_dir + "/.config"))
+        self.assertEqual("symbols", read(self.source_dir + "/Module.symvers"))
+
+    def test_publish_then_install_from_directory(self):
+        self.publish()
+
+        installer = BundleInstaller(DirectoryTransport(self.published_dir), download_dir=self.root_dir + "/download")
+        installer.install("4.14.10-gentoo", self.boot_dir, self.modules_root_dir, self.source_dir)
+
+        self.assert_installed()
+        self.assertFalse(os.path.exists(self.root_dir + "/staging/4.14.10-gentoo"))
+
+    def test_publish_then_install_over_http(self):
+        self.publish()
+        server = HTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=self.published_dir))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            installer = BundleInstaller(HttpTransport("http://127.0.0.1:" + str(server.server_port)),
+                                        download_dir=self.root_dir + "/download")
+            installer.install("4.14.10-gentoo", self.boot_dir, self.modules_root_dir, self.source_dir)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assert_installed()
+
+    def test_tampered_bundle_is_refused(self):
+        self.publish()
+        with open(self.published_dir + "/" + get_bundle_name("4.14.10-gentoo", "gzip"), "ab") as a_file:
+            a_file.write(b"garbage")
+
+        installer = BundleInstaller(DirectoryTransport(self.published_dir), download_dir=self.root_dir + "/download")
+        with self.assertRaises(ValueError):
+            installer.install("4.14.10-gentoo", self.boot_dir, self.modules_root_dir, self.source_dir)
+        self.assertEqual([], os.listdir(self.boot_dir))
+
+    def test_member_out_of_destination_is_refused(self):
+        os.makedirs(self.published_dir)
+        bundle_file = self.published_dir + "/" + get_bundle_name("4.14.10-gentoo", "gzip")
+        with tarfile.open(bundle_file, "w:gz") as tar:
+            tar_info = tarfile.TarInfo("boot/../../etc/passwd")
+            tar_info.size = 4
+            tar.addfile(tar_info, io.BytesIO(b"root"))
+        write(self.published_dir + "/" + get_manifest_name("4.14.10-gentoo"),
+              json.dumps({"release": "4.14.10-gentoo", "compression": "gzip", "bundle_sha256": get_file_hash(bundle_file),
+                          "files": {"boot/../../etc/passwd": "x"}}))
+
+        installer = BundleInstaller(DirectoryTransport(self.published_dir), download_dir=self.root_dir + "/download")
+        with self.assertRaises(ValueError):
+            installer.install("4.14.10-gentoo", self.boot_dir, self.modules_root_dir, self.source_dir)
+
+    def create_deploying_kernel_updater(self, command_recorder):
+        kernel_root_dir = self.root_dir + "/usr/src"
+        if not os.path.islink(kernel_root_dir + "/linux"):
+            os.symlink(self.source_dir, kernel_root_dir + "/linux")
+        return kernelupdater.KernelUpdater(
+            config_file=None, a_selected_kernel=kernelupdater.SelectedKernel(kernel_root_dir=kernel_root_dir),
+            a_command_runner=command_recorder, kernel_root_dir=kernel_root_dir,
+            modules_root_dir=self.modules_root_dir, grub_root_dir=self.boot_dir,
+            bundle_installer=BundleInstaller(DirectoryTransport(self.published_dir),
+                                             download_dir=self.root_dir + "/download"),
+            module_rebuilder=ModuleRebuilder(vdb_dir=self.root_dir + "/var/db/pkg",
+                                             emerge_log_file=self.root_dir + "/emerge.log"))
+
+    def test_deploy_plan_fetches_nothing(self):
+        self.publish()
+
+        plan = self.create_deploying_kernel_updater(CommandRecorder()).create_plan()
+
+        self.assertIsNone([step.skip_reason for step in plan.steps if step.name == "install_bundle"][0])
+        self.assertFalse(os.path.exists(self.root_dir + "/download"))
+
+    def test_deploy_pipeline_does_not_build(self):
+        self.publish()
+        command_recorder = CommandRecorder()
+        kernel_updater = self.create_deploying_kernel_updater(command_recorder)
+
+        kernel_updater.update_kernel(serial=True)
+
+        self.assert_installed()
+        self.assertTrue(os.path.exists(self.boot_dir + "/vmlinuz-4.14.10-gentoo.old"))
+        self.assertEqual(["make -C " + self.source_dir + " modules_prepare",
+                          "emerge -1q @x11-module-rebuild @module-rebuild", "genkernel initramfs",
+                          "grub-mkconfig -o " + self.boot_dir + "/grub/grub.cfg"], command_recorder.commands)
@@ -0,0 +1,187 @@
+import os
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from kernelupdater import CommandRunner, CommandFailedError, CommandResult
+from kernelupdater.grub import EntriesBackend
+
+
+GRUB_CONFIG = """### BEGIN /etc/grub.d/00_header ###
+set default="0"
+### END /etc/grub.d/00_header ###
+
+### BEGIN /etc/grub.d/10_linux ###
+menuentry 'Gentoo GNU/Linux' --class gentoo $menuentry_id_option 'gnulinux-simple-1234' {
+	echo	'Loading Linux 4.14.10-gentoo ...'
+	linux	/vmlinuz-4.14.10-gentoo root=/dev/sda2 ro
+	initrd	/initramfs-4.14.10-gentoo.img
+}
+submenu 'Advanced options for Gentoo GNU/Linux' $menuentry_id_option 'gnulinux-advanced-1234' {
+	menuentry 'Gentoo GNU/Linux, with Linux 4.14.10-gentoo' $menuentry_id_option 'gnulinux-4.14.10-gentoo-advanced-1234' {
+		linux	/vmlinuz-4.14.10-gentoo root=/dev/sda2 ro
+		initrd	/initramfs-4.14.10-gentoo.img
+	}
+	menuentry 'Gentoo GNU/Linux, with Linux 4.14.10-gentoo (recovery mode)' $menuentry_id_option 'gnulinux-4.14.10-gentoo-recovery-1234' {
+		linux	/vmlinuz-4.14.10-gentoo root=/dev/sda2 ro single
+		initrd	/initramfs-4.14.10-gentoo.img
+	}
+	menuentry 'Gentoo GNU/Linux, with Linux 4.14.1-gentoo' $menuentry_id_option 'gnulinux-4.14.1-gentoo-advanced-1234' {
+		linux	/vmlinuz-4.14.1-gentoo root=/dev/sda2 ro
+		initrd	/initramfs-4.14.1-gentoo.img
+	}
+	menuentry 'Gentoo GNU/Linux, with Linux 4.14.1-gentoo (recovery mode)' $menuentry_id_option 'gnulinux-4.14.1-gentoo-recovery-1234' {
+		linux	/vmlinuz-4.14.1-gentoo root=/dev/sda2 ro single
+		initrd	/initramfs-4.14.1-gentoo.img
+	}
+}
+### END /etc/grub.d/10_linux ###
+
+### BEGIN /etc/grub.d/30_os-prober ###
+menuentry 'Windows' {
+	chainloader +1
+}
+### END /etc/grub.d/30_os-prober ###
+"""
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+def read(fname):
+    with open(fname) as a_file:
+        return a_file.read()
+
+
+class CommandRecorder(CommandRunner):
+    def __init__(self, failing_command=None):
+        self.commands = []
+        self.failing_command = failing_command
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(command_array)
+        if command_array[0] == self.failing_command:
+            raise CommandFailedError(CommandResult(command_array, comment, 1, 0, 0, 0, 0, 0, []))
+
+
+class EntriesBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.boot_dir = self.root_dir + "/boot"
+        self.grub_settings_file = self.root_dir + "/default-grub"
+        os.makedirs(self.boot_dir + "/grub")
+        write(self.grub_settings_file, 'GRUB_CMDLINE_LINUX="quiet"\n')
+        write(self.boot_dir + "/grub/grub.cfg", GRUB_CONFIG)
+        for name in ["vmlinuz-4.14.10-gentoo", "initramfs-4.14.10-gentoo.img", "vmlinuz-4.14.12-gentoo",
+                     "initramfs-4.14.12-gentoo.img", "vmlinuz-4.15.1-gentoo"]:
+            write(self.boot_dir + "/" + name, "")
+        self.grub_backend = EntriesBackend(fingerprint_file=self.root_dir + "/state/grub-config.sha256",
+                                           grub_config_files=[self.grub_settings_file])
+        self.grub_backend.save_fingerprint()
+
+    def test_rewrites_the_linux_entries_of_installed_kernels(self):
+        command_runner = CommandRecorder()
+
+        self.grub_backend.update(command_runner, self.boot_dir)
+
+        self.assertEqual([["grub-script-check", self.boot_dir + "/grub/grub.cfg.tmp"]], command_runner.commands)
+        grub_config = read(self.boot_dir + "/grub/grub.cfg")
+        self.assertFalse(os.path.exists(self.boot_dir + "/grub/grub.cfg.tmp"))
+        # the default entry boots the newest kernel, which has no initramfs
+        self.assertIn("linux\t/vmlinuz-4.15.1-gentoo root=/dev/sda2 ro\n}", grub_config)
+        self.assertNotIn("4.14.1-gentoo", grub_config)
+        self.assertNotIn("/initramfs-4.15.1-gentoo.img", grub_config)
+        for release in ["4.15.1-gentoo", "4.14.12-gentoo", "4.14.10-gentoo"]:
+            self.assertIn("'Gentoo GNU/Linux, with Linux " + release + " (recovery mode)'", grub_config)
+        self.assertIn("initrd\t/initramfs-4.14.12-gentoo.img", grub_config)
+        self.assertLess(grub_config.index("with Linux 4.15.1-gentoo'"), grub_config.index("with Linux 4.14.12-gentoo'"))
+        self.assertTrue(grub_config.startswith(GRUB_CONFIG[0:GRUB_CONFIG.index("### BEGIN /etc/grub.d/10_linux")]))
+        self.assertTrue(grub_config.endswith(GRUB_CONFIG[GRUB_CONFIG.index("### END /etc/grub.d/10_linux"):]))
+
+    def test_keeps_the_entries_of_old_kernels(self):
+        first_entry_of_4_14_1 = "\tmenuentry 'Gentoo GNU/Linux, with Linux 4.14.1-gentoo'"
+        old_entries = "".join("\tmenuentry 'Gentoo GNU/Linux, with Linux 4.14.10-gentoo.old" + title_suffix + "' {\n"
+                              "\t\tlinux\t/vmlinuz-4.14.10-gentoo.old root=/dev/sda2 ro" + option + "\n"
+                              "\t\tinitrd\t/initramfs-4.14.10-gentoo.img\n"
+                              "\t}\n" for title_suffix, option in [("", ""), (" (recovery mode)", " single")])
+        write(self.boot_dir + "/grub/grub.cfg",
+              GRUB_CONFIG.replace(first_entry_of_4_14_1, old_entries + first_entry_of_4_14_1, 1))
+        write(self.boot_dir + "/vmlinuz-4.14.10-gentoo.old", "")
+        write(self.boot_dir + "/vmlinuz-4.14.12-gentoo.old", "")
+
+        self.grub_backend.update(CommandRecorder(), self.boot_dir)
+
+        grub_config = read(self.boot_dir + "/grub/grub.cfg")
+        for release in ["4.14.12-gentoo", "4.14.10-gentoo"]:
+            # booting the initramfs of the release, there is no .old one
+            self.assertIn("'Gentoo GNU/Linux, with Linux " + release + ".old (recovery mode)'", grub_config)
+            self.assertIn("linux\t/vmlinuz-" + release + ".old root=/dev/sda2 ro single\n"
+                          "\t\tinitrd\t/initramfs-" + release + ".img\n", grub_config)
+        self.assertLess(grub_config.index("with Linux 4.14.12-gentoo'"),
+                        grub_config.index("with Linux 4.14.12-gentoo.old'"))
+        self.assertLess(grub_config.index("with Linux 4.14.12-gentoo.old'"),
+                        grub_config.index("with Linux 4.14.10-gentoo'"))
+
+    def test_adds_the_initrd_line_the_template_entry_lacks(self):
+        write(self.boot_dir + "/grub/grub.cfg", "".join(line for line in GRUB_CONFIG.splitlines(True)
+                                                         if "initrd" not in line))
+
+        self.grub_backend.update(CommandRecorder(), self.boot_dir)
+
+        grub_config = read(self.boot_dir + "/grub/grub.cfg")
+        self.assertIn("linux\t/vmlinuz-4.14.12-gentoo root=/dev/sda2 ro single\n"
+                      "\t\tinitrd\t/initramfs-4.14.12-gentoo.img\n\t}", grub_config)
+        self.assertIn("linux\t/vmlinuz-4.15.1-gentoo root=/dev/sda2 ro\n}", grub_config)
+        self.assertNotIn("initramfs-4.15.1-gentoo", grub_config)
+
+    def test_runs_mkconfig_when_the_grub_settings_changed(self):
+        write(self.grub_settings_file, 'GRUB_CMDLINE_LINUX="quiet splash"\n')
+        command_runner = CommandRecorder()
+
+        self.grub_backend.update(command_runner, self.boot_dir)
+        self.grub_backend.update(command_runner, self.boot_dir)
+
+        self.assertEqual([["grub-mkconfig", "-o", self.boot_dir + "/grub/grub.cfg"],
+                          ["grub-script-check", self.boot_dir + "/grub/grub.cfg.tmp"]], command_runner.commands)
+
+    def test_keeps_the_config_when_the_check_fails(self):
+        with self.assertRaises(CommandFailedError):
+            self.grub_backend.update(CommandRecorder(failing_command="grub-script-check"), self.boot_dir)
+
+        self.assertEqual(GRUB_CONFIG, read(self.boot_dir + "/grub/grub.cfg"))
+        self.assertFalse(os.path.exists(self.boot_dir + "/grub/grub.cfg.tmp"))
+
+    @mock.patch("kernelupdater.grub.get_machine_id", return_value="1234")
+    def test_updates_boot_loader_entries(self, get_machine_id):
+        entries_dir = self.boot_dir + "/loader/entries"
+        os.makedirs(entries_dir)
+        write(entries_dir + "/1234-4.14.10-gentoo.conf", "title Gentoo 4.14.10-gentoo\nversion 4.14.10-gentoo\n"
+                                                         "linux /vmlinuz-4.14.10-gentoo\n"
+                                                         "initrd /initramfs-4.14.10-gentoo.img\noptions ro\n")
+        write(entries_dir + "/1234-4.14.1-gentoo.conf", "title Gentoo 4.14.1-gentoo\nversion 4.14.1-gentoo\n")
+
+        self.grub_backend.update(CommandRecorder(), self.boot_dir)
+
+        self.assertEqual(["1234-4.14.10-gentoo.conf", "1234-4.14.12-gentoo.conf", "1234-4.15.1-gentoo.conf"],
+                         sorted(os.listdir(entries_dir)))
+        self.assertEqual("title Gentoo 4.15.1-gentoo\nversion 4.15.1-gentoo\nlinux /vmlinuz-4.15.1-gentoo\n"
+                         "options ro\n", read(entries_dir + "/1234-4.15.1-gentoo.conf"))
+        self.assertIn("initrd /initramfs-4.14.12-gentoo.img\n", read(entries_dir + "/1234-4.14.12-gentoo.conf"))
+
+    @mock.patch("kernelupdater.grub.get_machine_id", return_value="1234")
+    def test_keeps_the_boot_loader_entries_of_others_and_of_old_kernels(self, get_machine_id):
+        entries_dir = self.boot_dir + "/loader/entries"
+        os.makedirs(entries_dir)
+        write(self.boot_dir + "/vmlinuz-4.14.8-gentoo.old", "")
+        entries = {"1234-4.14.8-gentoo.conf": "title Gentoo 4.14.8-gentoo\nversion 4.14.8-gentoo\n",
+                   "arch-5.10.1-arch1.conf": "title Arch Linux\nversion 5.10.1-arch1\n",
+                   "5678-4.14.1-gentoo.conf": "title Gentoo 4.14.1-gentoo\nversion 4.14.1-gentoo\n"}
+        for name, content in entries.items():
+            write(entries_dir + "/" + name, content)
+
+        self.grub_backend.update(CommandRecorder(), self.boot_dir)
+
+        for name, content in entries.items():
+            self.assertEqual(content, read(entries_dir + "/" + name))
+        self.assertNotIn("Arch", read(entries_dir + "/1234-4.15.1-gentoo.conf"))
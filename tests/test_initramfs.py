@@ -0,0 +1,100 @@
+import os
+import gzip
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.initramfs import BuiltinInitramfs, GenkernelInitramfs, DracutInitramfs
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+def read_cpio_names(data):
+    """
+    Names of the entries of the concatenated newc cpio archives in data.
+    """
+    names = []
+    offset = 0
+    while offset < len(data):
+        header = data[offset:offset + 110]
+        if not header.startswith(b"070701"):
+            # padding between archives
+            offset += 1
+            continue
+        name_size = int(header[94:102], 16)
+        file_size = int(header[54:62], 16)
+        name = data[offset + 110:offset + 110 + name_size - 1].decode()
+        names.append(name)
+        offset += (110 + name_size + 3) // 4 * 4
+        offset += (file_size + 3) // 4 * 4
+    return names
+
+
+class CommandRecorder(object):
+    def __init__(self):
+        self.commands = []
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(command_array)
+
+
+class BuiltinInitramfsTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.base_dir = self.root_dir + "/base"
+        self.cache_dir = self.root_dir + "/cache"
+        self.modules_root_dir = self.root_dir + "/modules"
+        self.boot_dir = self.root_dir + "/boot"
+        os.makedirs(self.base_dir + "/bin")
+        write(self.base_dir + "/init", "#!/bin/busybox sh\n")
+        write(self.base_dir + "/bin/busybox", "x" * 1001)
+        os.symlink("busybox", self.base_dir + "/bin/sh")
+        os.makedirs(self.modules_root_dir + "/4.12.4-gentoo/kernel/drivers")
+        write(self.modules_root_dir + "/4.12.4-gentoo/kernel/drivers/e1000e.ko", "y" * 333)
+        write(self.modules_root_dir + "/4.12.4-gentoo/modules.dep", "")
+        os.makedirs(self.boot_dir)
+
+    def test_modules_layer_is_appended_to_cached_base(self):
+        initramfs = BuiltinInitramfs(self.base_dir, cache_dir=self.cache_dir, compression="gzip")
+
+        initramfs.generate(CommandRecorder(), "4.12.4-gentoo", self.modules_root_dir, self.boot_dir)
+
+        self.assertEqual(["initramfs-4.12.4-gentoo.img"], os.listdir(self.boot_dir))
+        with open(self.boot_dir + "/initramfs-4.12.4-gentoo.img", "rb") as a_file:
+            names = read_cpio_names(gzip.decompress(a_file.read()))
+        self.assertEqual(["init", "bin", "bin/busybox", "bin/sh", "TRAILER!!!",
+                          "lib", "lib/modules", "lib/modules/4.12.4-gentoo", "lib/modules/4.12.4-gentoo/modules.dep",
+                          "lib/modules/4.12.4-gentoo/kernel", "lib/modules/4.12.4-gentoo/kernel/drivers",
+                          "lib/modules/4.12.4-gentoo/kernel/drivers/e1000e.ko", "TRAILER!!!"], names)
+
+    def test_base_layer_is_rebuilt_only_when_base_changes(self):
+        initramfs = BuiltinInitramfs(self.base_dir, cache_dir=self.cache_dir, compression="gzip")
+
+        first_base_layer = initramfs.get_base_layer()
+        os.utime(first_base_layer, (0, 0))
+        self.assertEqual(first_base_layer, initramfs.get_base_layer())
+        self.assertEqual(0, os.stat(first_base_layer).st_mtime)
+
+        write(self.base_dir + "/init", "#!/bin/busybox sh\nexec switch_root /newroot /sbin/init\n")
+
+        self.assertNotEqual(first_base_layer, initramfs.get_base_layer())
+
+
+class CommandBackendsTest(unittest.TestCase):
+    def test_genkernel_command(self):
+        command_recorder = CommandRecorder()
+
+        GenkernelInitramfs().generate(command_recorder, "4.12.4-gentoo", "/lib/modules", "/boot")
+        GenkernelInitramfs(compression="zstd").generate(command_recorder, "4.12.4-gentoo", "/lib/modules", "/boot")
+
+        self.assertEqual([["genkernel", "initramfs"], ["genkernel", "initramfs", "--compress-initramfs-type=zstd"]],
+                         command_recorder.commands)
+
+    def test_dracut_command(self):
+        command_recorder = CommandRecorder()
+
+        DracutInitramfs(compression="xz").generate(command_recorder, "4.12.4-gentoo", "/lib/modules", "/boot")
+
+        self.assertEqual([["dracut", "--force", "--kver", "4.12.4-gentoo", "--xz", "/boot/initramfs-4.12.4-gentoo.img"]],
+                         command_recorder.commands)
@@ -0,0 +1,65 @@
+import os
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from kernelupdater.jobs import JobsPlanner
+
+
+def write(fname, content):
+    if not os.path.exists(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class JobsPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.proc_root_dir = mkdtemp()
+        self.cgroup_root_dir = mkdtemp()
+        write(self.proc_root_dir + "/self/cgroup", "0::/builders/kernel\n")
+        write(self.proc_root_dir + "/meminfo", "MemTotal:       65536000 kB\nMemAvailable:   32768000 kB\n")
+        write(self.proc_root_dir + "/loadavg", "0.00 0.10 0.20 1/100 1234\n")
+        affinity_patcher = mock.patch("os.sched_getaffinity", return_value=set(range(16)))
+        affinity_patcher.start()
+        self.addCleanup(affinity_patcher.stop)
+        self.planner = JobsPlanner(memory_per_job_mb=500, proc_root_dir=self.proc_root_dir,
+                                   cgroup_root_dir=self.cgroup_root_dir)
+
+    def test_cgroup_quota_limits_cpus(self):
+        write(self.cgroup_root_dir + "/builders/cpu.max", "200000 100000\n")
+        write(self.cgroup_root_dir + "/builders/kernel/cpu.max", "max 100000\n")
+
+        plan = self.planner.plan()
+
+        self.assertEqual(2, self.planner.get_cgroup_cpus())
+        self.assertEqual(3, plan.jobs)
+        self.assertEqual("cpus", plan.limit)
+        self.assertEqual(["-j3", "-l2"], plan.make_options())
+
+    def test_memory_limits_jobs(self):
+        write(self.proc_root_dir + "/meminfo", "MemAvailable:    1024000 kB\n")
+
+        plan = self.planner.plan()
+
+        self.assertEqual(2, plan.jobs)
+        self.assertEqual("memory", plan.limit)
+
+    def test_load_limits_jobs(self):
+        write(self.cgroup_root_dir + "/builders/cpu.max", "800000 100000\n")
+        write(self.proc_root_dir + "/loadavg", "6.50 6.00 5.00 1/100 1234\n")
+
+        plan = self.planner.plan()
+
+        self.assertEqual("load", plan.limit)
+        self.assertEqual(2, plan.jobs)
+        self.assertEqual(["-j2", "-l8"], plan.make_options())
+
+    def test_command_line_overrides(self):
+        plan = self.planner.plan(jobs=7, load_average=3.5)
+
+        self.assertEqual(["-j7", "-l3.5"], plan.make_options())
+        self.assertEqual("command line", plan.limit)
+
+
+if __name__ == '__main__':
+    unittest.main()
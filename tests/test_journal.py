@@ -0,0 +1,58 @@
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.journal import Journal
+from kernelupdater.scheduler import StepScheduler
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.journal_file = mkdtemp() + "/state/journal.json"
+        self.inputs = {"kernel": "4.14.10-gentoo", "config_sha256": "abc"}
+        self.calls = []
+
+    def record(self, name):
+        return lambda: self.calls.append(name)
+
+    def create_scheduler(self, inputs, build=None):
+        scheduler = StepScheduler(journal=Journal(self.journal_file), journal_inputs=inputs)
+        scheduler.add_step("copy_config_file", self.record("copy_config_file"))
+        scheduler.add_step("build_kernel", build or self.record("build_kernel"), ["copy_config_file"])
+        scheduler.add_step("install_kernel", self.record("install_kernel"), ["build_kernel"])
+        return scheduler
+
+    def test_resume_skips_completed_steps(self):
+        def fail():
+            raise RuntimeError("out of memory")
+        self.assertRaises(RuntimeError, self.create_scheduler(self.inputs, build=fail).run)
+
+        self.create_scheduler(self.inputs).run(resume=True)
+
+        self.assertEqual(["copy_config_file", "build_kernel", "install_kernel"], self.calls)
+
+    def test_steps_after_a_rerun_step_are_rerun(self):
+        self.create_scheduler(self.inputs).run(serial=True)
+        journal = Journal(self.journal_file)
+        journal.content["steps"].pop("build_kernel")
+        journal.save()
+
+        self.create_scheduler(self.inputs).run(resume=True)
+
+        self.assertEqual(["copy_config_file", "build_kernel", "install_kernel", "build_kernel", "install_kernel"],
+                         self.calls)
+
+    def test_changed_inputs_invalidate_steps(self):
+        self.create_scheduler(self.inputs).run()
+
+        self.create_scheduler({"kernel": "4.14.10-gentoo", "config_sha256": "def"}).run(resume=True)
+
+        self.assertEqual(6, len(self.calls))
+
+    def test_steps_are_not_skipped_without_resume(self):
+        self.create_scheduler(self.inputs).run()
+        self.create_scheduler(self.inputs).run()
+
+        self.assertEqual(6, len(self.calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import gzip
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.kconfig import ConfigRanker, read_config, get_kconfig_symbols
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class KconfigTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.source_dir = self.root_dir + "/linux-4.14.10-gentoo"
+        os.makedirs(self.source_dir + "/drivers/net")
+        write(self.source_dir + "/Kconfig", "config 64BIT\n\tbool\nmenuconfig NET\n\tbool \"Networking\"\n")
+        write(self.source_dir + "/drivers/net/Kconfig", "config E1000E\n\ttristate \"Intel PRO/1000\"\n")
+        os.makedirs(self.source_dir + "/.git")
+        write(self.source_dir + "/.git/Kconfig", "config NOT_A_SYMBOL\n")
+
+    def write_config(self, release, content):
+        os.makedirs(self.root_dir + "/linux-" + release)
+        write(self.root_dir + "/linux-" + release + "/.config", content)
+        return self.root_dir + "/linux-" + release + "/.config"
+
+    def test_read_config(self):
+        config_file = self.write_config("4.9.1-gentoo", "# comment\nCONFIG_64BIT=y\nCONFIG_LOCALVERSION=\"\"\n"
+                                                        "# CONFIG_E1000E is not set\n")
+
+        self.assertEqual({"CONFIG_64BIT": "y", "CONFIG_LOCALVERSION": "\"\"", "CONFIG_E1000E": "n"},
+                         read_config(config_file))
+
+    def test_kconfig_symbols(self):
+        self.assertEqual(set(["CONFIG_64BIT", "CONFIG_NET", "CONFIG_E1000E"]), get_kconfig_symbols(self.source_dir))
+
+    def test_rank_prefers_config_of_running_kernel(self):
+        running_config_file = self.root_dir + "/config.gz"
+        with gzip.open(running_config_file, "wt") as a_file:
+            a_file.write("CONFIG_64BIT=y\nCONFIG_NET=y\nCONFIG_E1000E=m\n")
+        newest = self.write_config("4.14.8-gentoo", "CONFIG_64BIT=y\n# CONFIG_NET is not set\nCONFIG_OLD_SYMBOL=y\n")
+        running = self.write_config("4.9.1-gentoo", "CONFIG_64BIT=y\nCONFIG_NET=y\nCONFIG_E1000E=m\n")
+
+        config_scores = ConfigRanker(self.source_dir, running_config_file=running_config_file).rank([newest, running])
+
+        self.assertEqual([running, newest], [config_score.config_file for config_score in config_scores])
+        self.assertEqual(1.0, config_scores[0].similarity)
+        self.assertEqual(1.0, config_scores[0].coverage)
+        self.assertEqual(0.5, config_scores[1].coverage)
+
+    def test_rank_without_running_config_prefers_newest(self):
+        oldest = self.write_config("4.9.1-gentoo", "CONFIG_64BIT=y\n")
+        newest = self.write_config("4.14.8-gentoo", "CONFIG_64BIT=y\n")
+
+        config_scores = ConfigRanker(self.source_dir, running_config_file=None).rank([oldest, newest])
+
+        self.assertEqual([newest, oldest], [config_score.config_file for config_score in config_scores])
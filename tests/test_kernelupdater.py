@@ -1,6 +1,10 @@
 import unittest
 import kernelupdater
 import os
+from kernelupdater.buildcache import BuildCache
+from kernelupdater.journal import Journal, get_file_hash
+from kernelupdater.kconfig import ConfigDiffCache
+from kernelupdater.modules import ModuleRebuilder
 from tempfile import mkdtemp
 
 
@@ -20,6 +24,8 @@ class KernelUpdaterTest(unittest.TestCase):
         os.mkdir(self.kernel_root_dir)
         os.mkdir(self.modules_root_dir)
         os.mkdir(self.grub_root_dir)
+        self.module_rebuilder = ModuleRebuilder(vdb_dir=self.temp_root_dir + "/vdb",
+                                                emerge_log_file=self.temp_root_dir + "/emerge.log")
 
     def test_prev_v118_v122_v123_new_v124(self):
         os.mkdir(self.kernel_root_dir + "/linux-4.11.8-gentoo")
@@ -38,6 +44,8 @@ class KernelUpdaterTest(unittest.TestCase):
         touch(self.grub_root_dir + "/initramfs-genkernel-x86_64-4.11.8-gentoo")
         touch(self.grub_root_dir + "/System.map-4.11.8-gentoo.old")
         touch(self.grub_root_dir + "/vmlinuz-4.11.8-gentoo.old")
+        touch(self.grub_root_dir + "/kernel-genkernel-x86_64-4.11.8-gentoo")
+        touch(self.grub_root_dir + "/System.map-genkernel-x86_64-4.11.8-gentoo")
 
         self.command_runner = CommandInterceptor()
         self.selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
@@ -50,7 +58,8 @@ class KernelUpdaterTest(unittest.TestCase):
                                                      a_command_runner=self.command_runner,
                                                      kernel_root_dir=self.kernel_root_dir,
                                                      modules_root_dir=self.modules_root_dir,
-                                                     grub_root_dir=self.grub_root_dir)
+                                                     grub_root_dir=self.grub_root_dir,
+                                                     module_rebuilder=self.module_rebuilder)
         kernel_updater.update_kernel()
 
         for command in self.command_runner.commands:
@@ -110,7 +119,8 @@ class KernelUpdaterTest(unittest.TestCase):
                                                      a_command_runner=self.command_runner,
                                                      kernel_root_dir=self.kernel_root_dir,
                                                      modules_root_dir=self.modules_root_dir,
-                                                     grub_root_dir=self.grub_root_dir)
+                                                     grub_root_dir=self.grub_root_dir,
+                                                     module_rebuilder=self.module_rebuilder)
         kernel_updater.update_kernel()
 
         for command in self.command_runner.commands:
@@ -131,6 +141,202 @@ class KernelUpdaterTest(unittest.TestCase):
         self.assertNotIn("4.13.16", "".join(os.listdir(self.kernel_root_dir)))
         self.assertNotIn("4.13.16", "".join(os.listdir(self.modules_root_dir)))
 
+    def test_out_of_tree_build_keeps_series_build_dir(self):
+        build_root_dir = self.temp_root_dir + "/build"
+        os.mkdir(self.kernel_root_dir + "/linux-4.13.16-gentoo")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.8-gentoo-r1")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.10-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo",
+                   self.kernel_root_dir + "/linux")
+        os.makedirs(build_root_dir + "/4.12")
+        os.makedirs(build_root_dir + "/4.14")
+        config_file = build_root_dir + "/4.14/.config"
+        touch(config_file)
+
+        self.command_runner = CommandInterceptor()
+        self.selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
+
+        kernel_updater = kernelupdater.KernelUpdater(config_file=config_file,
+                                                     a_selected_kernel=self.selected_kernel,
+                                                     a_command_runner=self.command_runner,
+                                                     kernel_root_dir=self.kernel_root_dir,
+                                                     modules_root_dir=self.modules_root_dir,
+                                                     grub_root_dir=self.grub_root_dir,
+                                                     module_rebuilder=self.module_rebuilder,
+                                                     build_root_dir=build_root_dir)
+        kernel_updater.update_kernel()
+
+        make_commands = [command for command in self.command_runner.commands if command.startswith("make")]
+        # olddefconfig, build, install and modules_install
+        self.assertEqual(4, len(make_commands))
+        for command in make_commands:
+            self.assertIn("-C " + self.kernel_root_dir + "/linux O=" + build_root_dir + "/4.14", command)
+        self.assertEqual(["4.14"], os.listdir(build_root_dir))
+        self.assertTrue(os.path.exists(config_file))
+        self.assertNotIn("4.13.16", "".join(os.listdir(self.kernel_root_dir)))
+
+    def test_boot_files_of_other_releases_are_kept(self):
+        os.mkdir(self.kernel_root_dir + "/linux-4.1.1-gentoo")
+        os.mkdir(self.kernel_root_dir + "/linux-4.1.1-gentoo-r1")
+        os.mkdir(self.kernel_root_dir + "/linux-4.1.2-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.1.2-gentoo",
+                   self.kernel_root_dir + "/linux")
+        for release in ["4.1.1-gentoo", "4.1.1-gentoo-r1", "4.1.10-gentoo"]:
+            touch(self.grub_root_dir + "/vmlinuz-" + release)
+            touch(self.grub_root_dir + "/vmlinuz-" + release + ".old")
+            touch(self.grub_root_dir + "/initramfs-genkernel-x86_64-" + release)
+        os.mkdir(self.grub_root_dir + "/grub")
+
+        self.selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
+        kernel_updater = kernelupdater.KernelUpdater(config_file=None,
+                                                     a_selected_kernel=self.selected_kernel,
+                                                     a_command_runner=CommandInterceptor(),
+                                                     kernel_root_dir=self.kernel_root_dir,
+                                                     modules_root_dir=self.modules_root_dir,
+                                                     grub_root_dir=self.grub_root_dir,
+                                                     module_rebuilder=self.module_rebuilder)
+        kernel_updater.clean_old_kernels(kernel_updater.get_old_kernels_to_clean())
+
+        self.assertEqual(["grub",
+                          "initramfs-genkernel-x86_64-4.1.1-gentoo-r1", "initramfs-genkernel-x86_64-4.1.10-gentoo",
+                          "vmlinuz-4.1.1-gentoo-r1", "vmlinuz-4.1.1-gentoo-r1.old",
+                          "vmlinuz-4.1.10-gentoo", "vmlinuz-4.1.10-gentoo.old"],
+                         sorted(os.listdir(self.grub_root_dir)))
+
+    def test_rerun_on_up_to_date_host_skips_everything(self):
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.8-gentoo-r1")
+        config_file = self.kernel_root_dir + "/linux-4.14.8-gentoo-r1/.config"
+        with open(config_file, "w") as a_file:
+            a_file.write("CONFIG_64BIT=y\n")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.10-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo",
+                   self.kernel_root_dir + "/linux")
+        touch(self.grub_root_dir + "/vmlinuz-4.14.10-gentoo")
+        journal_file = self.temp_root_dir + "/journal.json"
+
+        commands_by_run = []
+        for _ in range(2):
+            self.command_runner = CommandInterceptor()
+            self.selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
+            kernel_updater = kernelupdater.KernelUpdater(config_file=config_file,
+                                                         a_selected_kernel=self.selected_kernel,
+                                                         a_command_runner=self.command_runner,
+                                                         kernel_root_dir=self.kernel_root_dir,
+                                                         modules_root_dir=self.modules_root_dir,
+                                                         grub_root_dir=self.grub_root_dir,
+                                                         module_rebuilder=self.module_rebuilder,
+                                                         journal=Journal(journal_file))
+            kernel_updater.update_kernel()
+            commands_by_run.append(self.command_runner.commands)
+
+        self.assertEqual(7, len(commands_by_run[0]))
+        self.assertEqual([], commands_by_run[1])
+        self.assertTrue(os.path.exists(self.grub_root_dir + "/vmlinuz-4.14.10-gentoo.old"))
+
+    def test_prebuilt_kernel_is_only_installed_once_selected(self):
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.8-gentoo-r1")
+        config_file = self.kernel_root_dir + "/linux-4.14.8-gentoo-r1/.config"
+        with open(config_file, "w") as a_file:
+            a_file.write("CONFIG_64BIT=y\n")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.10-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.8-gentoo-r1", self.kernel_root_dir + "/linux")
+        journal_file = self.temp_root_dir + "/journal.json"
+
+        prebuild_command_runner = CommandInterceptor()
+        kernelupdater.KernelUpdater(config_file=config_file,
+                                    a_selected_kernel=kernelupdater.SelectedKernel(
+                                        kernel_dir=self.kernel_root_dir + "/linux-4.14.10-gentoo"),
+                                    a_command_runner=prebuild_command_runner, kernel_root_dir=self.kernel_root_dir,
+                                    modules_root_dir=self.modules_root_dir, grub_root_dir=self.grub_root_dir,
+                                    module_rebuilder=self.module_rebuilder,
+                                    journal=Journal(journal_file)).prebuild_kernel()
+        os.remove(self.kernel_root_dir + "/linux")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo", self.kernel_root_dir + "/linux")
+        self.command_runner = CommandInterceptor()
+        kernelupdater.KernelUpdater(config_file=config_file,
+                                    a_selected_kernel=kernelupdater.SelectedKernel(
+                                        kernel_root_dir=self.kernel_root_dir),
+                                    a_command_runner=self.command_runner, kernel_root_dir=self.kernel_root_dir,
+                                    modules_root_dir=self.modules_root_dir, grub_root_dir=self.grub_root_dir,
+                                    module_rebuilder=self.module_rebuilder,
+                                    journal=Journal(journal_file)).update_kernel()
+
+        self.assertEqual(2, len(prebuild_command_runner.commands))
+        for command in prebuild_command_runner.commands:
+            self.assertIn("make -C " + self.kernel_root_dir + "/linux-4.14.10-gentoo", command)
+        self.assertEqual(5, len(self.command_runner.commands))
+        self.assertNotIn("olddefconfig", " ".join(self.command_runner.commands))
+        self.assertIn("install", self.command_runner.commands[0])
+
+    def test_cache_statistics_only_follow_a_build(self):
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.8-gentoo-r1")
+        config_file = self.kernel_root_dir + "/linux-4.14.8-gentoo-r1/.config"
+        with open(config_file, "w") as a_file:
+            a_file.write("CONFIG_64BIT=y\n")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.10-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo",
+                   self.kernel_root_dir + "/linux")
+        journal_file = self.temp_root_dir + "/journal.json"
+
+        commands_by_run = []
+        for _ in range(2):
+            # the statistics failing does not fail the upgrade
+            self.command_runner = StatisticsFailingInterceptor()
+            kernel_updater = kernelupdater.KernelUpdater(config_file=config_file,
+                                                         a_selected_kernel=kernelupdater.SelectedKernel(
+                                                             kernel_root_dir=self.kernel_root_dir),
+                                                         a_command_runner=self.command_runner,
+                                                         kernel_root_dir=self.kernel_root_dir,
+                                                         modules_root_dir=self.modules_root_dir,
+                                                         grub_root_dir=self.grub_root_dir,
+                                                         module_rebuilder=self.module_rebuilder,
+                                                         build_cache=BuildCache(self.command_runner,
+                                                                                cache_dir=self.temp_root_dir
+                                                                                + "/ccache"),
+                                                         journal=Journal(journal_file))
+            kernel_updater.update_kernel()
+            commands_by_run.append(self.command_runner.commands)
+
+        self.assertIn("ccache --zero-stats", commands_by_run[0])
+        self.assertEqual("ccache --print-stats", commands_by_run[0][-1])
+        self.assertEqual([], commands_by_run[1])
+
+    def test_reconciled_config_is_cached_per_version_pair(self):
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.8-gentoo-r1")
+        config_file = self.kernel_root_dir + "/linux-4.14.8-gentoo-r1/.config"
+        with open(config_file, "w") as a_file:
+            a_file.write("CONFIG_64BIT=y\nCONFIG_OLD=y\n")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.10-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo",
+                   self.kernel_root_dir + "/linux")
+        config_diff_cache = ConfigDiffCache(self.temp_root_dir + "/config-diffs")
+
+        commands_by_run = []
+        for _ in range(2):
+            self.command_runner = OlddefconfigInterceptor(self.kernel_root_dir + "/linux-4.14.10-gentoo/.config")
+            self.selected_kernel = kernelupdater.SelectedKernel(kernel_root_dir=self.kernel_root_dir)
+            kernel_updater = kernelupdater.KernelUpdater(config_file=config_file,
+                                                         a_selected_kernel=self.selected_kernel,
+                                                         a_command_runner=self.command_runner,
+                                                         kernel_root_dir=self.kernel_root_dir,
+                                                         modules_root_dir=self.modules_root_dir,
+                                                         grub_root_dir=self.grub_root_dir,
+                                                         module_rebuilder=self.module_rebuilder,
+                                                         config_diff_cache=config_diff_cache)
+            kernel_updater.copy_config_file()
+            kernel_updater.reconcile_config()
+            commands_by_run.append(self.command_runner.commands)
+
+        self.assertEqual(1, len(commands_by_run[0]))
+        self.assertIn("olddefconfig", commands_by_run[0][0])
+        self.assertEqual([], commands_by_run[1])
+        with open(self.kernel_root_dir + "/linux-4.14.10-gentoo/.config") as a_file:
+            self.assertEqual("CONFIG_64BIT=y\n# CONFIG_OLD is not set\nCONFIG_NEW=m\n", a_file.read())
+        config_diff = config_diff_cache.get(ConfigDiffCache.get_key(
+            "4.14.8-gentoo-r1", "4.14.10-gentoo", get_file_hash(config_file), "olddefconfig"))[0]
+        self.assertEqual({"CONFIG_NEW": "m"}, config_diff.added)
+        self.assertEqual({"CONFIG_OLD": ["y", "n"]}, config_diff.changed)
+
 # INSTALL net/netfilter/xt_LOG.ko
 #   INSTALL net/netfilter/xt_addrtype.ko
 #   INSTALL net/netfilter/xt_mark.ko
@@ -250,9 +456,28 @@ class CommandInterceptor(kernelupdater.CommandRunner):
     def __init__(self):
         self.commands = []
 
-    def run_command(self, command_array, comment=""):
+    def run_command(self, command_array, comment="", env=None):
         self.commands.append(" ".join(command_array))
 
 
+class StatisticsFailingInterceptor(CommandInterceptor):
+    def run_command(self, command_array, comment="", env=None):
+        CommandInterceptor.run_command(self, command_array, comment, env)
+        if "--print-stats" in command_array:
+            raise kernelupdater.CommandFailedError(kernelupdater.CommandResult(command_array, comment, 1, 0, 0, 0, 0,
+                                                                               0, []))
+
+
+class OlddefconfigInterceptor(CommandInterceptor):
+    def __init__(self, config_path):
+        CommandInterceptor.__init__(self)
+        self.config_path = config_path
+
+    def run_command(self, command_array, comment="", env=None):
+        CommandInterceptor.run_command(self, command_array, comment, env)
+        with open(self.config_path, "w") as a_file:
+            a_file.write("CONFIG_64BIT=y\n# CONFIG_OLD is not set\nCONFIG_NEW=m\n")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+import os
+import unittest
+from tempfile import mkdtemp
+from kernelupdater import CommandRunner
+from kernelupdater.jobs import JobsPlan
+from kernelupdater.modules import ModuleRebuilder, get_emerge_durations
+
+
+def write(fname, content, mode='w'):
+    if not os.path.isdir(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    with open(fname, mode) as a_file:
+        a_file.write(content)
+
+
+class EmergeInterceptor(CommandRunner):
+    def __init__(self, emerge_log_file):
+        self.commands = []
+        self.emerge_log_file = emerge_log_file
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(command_array)
+        write(self.emerge_log_file, "1518000000:  >>> emerge (1 of 1) app-emulation/virtualbox-modules-5.2.6 to /\n"
+                                    "1518000095:  ::: completed emerge (1 of 1) app-emulation/virtualbox-modules-5.2.6"
+                                    " to /\n", 'a')
+
+
+class ModuleRebuilderTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.vdb_dir = self.root_dir + "/var/db/pkg"
+        self.modules_root_dir = self.root_dir + "/lib/modules"
+        self.emerge_log_file = self.root_dir + "/emerge.log"
+        self.add_package("x11-drivers/nvidia-drivers-390.25", "4.14.12-gentoo", "video/nvidia.ko")
+        self.add_package("app-emulation/virtualbox-modules-5.2.6", "4.14.10-gentoo", "misc/vboxdrv.ko")
+        self.add_package("sys-kernel/gentoo-kernel-4.14.12", "4.14.12-gentoo", "kernel/fs/ext4/ext4.ko")
+        write(self.vdb_dir + "/app-editors/vim-8.0/CONTENTS", "obj /usr/bin/vim 0123 1518000000\n")
+        write(self.emerge_log_file, "1517000000:  >>> emerge (1 of 1) x11-drivers/nvidia-drivers-390.25 to /\n"
+                                    "1517000300:  ::: completed emerge (1 of 1) x11-drivers/nvidia-drivers-390.25"
+                                    " to /\n")
+        self.module_rebuilder = ModuleRebuilder(vdb_dir=self.vdb_dir, emerge_log_file=self.emerge_log_file)
+
+    def add_package(self, cpv, release, module):
+        module_file = self.modules_root_dir + "/" + release + "/" + module
+        write(module_file, "\0vermagic=" + release + " SMP mod_unload \0", 'w')
+        write(self.vdb_dir + "/" + cpv + "/CONTENTS", "dir " + self.modules_root_dir + "\n"
+                                                      "obj " + module_file + " 0123 1518000000\n")
+
+    def test_skips_the_packages_built_for_the_release(self):
+        packages, up_to_date_packages = self.module_rebuilder.get_packages_to_rebuild(self.modules_root_dir,
+                                                                                      "4.14.12-gentoo")
+
+        self.assertEqual(["app-emulation/virtualbox-modules-5.2.6"], [package.cpv for package in packages])
+        self.assertEqual(["x11-drivers/nvidia-drivers-390.25"], [package.cpv for package in up_to_date_packages])
+
+    def test_rebuilds_a_module_built_for_another_release(self):
+        write(self.modules_root_dir + "/4.14.12-gentoo/video/nvidia.ko", "\0vermagic=4.14.10-gentoo SMP \0")
+
+        packages, _ = self.module_rebuilder.get_packages_to_rebuild(self.modules_root_dir, "4.14.12-gentoo")
+
+        self.assertEqual(["app-emulation/virtualbox-modules-5.2.6", "x11-drivers/nvidia-drivers-390.25"],
+                         [package.cpv for package in packages])
+
+    def test_rebuilds_the_modules_older_than_a_rebuild_of_the_same_release(self):
+        os.makedirs(self.root_dir + "/build")
+        os.symlink(self.root_dir + "/build", self.modules_root_dir + "/4.14.12-gentoo/build")
+        write(self.root_dir + "/build/Module.symvers", "symbols")
+        module_time = os.path.getmtime(self.modules_root_dir + "/4.14.12-gentoo/video/nvidia.ko")
+        os.utime(self.root_dir + "/build/Module.symvers", (module_time + 60, module_time + 60))
+
+        packages, up_to_date_packages = self.module_rebuilder.get_packages_to_rebuild(self.modules_root_dir,
+                                                                                      "4.14.12-gentoo")
+
+        self.assertEqual(["app-emulation/virtualbox-modules-5.2.6", "x11-drivers/nvidia-drivers-390.25"],
+                         [package.cpv for package in packages])
+        self.assertEqual([], up_to_date_packages)
+
+    def test_rebuild_runs_one_parallel_emerge(self):
+        command_runner = EmergeInterceptor(self.emerge_log_file)
+
+        self.module_rebuilder.rebuild(command_runner, self.modules_root_dir, "4.14.12-gentoo",
+                                      JobsPlan(8, 4.0, "cpus", {}))
+
+        self.assertEqual([["emerge", "-1q", "--jobs=2", "--load-average=4", "@x11-module-rebuild",
+                           "=app-emulation/virtualbox-modules-5.2.6"]], command_runner.commands)
+
+    def test_falls_back_to_the_set_without_package_database(self):
+        module_rebuilder = ModuleRebuilder(vdb_dir=self.root_dir + "/none")
+
+        packages, _ = module_rebuilder.get_packages_to_rebuild(self.modules_root_dir, "4.14.12-gentoo")
+
+        self.assertEqual(["emerge", "-1q", "@x11-module-rebuild", "@module-rebuild"],
+                         module_rebuilder.get_command(packages, None))
+
+    def test_emerge_durations_only_count_the_new_lines(self):
+        offset = os.path.getsize(self.emerge_log_file)
+        EmergeInterceptor(self.emerge_log_file).run_command(["emerge"])
+
+        self.assertEqual({"app-emulation/virtualbox-modules-5.2.6": 95},
+                         get_emerge_durations(self.emerge_log_file, offset))
@@ -0,0 +1,107 @@
+import os
+import json
+import unittest
+from tempfile import mkdtemp
+import kernelupdater
+from kernelupdater.journal import Journal
+from kernelupdater.jobs import JobsPlan
+from kernelupdater.modules import ModuleRebuilder
+from kernelupdater.plan import Plan, PlannedStep
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class CommandInterceptor(kernelupdater.CommandRunner):
+    def __init__(self):
+        self.commands = []
+
+    def run_command(self, command_array, comment="", env=None):
+        self.commands.append(" ".join(command_array))
+
+
+class PlanTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_root_dir = mkdtemp()
+        self.kernel_root_dir = self.temp_root_dir + "/kernels"
+        self.modules_root_dir = self.temp_root_dir + "/modules"
+        self.grub_root_dir = self.temp_root_dir + "/grub"
+        for release in ["4.13.16-gentoo", "4.14.8-gentoo-r1", "4.14.10-gentoo"]:
+            os.makedirs(self.kernel_root_dir + "/linux-" + release)
+        os.makedirs(self.kernel_root_dir + "/linux-4.13.16-gentoo/kernel")
+        write(self.kernel_root_dir + "/linux-4.13.16-gentoo/kernel/fork.c", "x" * 1000)
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo", self.kernel_root_dir + "/linux")
+        os.makedirs(self.modules_root_dir + "/4.13.16-gentoo")
+        write(self.modules_root_dir + "/4.13.16-gentoo/modules.dep", "x" * 200)
+        os.makedirs(self.grub_root_dir)
+        write(self.grub_root_dir + "/vmlinuz-4.13.16-gentoo", "x" * 30)
+        self.config_file = self.kernel_root_dir + "/linux-4.14.8-gentoo-r1/.config"
+        write(self.config_file, "CONFIG_64BIT=y\n")
+        self.journal = Journal(self.temp_root_dir + "/journal.json")
+
+    def create_kernel_updater(self, command_runner):
+        return kernelupdater.KernelUpdater(config_file=self.config_file,
+                                           a_selected_kernel=kernelupdater.SelectedKernel(self.kernel_root_dir),
+                                           a_command_runner=command_runner, kernel_root_dir=self.kernel_root_dir,
+                                           modules_root_dir=self.modules_root_dir, grub_root_dir=self.grub_root_dir,
+                                           jobs_plan=JobsPlan(4, 4.0, "cpus", {}), journal=self.journal,
+                                           module_rebuilder=ModuleRebuilder(
+                                               vdb_dir=self.temp_root_dir + "/vdb",
+                                               emerge_log_file=self.temp_root_dir + "/emerge.log"))
+
+    def test_plan_changes_nothing(self):
+        command_interceptor = CommandInterceptor()
+
+        plan = self.create_kernel_updater(command_interceptor).create_plan()
+
+        self.assertEqual([], command_interceptor.commands)
+        self.assertTrue(os.path.exists(self.kernel_root_dir + "/linux-4.13.16-gentoo"))
+        self.assertFalse(os.path.exists(self.kernel_root_dir + "/linux-4.14.10-gentoo/.config"))
+        self.assertFalse(os.path.exists(self.temp_root_dir + "/journal.json"))
+
+        commands = dict((step.name, [" ".join(command) for command in step.commands]) for step in plan.steps)
+        self.assertEqual(["make -C " + self.kernel_root_dir + "/linux-4.14.10-gentoo -j4 -l4"],
+                         commands["build_kernel"])
+        self.assertEqual(["emerge -C =gentoo-sources-4.13.16"], commands["clean_old_kernels"])
+        self.assertEqual([("modules", self.modules_root_dir + "/4.13.16-gentoo", 200),
+                          ("sources", self.kernel_root_dir + "/linux-4.13.16-gentoo", 1000),
+                          ("boot file", self.grub_root_dir + "/vmlinuz-4.13.16-gentoo", 30)],
+                         [(removal.kind, removal.path, removal.size) for removal in plan.removals])
+        self.assertEqual(1230, json.loads(plan.to_json())["freed_bytes"])
+
+    def test_plan_after_run_skips_and_estimates(self):
+        self.create_kernel_updater(CommandInterceptor()).update_kernel()
+        self.journal.record("build_kernel", self.journal.get_completed_inputs("build_kernel"), 0, 600)
+
+        plan = self.create_kernel_updater(CommandInterceptor()).create_plan()
+        forced_plan = self.create_kernel_updater(CommandInterceptor()).create_plan(force=True)
+
+        skip_reasons = dict((step.name, step.skip_reason) for step in plan.steps)
+        self.assertEqual("up to date", skip_reasons["build_kernel"])
+        self.assertIsNone(skip_reasons["clean_old_kernels"])
+        self.assertEqual([], plan.removals)
+        self.assertLess(plan.get_estimated_seconds(), 1)
+        self.assertEqual([None], [step.skip_reason for step in forced_plan.steps if step.name == "build_kernel"])
+        self.assertIn("build_kernel: 10m00s", forced_plan.describe())
+        self.assertLess(600, forced_plan.get_estimated_seconds())
+
+    def test_estimate_is_unknown_without_journal(self):
+        self.journal = None
+
+        plan = self.create_kernel_updater(CommandInterceptor()).create_plan()
+
+        self.assertEqual([None], [step.estimated_seconds for step in plan.steps if step.name == "build_kernel"])
+        self.assertTrue(plan.has_unknown_durations())
+
+
+class PlanEstimateTest(unittest.TestCase):
+    def test_estimate_is_longest_chain_unless_serial(self):
+        for serial, expected_seconds in [(False, 70), (True, 100)]:
+            plan = Plan("4.14.10-gentoo", None, serial)
+            plan.add_step(PlannedStep("build", [], [], None, 60))
+            plan.add_step(PlannedStep("clean", [], [], None, 30))
+            plan.add_step(PlannedStep("grub", ["build", "clean"], [], None, 10))
+
+            self.assertEqual(expected_seconds, plan.get_estimated_seconds())
@@ -0,0 +1,35 @@
+import json
+import os
+import unittest
+from tempfile import mkdtemp
+import kernelupdater
+from kernelupdater.profiling import Profiler
+from kernelupdater.scheduler import StepScheduler
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_steps_and_commands_are_reported(self):
+        profiler = Profiler(run_info={"kernel": "4.14.10-gentoo"})
+        command_runner = kernelupdater.CommandRunner(profiler=profiler)
+        scheduler = StepScheduler(profiler=profiler)
+        scheduler.add_step("build_kernel", lambda: command_runner.run_command(["sh", "-c", "sleep 0.05"]))
+        scheduler.add_step("clean_old_kernels", lambda: profiler.count("bytes_deleted", 1234), ["build_kernel"])
+        scheduler.run()
+
+        report_file = mkdtemp() + "/profile.json"
+        profiler.write_report(report_file)
+        with open(report_file) as a_file:
+            report = json.load(a_file)
+
+        events = dict((event["name"], event) for event in report["traceEvents"] if event["ph"] == "X")
+        self.assertEqual(["build_kernel", "clean_old_kernels", "sh -c sleep 0.05"], sorted(events))
+        self.assertEqual("command", events["sh -c sleep 0.05"]["cat"])
+        self.assertEqual(1234, events["clean_old_kernels"]["args"]["bytes_deleted"])
+        self.assertGreaterEqual(events["build_kernel"]["dur"], 50000)
+        self.assertEqual("build_kernel", report["summary"]["slowest_step"])
+        self.assertEqual("4.14.10-gentoo", report["summary"]["run"]["kernel"])
+        self.assertFalse(os.path.exists(report_file + ".tmp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from kernelupdater.inventory import KernelInventory
+from kernelupdater.retention import RetentionPolicy, get_default_boot_release
+from kernelupdater.version import KernelVersion
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class RetentionPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = mkdtemp()
+        self.kernel_root_dir = self.root_dir + "/src"
+        self.modules_root_dir = self.root_dir + "/modules"
+        self.boot_dir = self.root_dir + "/boot"
+        os.makedirs(self.boot_dir + "/grub")
+        os.makedirs(self.modules_root_dir)
+        for release in ["4.9.90-gentoo", "4.9.95-gentoo", "4.14.8-gentoo", "4.14.10-gentoo", "4.14.12-gentoo",
+                        "4.15.1-gentoo"]:
+            os.makedirs(self.kernel_root_dir + "/linux-" + release)
+            write(self.boot_dir + "/vmlinuz-" + release, "x" * 1024)
+        self.inventory = KernelInventory(self.kernel_root_dir, self.modules_root_dir, self.boot_dir)
+        self.selected_version = KernelVersion.parse("4.14.12-gentoo")
+
+    def select(self, **policy_options):
+        policy_options.setdefault("protected_releases", {})
+        report = RetentionPolicy(**policy_options).select(self.inventory, self.selected_version)
+        return [version.release for version in report.to_remove], report
+
+    def test_default_keeps_selected_previous_and_newer(self):
+        removed, report = self.select()
+
+        self.assertEqual(["4.9.90-gentoo", "4.9.95-gentoo", "4.14.8-gentoo"], removed)
+        self.assertEqual(3 * 1024, report.boot_bytes_reclaimed)
+
+    def test_protected_and_per_series(self):
+        removed, _ = self.select(keep_per_series=1, prune_newer=True, protected_releases={"4.9.90-gentoo": "running"})
+
+        self.assertEqual(["4.14.8-gentoo"], removed)
+
+    def test_prune_newer(self):
+        removed, _ = self.select(prune_newer=True)
+
+        self.assertEqual(["4.9.90-gentoo", "4.9.95-gentoo", "4.14.8-gentoo", "4.15.1-gentoo"], removed)
+
+    @mock.patch("os.statvfs", return_value=mock.Mock(f_bavail=0, f_frsize=4096))
+    def test_min_boot_free_removes_oldest_kept(self, statvfs):
+        removed, report = self.select(keep_last=4, min_boot_free_mb=3.5 * 1024 / 1048576)
+
+        self.assertEqual(["4.9.90-gentoo", "4.9.95-gentoo", "4.14.8-gentoo", "4.14.10-gentoo"], removed)
+        self.assertIn(("4.15.1-gentoo", "newer than the selected kernel"),
+                      [(version.release, reason) for version, reason in report.kept])
+
+    @mock.patch("os.statvfs", return_value=mock.Mock(f_bavail=0, f_frsize=4096))
+    def test_min_boot_free_keeps_the_newer_kernels(self, statvfs):
+        removed, report = self.select(min_boot_free_mb=100)
+
+        self.assertEqual(["4.9.90-gentoo", "4.9.95-gentoo", "4.14.8-gentoo", "4.14.10-gentoo"], removed)
+        self.assertEqual([("4.15.1-gentoo", "newer than the selected kernel"), ("4.14.12-gentoo", "selected")],
+                         [(version.release, reason) for version, reason in report.kept])
+
+    def test_oldest_archives_are_removed(self):
+        archived_versions = [KernelVersion.parse(release) for release in ["4.9.95-gentoo", "4.9.90-gentoo",
+                                                                          "4.14.8-gentoo"]]
+
+        self.assertEqual(["4.9.90-gentoo"], [version.release for version in
+                                             RetentionPolicy(keep_archives=2).select_archives(archived_versions)])
+        self.assertEqual([], RetentionPolicy().select_archives(archived_versions))
+
+    def test_default_boot_release_from_grubenv(self):
+        write(self.boot_dir + "/grub/grubenv", "# GRUB Environment Block\n"
+                                               "saved_entry=gnulinux-4.14.10-gentoo-advanced-1234\n")
+
+        self.assertEqual("4.14.10-gentoo",
+                         get_default_boot_release(self.boot_dir, ["4.14.1-gentoo", "4.14.10-gentoo", "4.14.10"]))
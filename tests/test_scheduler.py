@@ -0,0 +1,51 @@
+import threading
+import unittest
+from kernelupdater.scheduler import StepScheduler
+
+
+class StepSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def record(self, name):
+        return lambda: self.calls.append(name)
+
+    def test_serial_run_keeps_declaration_order(self):
+        scheduler = StepScheduler()
+        scheduler.add_step("a", self.record("a"))
+        scheduler.add_step("c", self.record("c"))
+        scheduler.add_step("b", self.record("b"), ["a"])
+
+        scheduler.run(serial=True)
+
+        self.assertEqual(["a", "c", "b"], self.calls)
+
+    def test_independent_steps_run_at_the_same_time(self):
+        both_started = threading.Barrier(2, timeout=5)
+        scheduler = StepScheduler()
+        scheduler.add_step("first", both_started.wait)
+        scheduler.add_step("second", both_started.wait)
+        scheduler.add_step("last", self.record("last"), ["first", "second"])
+
+        scheduler.run()
+
+        self.assertEqual(["last"], self.calls)
+
+    def test_failure_stops_dependent_steps(self):
+        def fail():
+            raise RuntimeError("make failed")
+
+        scheduler = StepScheduler()
+        scheduler.add_step("build", fail)
+        scheduler.add_step("install", self.record("install"), ["build"])
+
+        self.assertRaises(RuntimeError, scheduler.run)
+        self.assertEqual([], self.calls)
+
+    def test_unknown_dependency_is_rejected(self):
+        scheduler = StepScheduler()
+        self.assertRaises(ValueError, scheduler.add_step, "install", self.record("install"), ["build"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.inventory import KernelInventory
+from kernelupdater.version import KernelVersion
+
+
+def touch(fname, times=None):
+    with open(fname, 'a'):
+        os.utime(fname, times)
+
+
+class KernelVersionTest(unittest.TestCase):
+    def test_versions_are_ordered(self):
+        names = ["linux-4.14.10-gentoo", "4.9.1-gentoo", "linux-4.14.8-gentoo-r1", "4.15-rc3", "4.14.8-gentoo",
+                 "4.15.0-gentoo"]
+
+        versions = sorted(KernelVersion.parse(name) for name in names)
+
+        self.assertEqual(["4.9.1-gentoo", "4.14.8-gentoo", "4.14.8-gentoo-r1", "4.14.10-gentoo", "4.15-rc3",
+                          "4.15.0-gentoo"], [version.release for version in versions])
+
+    def test_suffixes(self):
+        self.assertEqual("gentoo-x86_64", KernelVersion.parse("5.10.1-gentoo-x86_64").local)
+        self.assertEqual("=gentoo-kernel-6.1.2", KernelVersion.parse("6.1.2-gentoo-dist").get_package_atom())
+        self.assertEqual("=gentoo-sources-4.14.8-r1", KernelVersion.parse("4.14.8-gentoo-r1").get_package_atom())
+        self.assertEqual("4.15_rc3", KernelVersion.parse("linux-4.15-rc3").get_package_version())
+        self.assertEqual("=vanilla-sources-4.15_rc3", KernelVersion.parse("4.15.0-rc3").get_package_atom())
+        self.assertEqual("=gentoo-sources-4.15.0", KernelVersion.parse("4.15.0-gentoo").get_package_atom())
+        self.assertEqual("4.14", KernelVersion.parse("linux-4.14.8-gentoo-r1").get_series())
+        self.assertIsNone(KernelVersion.try_parse("linux-headers"))
+
+    def test_versions_are_hashable_and_parsed_once(self):
+        self.assertIs(KernelVersion.parse("4.14.8-gentoo"), KernelVersion.parse("4.14.8-gentoo"))
+        self.assertEqual(1, len(set([KernelVersion.parse("linux-4.14.8-gentoo"),
+                                     KernelVersion.parse("4.14.8-gentoo")])))
+
+
+class KernelInventoryTest(unittest.TestCase):
+    def test_sources_modules_and_boot_files_are_cross_referenced(self):
+        root_dir = mkdtemp()
+        for a_dir in ["/src/linux-4.14.8-gentoo-r1", "/src/linux-4.14.10-gentoo", "/src/lost+found",
+                      "/modules/4.14.8-gentoo-r1", "/modules/4.13.16-gentoo", "/boot"]:
+            os.makedirs(root_dir + a_dir)
+        os.symlink("linux-4.14.10-gentoo", root_dir + "/src/linux")
+        touch(root_dir + "/boot/vmlinuz-4.14.8-gentoo-r1")
+        touch(root_dir + "/boot/System.map-4.13.16-gentoo")
+
+        inventory = KernelInventory(root_dir + "/src", root_dir + "/modules", root_dir + "/boot")
+
+        self.assertEqual(["4.13.16-gentoo", "4.14.8-gentoo-r1", "4.14.10-gentoo"],
+                         [version.release for version in inventory.get_versions()])
+        self.assertEqual(["4.14.8-gentoo-r1", "4.14.10-gentoo"],
+                         [version.release for version in inventory.get_source_versions()])
+        self.assertEqual([KernelVersion.parse("4.14.8-gentoo-r1")], inventory.get_boot_versions())
+        entry = inventory.get_entry(KernelVersion.parse("4.13.16-gentoo"))
+        self.assertIsNone(entry.source_dir)
+        self.assertEqual(root_dir + "/modules/4.13.16-gentoo", entry.modules_dir)
+        self.assertEqual(["System.map-4.13.16-gentoo"], [artifact.name for artifact in entry.boot_artifacts])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import unittest
+from tempfile import mkdtemp
+from kernelupdater.watch import InotifyWatcher, PollingWatcher, SourceWatcher
+
+
+def write(fname, content):
+    with open(fname, 'w') as a_file:
+        a_file.write(content)
+
+
+class SourceWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.kernel_root_dir = mkdtemp()
+        self.state_file = mkdtemp() + "/watch.json"
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.10-gentoo")
+        os.symlink(self.kernel_root_dir + "/linux-4.14.10-gentoo", self.kernel_root_dir + "/linux")
+
+    def create_source_watcher(self, settle_timeout=60):
+        return SourceWatcher(self.kernel_root_dir, state_file=self.state_file, settle_seconds=0, poll_interval=0,
+                             settle_timeout=settle_timeout, max_attempts=2)
+
+    def test_only_trees_merged_after_the_first_start_are_new(self):
+        self.create_source_watcher()
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.12-gentoo")
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.11-gentoo")
+        os.mkdir(self.kernel_root_dir + "/not-a-kernel")
+
+        source_watcher = self.create_source_watcher()
+
+        self.assertEqual(["linux-4.14.11-gentoo", "linux-4.14.12-gentoo"], source_watcher.get_new_trees())
+        self.assertEqual("linux-4.14.12-gentoo", source_watcher.wait_for_new_tree())
+        source_watcher.mark_known("linux-4.14.12-gentoo")
+        self.assertEqual(["linux-4.14.11-gentoo"], self.create_source_watcher().get_new_trees())
+
+    def test_prebuilt_releases_are_kept_until_confirmed(self):
+        source_watcher = self.create_source_watcher()
+        source_watcher.record_prebuilt("4.14.12-gentoo", "/usr/src/linux-4.14.10-gentoo/.config")
+        source_watcher.record_prebuilt("4.14.9-gentoo", "/usr/src/linux-4.14.10-gentoo/.config")
+
+        self.assertEqual(["4.14.12-gentoo", "4.14.9-gentoo"], self.create_source_watcher().get_prebuilt_releases())
+        source_watcher.forget_prebuilt("4.14.12-gentoo")
+        self.assertEqual(["4.14.9-gentoo"], self.create_source_watcher().get_prebuilt_releases())
+
+    def test_tree_settles_once_merged(self):
+        tree_dir = self.kernel_root_dir + "/linux-4.14.12-gentoo"
+        os.mkdir(tree_dir)
+        write(tree_dir + "/Makefile", "VERSION = 4\n")
+
+        self.assertTrue(self.create_source_watcher().wait_until_settled(tree_dir))
+        self.assertFalse(self.create_source_watcher().wait_until_settled(self.kernel_root_dir + "/linux-4.15.1"))
+
+    def test_tree_without_makefile_is_given_up(self):
+        tree_dir = self.kernel_root_dir + "/linux-4.14.12-gentoo"
+        os.mkdir(tree_dir)
+
+        self.assertFalse(self.create_source_watcher(settle_timeout=0).wait_until_settled(tree_dir))
+
+    def test_failed_prebuilds_are_retried_up_to_the_limit(self):
+        self.create_source_watcher()
+        os.mkdir(self.kernel_root_dir + "/linux-4.14.13-gentoo")
+
+        self.assertTrue(self.create_source_watcher().record_failure("linux-4.14.13-gentoo"))
+        self.assertEqual(["linux-4.14.13-gentoo"], self.create_source_watcher().get_new_trees())
+        self.assertFalse(self.create_source_watcher().record_failure("linux-4.14.13-gentoo"))
+        self.assertEqual([], self.create_source_watcher().get_new_trees())
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+        os.mkdir(self.directory + "/linux-4.14.10-gentoo")
+
+    def test_inotify_reports_new_directories(self):
+        try:
+            watcher = InotifyWatcher(self.directory)
+        except (OSError, AttributeError):
+            self.skipTest("inotify is not available")
+        try:
+            write(self.directory + "/a-file", "")
+            os.mkdir(self.directory + "/linux-4.14.12-gentoo")
+
+            self.assertEqual(["linux-4.14.12-gentoo"], watcher.wait(1))
+            self.assertEqual([], watcher.wait(0))
+        finally:
+            watcher.close()
+
+    def test_polling_reports_new_directories(self):
+        watcher = PollingWatcher(self.directory, 0)
+        write(self.directory + "/a-file", "")
+        os.mkdir(self.directory + "/linux-4.14.12-gentoo")
+
+        self.assertEqual(["linux-4.14.12-gentoo"], watcher.wait(0))
+        self.assertEqual([], watcher.wait(0))